@@ -93,25 +93,29 @@ class InwNGN(MessagePassing):
         x = x
         return self.propagate(edge_index, x=x)
 
+    def edge_weights(self, rows, device):
+        """weights [E, 3] repeated over the rows//E graphs of a batch, as float32 on device,
+        cached per batch size and device instead of rebuilt at every message call, and rebuilt
+        when self.weights is reassigned or modified in place."""
+        key = (rows, str(device))
+        state = (self.weights._version, self.weights.data_ptr())
+        tiles = self.__dict__.setdefault('tiles', {})
+        if key in tiles:
+            source, cached_state, tile = tiles[key]
+            if source is self.weights and cached_state == state:
+                return tile
+        w = self.weights.detach().to(device=device, dtype=torch.float32)
+        tiles[key] = (self.weights, state, w.repeat(rows//w.shape[0], 1))
+        return tiles[key][2]
+
     def message(self, x_i, x_j):
         tmp = torch.cat([x_i[:,0], x_j[:,0]])
         tmp = tmp.reshape(2,-1)
         tmp = tmp.t()
-        Len = int(tmp.shape[0])/int(self.weights.shape[0])
-        w = self.weights.repeat(int(Len),1)
-        w = w.clone().detach()
-        w = w.to(torch.float32)
-        w = w.to(device)
+        w = self.edge_weights(tmp.shape[0], tmp.device)
 
         #Tmp = tmp[:,1]-tmp[:,0]
 
-        tmp1 = torch.cat([tmp[:,1].reshape(-1,1),w[:,0].reshape(-1,1)],dim=1)
-        tmp2 = torch.cat([tmp[:,1].reshape(-1,1),w[:,1].reshape(-1,1)],dim=1)
-        tmp3 = torch.cat([tmp[:,1].reshape(-1,1),w[:,2].reshape(-1,1)],dim=1)
-        w1 = torch.zeros_like(w)
-        w1[w != 0] = 1
-        w1 = w1.to(torch.float32)
-        w1 = w1.to(device)
         return self.msg_fnc_ret(tmp)*w[:,0].reshape(-1,1) + self.msg_fnc_ant(tmp)*w[:,1].reshape(-1,1) + self.msg_fnc_euc(tmp)*w[:,2].reshape(-1,1)
         #return self.msg_fnc_ret(tmp1)*w1[:,0].reshape(-1,1)+ self.msg_fnc_ant(tmp2)*w1[:,1].reshape(-1,1) + self.msg_fnc_euc(tmp3)*w1[:,2].reshape(-1,1)
         #return self.msg_fnc_ret(tmp) + self.msg_fnc_ant(tmp) + self.msg_fnc_euc(tmp)
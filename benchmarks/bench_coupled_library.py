@@ -0,0 +1,74 @@
+"""Benchmark of the coupled library on 10^6 edge samples.
+
+Compares the shared-subexpression evaluation of Interaction_func.ElementaryFunctions_Array
+with an unshared reference evaluating every column from scratch (the way the library
+was built before: xi*xj, xj-xi, exp(xj), sigmoid(xj) ... recomputed for each column,
+tanh through four calls of np.exp).
+
+usage: python benchmarks/bench_coupled_library.py [number of edges] [repeats]
+"""
+
+import os
+import sys
+import time
+import warnings
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'utils'))
+import Interaction_func
+
+def sigmoidfun(x, alpha, beta):
+    return 1/(1+np.exp(-alpha*(x-beta)))
+
+def tangentH(x):
+    return (np.exp(x)-np.exp(-x))/(np.exp(x)+np.exp(-x))
+
+def Hill_func(x, gamma):
+    return (x**gamma)/(x**gamma+1)
+
+def unshared_library(xi, xj, PolyOrder=2):
+    columns = [xj, xi*xj, xj-xi]
+    for order in range(2, PolyOrder+1):
+        columns += [xj**order, (xi*xj)**order, (xj-xi)**order]
+    columns += [np.sin(xj), np.sin(xi*xj), np.sin(xj-xi), xi*np.sin(xj)]
+    columns += [np.exp(xj), np.exp(xi*xj), np.exp(xj-xi), xi*np.exp(xj)]
+    columns += [1/xj, 1/(xi*xj), 1/((xj-xi)+1e-5), xi/(xj+1e-5)]
+    for alpha, beta in ((1, 0), (10, 1)):
+        columns += [sigmoidfun(xj, alpha, beta), sigmoidfun(xi*xj, alpha, beta),
+                    sigmoidfun(xj-xi, alpha, beta), sigmoidfun(xj, alpha, beta)*xi]
+    columns += [tangentH(xj), tangentH(xi*xj), tangentH(xj-xi), tangentH(xj)*xi]
+    columns += [Hill_func(xj, 1), Hill_func(xi*xj, 1), Hill_func(xj-xi, 1), Hill_func(xj, 1)*xi]
+    for gamma in (2, 5):
+        columns += [Hill_func(xj, gamma), Hill_func(xi*xj, gamma), Hill_func(xj-xi, gamma)]
+    return np.stack(columns, axis=1)
+
+def best_of(f, repeats):
+    times = []
+    for r in range(repeats):
+        start = time.perf_counter()
+        f()
+        times.append(time.perf_counter()-start)
+    return min(times)
+
+def main(Nedges=10**6, repeats=5):
+    warnings.filterwarnings('ignore')
+    rng = np.random.default_rng(0)
+    xi = rng.normal(size=Nedges)
+    xj = rng.normal(size=Nedges)
+
+    shared, names = Interaction_func.ElementaryFunctions_Array(xi, xj, 2)
+    reference = unshared_library(xi, xj, 2)
+    np.testing.assert_allclose(shared, reference, rtol=1e-9, atol=1e-12)
+
+    out = np.empty_like(shared, order='F')
+    t_unshared = best_of(lambda: unshared_library(xi, xj, 2), repeats)
+    t_shared = best_of(lambda: Interaction_func.ElementaryFunctions_Array(xi, xj, 2, out=out), repeats)
+    t_frame = best_of(lambda: Interaction_func.ElementaryFunctions_Matrix(xi, xj, 2), repeats)
+    print('%d edges, %d columns, best of %d' % (Nedges, len(names), repeats))
+    print('unshared reference          %8.3f s' % t_unshared)
+    print('shared DAG, preallocated    %8.3f s  (%.2fx)' % (t_shared, t_unshared/t_shared))
+    print('shared DAG, DataFrame       %8.3f s  (%.2fx)' % (t_frame, t_unshared/t_frame))
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,171 @@
+"""Aggregation
+   Aggregation backends of the SDI messages on a fixed graph, with a one-time autotuner.
+
+The messages of SDI, SDIw and SDIdifftype are message_terms() of the model: functions of
+tmp = [x_i[:,0], x_j[:,0]] times an optional edge weight (the weights of SDIw, the positive
+and negative parts of Type in SDIdifftype), summed over the incoming edges of every node.
+On a static graph this sum can be computed by
+    scatter  gather x_i / x_j per edge and index_add_ the messages (as MessagePassing),
+    csr      gather per edge, sum with the (N, E) weighted incidence matrix in CSR (SpMM),
+    dense    evaluate the messages on all N*N pairs and contract with the weighted
+             adjacency, einsum('ij,bijd->bid'), without any index operation.
+Which is fastest depends on N, E, the batch size, the device and the number of threads;
+Aggregator(edge_index, N) with backend='auto' times them once per setting and keeps the
+choice in Choices (per model type and number of message terms). model.aggregation = Aggregator(...) makes transition(), loss() and the
+trajectory methods use it instead of propagate.
+"""
+
+import time
+import zlib
+
+import numpy as np
+import torch
+
+Backends = ('scatter', 'csr', 'dense')
+
+# (graph, N, E, model type, message terms, batch size, device, threads) -> backend chosen by the autotuner
+Choices = {}
+
+def graph_key(edge_index):
+    edge_index = np.ascontiguousarray(torch.as_tensor(edge_index).cpu().numpy().astype(np.int64))
+    return zlib.crc32(edge_index.tobytes())
+
+def edge_messages(terms, x, source, target):
+    """Weighted messages of the edges (source -> target) as one [rows, d] tensor per term."""
+    tmp = torch.stack([x[target,0], x[source,0]], dim=1)
+    return [fnc(tmp) for fnc, weight in terms]
+
+def same_values(a, b):
+    if a is None or b is None:
+        return a is None and b is None
+    return a.shape == b.shape and a.device == b.device and torch.equal(a, b)
+
+
+class Aggregator:
+    """Aggregated messages [B*N, msg_dim] of a model on B copies of the graph edge_index [2, E].
+
+    The incidence / adjacency matrices of the edge weights are built on first use and
+    rebuilt when the values of the weights change (reassigned or modified in place).
+    """
+    def __init__(self, edge_index, N, backend='auto', dense_max=64, repeats=5):
+        if backend != 'auto' and backend not in Backends:
+            raise ValueError('backend must be auto or one of %s' % (Backends,))
+        self.edge_index = torch.as_tensor(edge_index).long()
+        self.N = N
+        self.E = self.edge_index.shape[1]
+        self.backend = backend
+        self.dense_max = dense_max
+        self.repeats = repeats
+        self.key = graph_key(self.edge_index)
+        self.cache = {}
+
+    def __call__(self, model, x):
+        B = x.shape[0]//self.N
+        if B*self.N != x.shape[0]:
+            raise ValueError('%d rows are not copies of a graph with %d nodes' % (x.shape[0], self.N))
+        backend = self.backend if self.backend != 'auto' else self.choose(model, x, B)
+        return getattr(self, backend)(model.message_terms(), x, B)
+
+    def cached(self, name, device, build):
+        if (name, device) not in self.cache:
+            self.cache[(name, device)] = build()
+        return self.cache[(name, device)]
+
+    def weighted(self, name, weight, device, dtype, build):
+        """build(weight, device, dtype), cached with a copy of the weight values it was built from."""
+        values = None if weight is None else weight.detach()
+        entry = self.cache.get((name, device))
+        if entry is None or not same_values(entry[0], values):
+            entry = (None if values is None else values.clone(), build(weight, device, dtype))
+            self.cache[(name, device)] = entry
+        return entry[1]
+
+    def batched_edges(self, B, device):
+        def build():
+            edge_index = self.edge_index.to(device)
+            offsets = self.N*torch.arange(B, device=device)
+            return (edge_index[:,None,:]+offsets[None,:,None]).reshape(2,-1)
+        return self.cached(('edges', B), device, build)
+
+    def scatter(self, terms, x, B):
+        source, target = self.batched_edges(B, x.device)
+        out = None
+        for (fnc, weight), message in zip(terms, edge_messages(terms, x, source, target)):
+            if weight is not None:
+                message = message*weight.to(message.dtype).reshape(1,self.E,-1).expand(B,-1,-1).reshape(B*self.E,-1)
+            aggr = torch.zeros(x.shape[0], message.shape[1], dtype=message.dtype, device=x.device).index_add_(0, target, message)
+            out = aggr if out is None else out+aggr
+        return out
+
+    def incidence(self, weight, device, dtype):
+        """(N, E) CSR matrix with the edge weights at (target, edge)."""
+        values = torch.ones(self.E, dtype=dtype, device=device) if weight is None \
+            else weight.reshape(-1).detach().to(device=device, dtype=dtype)
+        target = self.edge_index[1].to(device)
+        coo = torch.sparse_coo_tensor(torch.stack([target, torch.arange(self.E, device=device)]), values, (self.N, self.E))
+        return coo.coalesce().to_sparse_csr()
+
+    def csr(self, terms, x, B):
+        source, target = self.edge_index.to(x.device)
+        out = None
+        for k, (fnc, weight) in enumerate(terms):
+            S = self.weighted(('csr', k, x.dtype), weight, x.device, x.dtype, self.incidence)
+            xb = x[:,0].reshape(B, self.N)
+            tmp = torch.stack([xb[:,target], xb[:,source]], dim=2).reshape(-1,2)
+            message = fnc(tmp).reshape(B, self.E, -1)
+            d = message.shape[2]
+            aggr = S @ message.permute(1,0,2).reshape(self.E, B*d)
+            aggr = aggr.reshape(self.N, B, d).permute(1,0,2).reshape(B*self.N, d)
+            out = aggr if out is None else out+aggr
+        return out
+
+    def adjacency(self, weight, device, dtype):
+        """Dense (N, N) adjacency A[i, j] = sum of the weights of the edges j -> i."""
+        values = torch.ones(self.E, dtype=dtype, device=device) if weight is None \
+            else weight.reshape(-1).detach().to(device=device, dtype=dtype)
+        source, target = self.edge_index.to(device)
+        A = torch.zeros(self.N*self.N, dtype=dtype, device=device)
+        return A.index_add_(0, target*self.N+source, values).reshape(self.N, self.N)
+
+    def dense(self, terms, x, B):
+        xb = x[:,0].reshape(B, self.N)
+        tmp = torch.stack([xb[:,:,None].expand(-1,-1,self.N), xb[:,None,:].expand(-1,self.N,-1)], dim=3).reshape(-1,2)
+        out = None
+        for k, (fnc, weight) in enumerate(terms):
+            A = self.weighted(('dense', k, x.dtype), weight, x.device, x.dtype, self.adjacency)
+            message = fnc(tmp).reshape(B, self.N, self.N, -1)
+            aggr = torch.einsum('ij,bijd->bid', A, message).reshape(B*self.N, -1)
+            out = aggr if out is None else out+aggr
+        return out
+
+    def candidates(self):
+        """dense evaluates N*N pairs per graph, only tried up to dense_max nodes."""
+        if self.N > self.dense_max:
+            return [backend for backend in Backends if backend != 'dense']
+        return list(Backends)
+
+    def choose(self, model, x, B):
+        """Fastest backend (forward and backward of the aggregation) for this setting, timed once."""
+        key = (self.key, self.N, self.E, type(model).__name__, len(model.message_terms()), B, str(x.device), torch.get_num_threads())
+        if key not in Choices:
+            timings = {}
+            # timed with autograd (the training setting) also when called from an inference_mode rollout
+            with torch.inference_mode(False), torch.enable_grad():
+                x = x.detach().clone().requires_grad_(True)
+                inputs = [x]+[p for p in model.parameters() if p.requires_grad]
+                for backend in self.candidates():
+                    # autograd.grad leaves the .grad of the model untouched
+                    run = lambda: torch.autograd.grad(getattr(self, backend)(model.message_terms(), x, B).sum(), \
+                        inputs, allow_unused=True)
+                    run()
+                    if x.is_cuda:
+                        torch.cuda.synchronize()
+                    start = time.perf_counter()
+                    for r in range(self.repeats):
+                        run()
+                    if x.is_cuda:
+                        torch.cuda.synchronize()
+                    timings[backend] = (time.perf_counter()-start)/self.repeats
+            Choices[key] = min(timings, key=timings.get)
+            self.timings = timings
+        return Choices[key]
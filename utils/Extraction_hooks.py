@@ -0,0 +1,139 @@
+"""Extraction hooks
+   Messages, self-dynamics and diffusion of an SDI model from one forward pass over a probe set.
+
+The notebooks call get_messages, get_selfDynamics and get_diffusion after every epoch, each
+iterating newtestloader again and re-evaluating msg_fnc / node_fnc_* / stochastic_* on the
+gathered edges. ExtractionHooks registers forward hooks on an SDIcore model (SDIunweighted,
+SDIweighted, SDI_Difftype) instead: the message hook of MessagePassing records x_i[:,0],
+x_j[:,0] and the (weighted) messages of every edge, the hooks on the drift and diffusion
+heads their outputs on every node, all written into buffers preallocated for the probe set,
+so one model(x, edge_index) per batch gives the three tables:
+
+    hooks = ExtractionHooks(ogn, newtestloader)
+    cur_msgs, cur_selfdyn, cur_diff = hooks.extract(newtestloader)
+
+with the columns of the notebooks, x1, x2 (target, source), w (edge weight, for weighted
+models) and e0, e1, ... for the messages, the node features then s1, s2, ... (drift heads)
+or d1, d2, ... (diffusion heads). The self-dynamics and diffusion rows are the nodes, not
+the edge targets of the notebooks (every node once instead of once per incoming edge).
+"""
+
+import numpy as np
+import pandas as pd
+import torch
+
+from NeuGNN_model import axis
+
+
+def probe_size(loader):
+    """Number of nodes and edges of the graphs of loader (a StaticGraphLoader or a PyG DataLoader)."""
+    dataset = loader.dataset
+    if hasattr(dataset, 'num_nodes') and hasattr(dataset, 'edge_index'):
+        return len(dataset)*dataset.num_nodes, len(dataset)*dataset.edge_index.shape[1]
+    return sum(g.num_nodes for g in dataset), sum(g.num_edges for g in dataset)
+
+def edge_weight(model):
+    """Total weight [E, 1] of the message terms of model, None if unweighted."""
+    weights = [weight for fnc, weight in model.message_terms() if weight is not None]
+    if not weights:
+        return None
+    return sum(weight.detach().reshape(len(weight), -1) for weight in weights)
+
+
+class ExtractionHooks:
+    """Forward hooks of model writing the messages, drift and diffusion of a probe set
+    of num_nodes nodes and num_edges edges (default: probe_size(loader)) into buffers."""
+    def __init__(self, model, loader=None, num_nodes=None, num_edges=None):
+        if num_nodes is None or num_edges is None:
+            num_nodes, num_edges = probe_size(loader)
+        self.model = model
+        self.num_nodes = num_nodes
+        self.num_edges = num_edges
+        self.weight = edge_weight(model)
+        self.handles = []
+        self.buffers = None
+
+    def allocate(self, n_f, msg_dim, device, dtype):
+        ndim = self.model.ndim
+        empty = lambda *shape: torch.empty(*shape, device=device, dtype=dtype)
+        self.buffers = {'pairs': empty(self.num_edges, 2), 'messages': empty(self.num_edges, msg_dim),
+            'nodes': empty(self.num_nodes, n_f), 'drift': empty(self.num_nodes, ndim),
+            'diffusion': empty(self.num_nodes, ndim)}
+        self.edge_cursor = 0
+        self.node_cursor = 0
+
+    def message_hook(self, module, inputs, output):
+        x_i, x_j = inputs[0]['x_i'], inputs[0]['x_j']
+        if self.buffers is None:
+            self.allocate(x_i.shape[1], output.shape[1], output.device, output.dtype)
+        rows = slice(self.edge_cursor, self.edge_cursor+len(output))
+        self.buffers['pairs'][rows] = torch.stack([x_i[:,0], x_j[:,0]], dim=1)
+        self.buffers['messages'][rows] = output
+        self.edge_cursor += len(output)
+
+    def head_hook(self, name, k):
+        def hook(module, inputs, output):
+            rows = slice(self.node_cursor, self.node_cursor+len(output))
+            if name == 'drift' and k == 0:
+                self.buffers['nodes'][rows] = inputs[0]
+            self.buffers[name][rows, k:k+1] = output
+        return hook
+
+    def attach(self):
+        """Registers the hooks; while attached the heads run one by one (not grouped)."""
+        if not self.handles:
+            ndim = self.model.ndim
+            heads = self.model.heads()
+            self.handles.append(self.model.register_message_forward_hook(self.message_hook))
+            for k in range(ndim):
+                self.handles.append(heads[k].register_forward_hook(self.head_hook('drift', k)))
+                self.handles.append(heads[ndim+k].register_forward_hook(self.head_hook('diffusion', k)))
+        return self
+
+    def detach(self):
+        for handle in self.handles:
+            handle.remove()
+        self.handles = []
+
+    def __enter__(self):
+        return self.attach()
+
+    def __exit__(self, *args):
+        self.detach()
+
+    @torch.no_grad()
+    def run(self, loader):
+        """One forward pass of the model over loader with the hooks attached."""
+        self.buffers = None
+        device = next(self.model.parameters()).device
+        with self:
+            for g in loader:
+                g = g.to(device)
+                self.model(g.x, g.edge_index)
+                self.node_cursor += len(g.x)
+        if self.buffers is None or self.edge_cursor != self.num_edges or self.node_cursor != self.num_nodes:
+            raise ValueError('the probe set has %d nodes and %d edges, expected %d and %d'
+                % (self.node_cursor, self.edge_cursor, self.num_nodes, self.num_edges))
+        return self
+
+    def frames(self):
+        """(messages, self-dynamics, diffusion) DataFrames of the last run."""
+        ndim = self.model.ndim
+        arrays = {name: buffer.cpu().numpy() for name, buffer in self.buffers.items()}
+        columns = ['x1', 'x2']
+        data = [arrays['pairs']]
+        if self.weight is not None:
+            weight = self.weight.to(self.buffers['pairs'].device, self.buffers['pairs'].dtype)
+            data.append(weight.repeat(self.num_edges//len(weight), 1).cpu().numpy())
+            columns += ['w']
+        columns += ['e%d' % k for k in range(arrays['messages'].shape[1])]
+        messages = pd.DataFrame(np.concatenate(data+[arrays['messages']], axis=1), columns=columns)
+        features = [axis(k) for k in range(arrays['nodes'].shape[1])]
+        self_dynamics = pd.DataFrame(np.concatenate([arrays['nodes'], arrays['drift']], axis=1),
+            columns=features+['s%d' % (k+1) for k in range(ndim)])
+        diffusion = pd.DataFrame(np.concatenate([arrays['nodes'], arrays['diffusion']], axis=1),
+            columns=features+['d%d' % (k+1) for k in range(ndim)])
+        return messages, self_dynamics, diffusion
+
+    def extract(self, loader):
+        return self.run(loader).frames()
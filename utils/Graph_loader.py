@@ -0,0 +1,112 @@
+"""Graph loader
+   Mini-batches of snapshots on one static graph, without lists of Data objects.
+
+The training sets are T snapshots X[t] [N, F] with targets y[t] on the same edge_index.
+StaticGraphDataset keeps them as contiguous [T, N, F] tensors (on the training device, if
+moved there once with .to()), a batch is gathered with a tensor of snapshot ids and the
+batched edge_index (edge_index of graph b offset by b*N, the collation of DataLoader) and
+batch vector are computed once per batch size. The batches have the attributes x, y,
+edge_index, batch and num_graphs of a torch_geometric Batch, so they go directly into
+loss(), sample_trajectories() and average_trajectories() of the models:
+
+    dataset = StaticGraphDataset(X_train, y_train, edge_index).to('cuda')
+    trainloader = StaticGraphLoader(dataset, batch_size=32, shuffle=True)
+    for ginput in trainloader:
+        loss = ogn.loss(ginput)
+"""
+
+import torch
+
+
+class GraphBatch:
+    """Snapshots index of a StaticGraphDataset, stacked along the nodes as in a PyG Batch."""
+    def __init__(self, x, y, edge_index, batch, index):
+        self.x = x
+        self.y = y
+        self.edge_index = edge_index
+        self.batch = batch
+        self.index = index
+
+    @property
+    def num_graphs(self):
+        return len(self.index)
+
+    def to(self, device):
+        for name in ('x', 'y', 'edge_index', 'batch', 'index'):
+            value = getattr(self, name)
+            setattr(self, name, None if value is None else value.to(device))
+        return self
+
+    def cuda(self):
+        return self.to('cuda')
+
+    def cpu(self):
+        return self.to('cpu')
+
+
+class StaticGraphDataset:
+    """X [T, N, F] and y [T, N_y, F_y] (or None) on the fixed edge_index [2, E]."""
+    def __init__(self, X, y, edge_index):
+        self.X = torch.as_tensor(X).contiguous()
+        self.y = None if y is None else torch.as_tensor(y).contiguous()
+        if self.y is not None and len(self.y) != len(self.X):
+            raise ValueError('X and y have %d and %d snapshots' % (len(self.X), len(self.y)))
+        if self.X.dim() == 2:
+            self.X = self.X.unsqueeze(-1)
+        self.edge_index = torch.as_tensor(edge_index).long()
+        self.cache = {}
+
+    def __len__(self):
+        return len(self.X)
+
+    @property
+    def num_nodes(self):
+        return self.X.shape[1]
+
+    def to(self, device):
+        self.X = self.X.to(device)
+        self.y = None if self.y is None else self.y.to(device)
+        self.edge_index = self.edge_index.to(device)
+        self.cache = {}
+        return self
+
+    def batched_graph(self, size):
+        """edge_index and batch vector of size copies of the graph, computed once per size."""
+        if size not in self.cache:
+            N = self.num_nodes
+            offsets = N*torch.arange(size, device=self.edge_index.device)
+            edge_index = (self.edge_index[:,None,:]+offsets[None,:,None]).reshape(2,-1)
+            batch = torch.arange(size, device=self.edge_index.device).repeat_interleave(N)
+            self.cache[size] = (edge_index, batch)
+        return self.cache[size]
+
+    def __getitem__(self, index):
+        index = torch.as_tensor(index, device=self.X.device).reshape(-1)
+        edge_index, batch = self.batched_graph(len(index))
+        x = self.X[index].reshape(-1, self.X.shape[2])
+        y = None if self.y is None else self.y[index].reshape(-1, *self.y.shape[2:])
+        return GraphBatch(x, y, edge_index, batch, index)
+
+
+class StaticGraphLoader:
+    """Iterates over a StaticGraphDataset in batches of batch_size snapshots."""
+    def __init__(self, dataset, batch_size=32, shuffle=False, drop_last=False, generator=None):
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.generator = generator
+
+    def __len__(self):
+        if self.drop_last:
+            return len(self.dataset)//self.batch_size
+        return -(-len(self.dataset)//self.batch_size)
+
+    def __iter__(self):
+        T = len(self.dataset)
+        if self.shuffle:
+            order = torch.randperm(T, generator=self.generator).to(self.dataset.X.device)
+        else:
+            order = torch.arange(T, device=self.dataset.X.device)
+        for start in range(0, len(self)*self.batch_size, self.batch_size):
+            yield self.dataset[order[start:start+self.batch_size]]
@@ -1,217 +1,309 @@
 import pandas as pd
 import numpy as np
 
-def ElementaryFunctions_Matrix(xi, xj, coupledPolyOrder = 1, CoupledPolynomialIndex = True, \
-        CoupledTrigonometricIndex = True, CoupledExponentialIndex = True, CoupledFractionalIndex = True, \
-            CoupledActivationIndex = True):
-    
-    ElementaryMatrix = pd.DataFrame()
+"""
+The coupled library is described as a small expression DAG. Every column is an
+expression over the variables 'xi' and 'xj', written as nested tuples
+(operation, argument, ..., constant, ...), e.g. ('mul', 'xi', ('sin', 'xj')).
+Equal subexpressions are equal tuples, so evaluate_library computes every base
+quantity (xi*xj, xj-xi, powers) and every transcendental (exp(xj), sigmoid, ...)
+once per call and reuses it in all the columns that need it. A node which is
+itself a library column is computed directly into its column of the output.
+
+Every family has a *_columns function listing (name, expression) pairs, a *_names
+and a *_array function; ElementaryFunctions_Array evaluates all enabled families
+in one DAG and ElementaryFunctions_Matrix wraps it into a DataFrame.
+"""
+
+XIXJ = ('mul', 'xi', 'xj')
+XJMINUSXI = ('sub', 'xj', 'xi')
+Coupled_arguments = (('xj', 'xj'), ('xixj', XIXJ), ('xjMinusxi', XJMINUSXI))
+
+def power(u, k):
+    """u**k by repeated squaring, so that lower powers are shared nodes."""
+    if k == 1:
+        return u
+    if k%2 == 0:
+        return ('square', power(u, k//2))
+    return ('mul', power(u, k-1), u)
+
+def sigmoid(u, alpha, beta):
+    if (alpha, beta) == (1, 0):
+        # 1/(1+exp(-u)) = 1/(1+1/exp(u)) reuses exp(u) of the exponential family
+        return ('recip', ('add', ('recip', ('exp', u)), 1.))
+    return ('sigmoid', u, alpha, beta)
+
+def Op_sigmoid(u, alpha, beta, out=None):
+    out = np.subtract(u, beta, out=out)
+    out *= -alpha
+    np.exp(out, out=out)
+    out += 1.
+    return np.reciprocal(out, out=out)
+
+def Op_hill(p, out=None):
+    out = np.add(p, 1., out=out)
+    return np.divide(p, out, out=out)
+
+Operations = {
+    'mul': np.multiply,
+    'sub': np.subtract,
+    'add': np.add,
+    'div': np.divide,
+    'square': np.square,
+    'recip': lambda u, out=None: np.divide(1., u, out=out),
+    'sin': np.sin,
+    'cos': np.cos,
+    'tan': np.tan,
+    'exp': np.exp,
+    'tanh': np.tanh,
+    'sigmoid': Op_sigmoid,
+    'hill': Op_hill,
+}
+
+def evaluate_library(columns, variables, out):
+    """Evaluate the expressions `columns` into the columns of `out`, sharing subexpressions.
+
+    variables maps the leaf names to arrays. Division by zero and overflow give
+    inf/nan without warnings, they are dropped after construction as before.
+    """
+    target = {}
+    for j, expr in enumerate(columns):
+        target.setdefault(expr, j)
+    memo = dict(variables)
+
+    def value(expr):
+        if expr in memo:
+            return memo[expr]
+        op = expr[0]
+        args = [value(arg) if isinstance(arg, (tuple, str)) else arg for arg in expr[1:]]
+        dest = out[:,target[expr]] if expr in target else None
+        memo[expr] = Operations[op](*args, out=dest)
+        return memo[expr]
+
+    with np.errstate(divide='ignore', over='ignore', invalid='ignore'):
+        for j, expr in enumerate(columns):
+            result = value(expr)
+            if target[expr] != j or isinstance(expr, str):
+                out[:,j] = result
+    return out
+
+def new_block(xi, Numfunc, out=None, dtype=np.float64):
+    if out is None:
+        # column-major, so that every library column is contiguous
+        out = np.empty(shape=(np.size(xi,0),Numfunc), dtype=dtype, order='F')
+    return out
+
+def coupled_library_plan(coupledPolyOrder = 1, CoupledPolynomialIndex = True, CoupledTrigonometricIndex = True, \
+        CoupledExponentialIndex = True, CoupledFractionalIndex = True, CoupledActivationIndex = True):
+    """List the enabled families as (columns function, keyword arguments, column names)."""
+    plan = []
     if CoupledPolynomialIndex == True:
-        ElementaryMatrix = pd.concat([ElementaryMatrix, Coupled_Polynomial_functions(xi, xj, coupledPolyOrder)],axis=1)
+        plan.append((Coupled_Polynomial_columns, dict(PolyOrder = coupledPolyOrder)))
     if CoupledTrigonometricIndex == True:
-        ElementaryMatrix = pd.concat([ElementaryMatrix, Coupled_Trigonometric_functions(xi, xj, Sine = True, Cos = False, Tan = False)],axis=1)
+        plan.append((Coupled_Trigonometric_columns, dict(Sine = True, Cos = False, Tan = False)))
     if CoupledExponentialIndex == True:
-        ElementaryMatrix = pd.concat([ElementaryMatrix, Coupled_Exponential_functions(xi, xj, Exponential = True)],axis=1)
+        plan.append((Coupled_Exponential_columns, dict(Exponential = True)))
     if CoupledFractionalIndex == True:
-        ElementaryMatrix = pd.concat([ElementaryMatrix, Coupled_Fractional_functions(xi, xj, Fractional = True)],axis=1)
+        plan.append((Coupled_Fractional_columns, dict(Fractional = True)))
     if CoupledActivationIndex == True:
-        ElementaryMatrix = pd.concat([ElementaryMatrix, Coupled_Activation_functions(xi, xj, Sigmoid = True, Tanh = True, Hill = True)],axis=1)
-   
-    return ElementaryMatrix
+        plan.append((Coupled_Activation_columns, dict(Sigmoid = True, Tanh = True, Hill = True)))
+    return [(columns, kwargs, [name for name, expr in columns(**kwargs)]) for columns, kwargs in plan]
+
+def ElementaryFunctions_Array(xi, xj, coupledPolyOrder = 1, CoupledPolynomialIndex = True, \
+        CoupledTrigonometricIndex = True, CoupledExponentialIndex = True, CoupledFractionalIndex = True, \
+            CoupledActivationIndex = True, out = None, dtype = np.float64):
+    """Evaluate the coupled library into one (E, Numfunc) array with a single shared DAG.
+    Returns the array and the list of column names."""
+    plan = coupled_library_plan(coupledPolyOrder, CoupledPolynomialIndex, CoupledTrigonometricIndex, \
+        CoupledExponentialIndex, CoupledFractionalIndex, CoupledActivationIndex)
+    columns = [column for family, kwargs, names in plan for column in family(**kwargs)]
+    ElementaryArray = new_block(xi, len(columns), out, dtype)
+    evaluate_library([expr for name, expr in columns], dict(xi=np.asarray(xi), xj=np.asarray(xj)), ElementaryArray)
+    return ElementaryArray, [name for name, expr in columns]
+
+def ElementaryFunctions_Matrix(xi, xj, coupledPolyOrder = 1, CoupledPolynomialIndex = True, \
+        CoupledTrigonometricIndex = True, CoupledExponentialIndex = True, CoupledFractionalIndex = True, \
+            CoupledActivationIndex = True):
+
+    ElementaryArray, names = ElementaryFunctions_Array(xi, xj, coupledPolyOrder, CoupledPolynomialIndex, \
+        CoupledTrigonometricIndex, CoupledExponentialIndex, CoupledFractionalIndex, CoupledActivationIndex)
+    return pd.DataFrame(data = ElementaryArray, columns = names)
+
+def family_array(columns, xi, xj, out = None):
+    out = new_block(xi, len(columns), out)
+    return evaluate_library([expr for name, expr in columns], dict(xi=np.asarray(xi), xj=np.asarray(xj)), out)
+
+def family_frame(columns, xi, xj):
+    return pd.DataFrame(data = family_array(columns, xi, xj), columns = [name for name, expr in columns])
 
 
 #Libraries construction
+def Coupled_Polynomial_columns(PolyOrder):
+    columns = list(Coupled_arguments)
+    for order in range(2,PolyOrder+1):
+        columns += [(name+'pow'+str(order), power(u, order)) for name, u in Coupled_arguments]
+    return columns
+
+def Coupled_Polynomial_names(PolyOrder):
+    return [name for name, expr in Coupled_Polynomial_columns(PolyOrder)]
+
+def Coupled_Polynomial_array(xi, xj, PolyOrder, out = None):
+    return family_array(Coupled_Polynomial_columns(PolyOrder), xi, xj, out)
+
 def Coupled_Polynomial_functions(xi,xj,PolyOrder):
-    if PolyOrder>=1:
-        column_values = ['xj','xixj','xjMinusxi']
-        CoupledPolyOne = np.zeros(shape=(np.size(xi,0),len(column_values)))
-        for j in range(len(column_values)):
-            if j == 0:
-                tmp1 = xj
-            if j == 1:
-                tmp2 = xi*xj
-            if j == 2:
-                tmp3 = xj-xi
-        CoupledPolyOne = np.stack((tmp1,tmp2,tmp3),axis=1)
-        CoupledPolyOne = pd.DataFrame(data = CoupledPolyOne, columns = column_values)
-    if PolyOrder>=2:
-        column_values = ['xjpow2','xixjpow2','xjMinusxipow2']
-        CoupledPolyTwo = np.zeros(shape=(np.size(xi,0),len(column_values)))
-        for j in range(len(column_values)):
-            if j == 0:
-                tmp1 = xj**2
-            if j == 1:
-                tmp2 = (xi*xj)**2
-            if j == 2:
-                tmp3 = (xj-xi)**2
-        CoupledPolyTwo = np.stack((tmp1,tmp2,tmp3),axis=1)
-        CoupledPolyTwo = pd.DataFrame(data = CoupledPolyTwo, columns = column_values)
-    if PolyOrder == 1:
-        return CoupledPolyOne
-    if PolyOrder == 2:
-        return pd.concat([CoupledPolyOne, CoupledPolyTwo], axis=1)
+    return family_frame(Coupled_Polynomial_columns(PolyOrder), xi, xj)
+
+def unary_columns(prefix, f):
+    """f(xj), f(xi*xj), f(xj-xi) and xi*f(xj)."""
+    return [(prefix+name, f(u)) for name, u in Coupled_arguments]+[('xi'+prefix+'xj', ('mul', 'xi', f('xj')))]
+
+def Coupled_Trigonometric_columns(Sine = True, Cos = False, Tan = False):
+    columns = []
+    for prefix, index in (('sin', Sine), ('cos', Cos), ('tan', Tan)):
+        if index == True:
+            columns += unary_columns(prefix, lambda u: (prefix, u))
+    return columns
+
+def Coupled_Trigonometric_names(Sine = True, Cos = False, Tan = False):
+    return [name for name, expr in Coupled_Trigonometric_columns(Sine, Cos, Tan)]
+
+def Coupled_Trigonometric_array(xi, xj, Sine = True, Cos = False, Tan = False, out = None):
+    return family_array(Coupled_Trigonometric_columns(Sine, Cos, Tan), xi, xj, out)
 
 def Coupled_Trigonometric_functions(xi, xj, Sine = True, Cos = False, Tan = False):
-    if Sine == True:
-        column_values = ['sinxj','sinxixj','sinxjMinusxi','xisinxj']
-        CoupledSine = np.zeros(shape=(np.size(xi,0),len(column_values)))
-        for j in range(len(column_values)):
-            if j == 0:
-                tmp1 = np.sin(xj)
-            if j == 1:
-                tmp2 = np.sin(xi*xj)
-            if j == 2:
-                tmp3 = np.sin(xj-xi)
-            if j == 3:
-                tmp4 = xi*np.sin(xj)
-        CoupledSine = np.stack((tmp1,tmp2,tmp3,tmp4),axis=1)
-        CoupledSine = pd.DataFrame(data = CoupledSine, columns = column_values)
-    if Cos == True:
-        column_values = ['cosxj','cosxixj','cosxjMinusxi','xicosxj']
-        CoupledCosine = np.zeros(shape=(np.size(xi,0),len(column_values)))
-        for j in range(len(column_values)):
-            if j == 0:
-                tmp1 = np.cos(xj)
-            if j == 1:
-                tmp2 = np.cos(xi*xj)
-            if j == 2:
-                tmp3 = np.cos(xj-xi)
-            if j == 3:
-                tmp4 = xi*np.cos(xj)
-        CoupledCosine = np.stack((tmp1,tmp2,tmp3,tmp4),axis=1)
-        CoupledCosine = pd.DataFrame(data = CoupledCosine, columns = column_values)
-    if Tan == True:
-        column_values = ['tanxj','tanxixj','tanxjMinusxi','xitanxj']
-        CoupledTan = np.zeros(shape=(np.size(xi,0),len(column_values)))
-        for j in range(len(column_values)):
-            if j == 0:
-                tmp1 = np.tan(xj)
-            if j == 1:
-                tmp2 = np.tan(xi*xj)
-            if j == 2:
-                tmp3 = np.tan(xj-xi)
-            if j == 3:
-                tmp4 = xi*np.tan(xj)
-        CoupledTan = np.stack((tmp1,tmp2,tmp3,tmp4),axis=1)
-        CoupledTan = pd.DataFrame(data = CoupledTan, columns = column_values)
-    CoupledTrignometric = pd.DataFrame()
-    if Sine == True:
-        CoupledTrignometric = pd.concat([CoupledTrignometric,CoupledSine],axis=1)
-    if Cos == True:
-        CoupledTrignometric = pd.concat([CoupledTrignometric, CoupledCosine], axis=1)
-    if Tan == True:
-        CoupledTrignometric = pd.concat([CoupledTrignometric, CoupledTan], axis=1)
-    return CoupledTrignometric
+    return family_frame(Coupled_Trigonometric_columns(Sine, Cos, Tan), xi, xj)
 
-def Coupled_Exponential_functions(xi, xj, Exponential = True):
+def Coupled_Exponential_columns(Exponential = True):
     if Exponential == True:
-        column_values = ['expxj','expxixj','expxjMinusxi','xiexpxj']
-        CoupledExp = np.zeros(shape=(np.size(xi,0),len(column_values)))
-        for j in range(len(column_values)):
-            if j == 0:
-                tmp1 = np.exp(xj)
-            if j == 1:
-                tmp2 = np.exp(xi*xj)
-            if j == 2:
-                tmp3 = np.exp(xj-xi)
-            if j == 3:
-                tmp4 = xi*np.exp(xj)
-        CoupledExp = np.stack((tmp1,tmp2,tmp3,tmp4),axis=1)    
-        CoupledExp = pd.DataFrame(data = CoupledExp, columns = column_values)
-    return CoupledExp
+        return unary_columns('exp', lambda u: ('exp', u))
+    return []
 
-def Coupled_Fractional_functions(xi, xj, Fractional = True):
+def Coupled_Exponential_names(Exponential = True):
+    return [name for name, expr in Coupled_Exponential_columns(Exponential)]
+
+def Coupled_Exponential_array(xi, xj, Exponential = True, out = None):
+    return family_array(Coupled_Exponential_columns(Exponential), xi, xj, out)
+
+def Coupled_Exponential_functions(xi, xj, Exponential = True):
+    return family_frame(Coupled_Exponential_columns(Exponential), xi, xj)
+
+def Coupled_Fractional_columns(Fractional = True):
     if Fractional == True:
-        column_values = ['fracxj','fracxixj','fracxjMinusxi','xifracxj']
-        CoupledFraction = np.zeros(shape=(np.size(xi,0),len(column_values)))
-        for j in range(len(column_values)):
-            if j == 0:
-                tmp1 = 1/xj
-            if j == 1:
-                tmp2 = 1/(xi*xj)
-            if j == 2:
-                tmp3 = 1/((xj-xi)+1e-5)
-            if j == 3:
-                tmp4 = xi/(xj+1e-5)
-        CoupledFraction = np.stack((tmp1,tmp2,tmp3,tmp4),axis=1) 
-        CoupledFraction = pd.DataFrame(data = CoupledFraction, columns = column_values)
-    return CoupledFraction
+        return [('fracxj', ('recip', 'xj')),
+                ('fracxixj', ('recip', XIXJ)),
+                ('fracxjMinusxi', ('recip', ('add', XJMINUSXI, 1e-5))),
+                ('xifracxj', ('div', 'xi', ('add', 'xj', 1e-5)))]
+    return []
+
+def Coupled_Fractional_names(Fractional = True):
+    return [name for name, expr in Coupled_Fractional_columns(Fractional)]
+
+def Coupled_Fractional_array(xi, xj, Fractional = True, out = None):
+    return family_array(Coupled_Fractional_columns(Fractional), xi, xj, out)
+
+def Coupled_Fractional_functions(xi, xj, Fractional = True):
+    return family_frame(Coupled_Fractional_columns(Fractional), xi, xj)
 
 def sigmoidfun(x,alpha,beta):
     sigmoidOutput = 1/(1+np.exp(-alpha*(x-beta)))
     return sigmoidOutput
 
 def tangentH(x):
-    Tanh = (np.exp(x)-np.exp(-x))/(np.exp(x)+np.exp(-x))
-    return Tanh
+    return np.tanh(x)
 
 def Hill_func(x,gamma):
     Regulation_result = (x**gamma)/(x**gamma+1)
     return Regulation_result
 
-def Coupled_Activation_functions(xi, xj, Sigmoid = True, Tanh = True, Hill = True):
+def Coupled_Activation_columns(Sigmoid = True, Tanh = True, Hill = True):
+    columns = []
     if Sigmoid == True:
-        column_values = ['sigmoidxj','sigmoidxixj','sigmoidXjMinusXi','xisigmoidxj',
-                        'sigmoidxj101','sigmoidxixj101','sigmoidXjMinusXi101','xisigmoidxj101']
-        CoupledSigmoid = np.zeros(shape=(np.size(xi,0),len(column_values)))
-        for j in range(len(column_values)):
-            if j == 0:
-                tmp1 = sigmoidfun(xj,1,0)
-            if j == 1:
-                tmp2 = sigmoidfun(xi*xj,1,0)
-            if j == 2:
-                tmp3 = sigmoidfun(xj-xi,1,0)
-            if j == 3:
-                tmp4 = sigmoidfun(xj,1,0)*xi
-            if j == 4:
-                tmp5 = sigmoidfun(xj,10,1)
-            if j == 5:
-                tmp6 = sigmoidfun(xi*xj,10,1)
-            if j == 6:
-                tmp7 = sigmoidfun(xj-xi,10,1)
-            if j == 7:
-                tmp8 = sigmoidfun(xj,10,1)*xi
-        CoupledSigmoid = np.stack((tmp1,tmp2,tmp3,tmp4,tmp5,tmp6,tmp7,tmp8),axis=1)
-        CoupledSigmoid = pd.DataFrame(data = CoupledSigmoid, columns = column_values)
+        columns += [('sigmoidxj', sigmoid('xj',1,0)),
+                    ('sigmoidxixj', sigmoid(XIXJ,1,0)),
+                    ('sigmoidXjMinusXi', sigmoid(XJMINUSXI,1,0)),
+                    ('xisigmoidxj', ('mul', 'xi', sigmoid('xj',1,0))),
+                    ('sigmoidxj101', sigmoid('xj',10,1)),
+                    ('sigmoidxixj101', sigmoid(XIXJ,10,1)),
+                    ('sigmoidXjMinusXi101', sigmoid(XJMINUSXI,10,1)),
+                    ('xisigmoidxj101', ('mul', 'xi', sigmoid('xj',10,1)))]
     if Tanh == True:
-        column_values = ['tanhxj','tanhxixj','tanhxjMinusxi','xitanhxj']
-        CoupledTanh = np.zeros(shape=(np.size(xi,0),len(column_values)))
-        for j in range(len(column_values)):
-            if j == 0:
-                tmp1 = tangentH(xj)
-            if j == 1:
-                tmp2 = tangentH(xi*xj)
-            if j == 2:
-                tmp3 = tangentH(xj-xi)
-            if j == 3:
-                tmp4 = tangentH(xj)*xi
-        Coupledtanh = np.stack((tmp1,tmp2,tmp3,tmp4),axis=1)
-        Coupledtanh = pd.DataFrame(data = Coupledtanh, columns = column_values)
+        columns += unary_columns('tanh', lambda u: ('tanh', u))
     if Hill == True:
-        column_values = ['hillxj','hillxixj','hillxjMinusxi','xihillxj','hillxj2',
-                        'hillxixj2','hillxjMinusxi2','hillxj5','hillxixj5','hillxjMinusxi5']
-        CoupledHill = np.zeros(shape=(np.size(xi,0),len(column_values)))
-        for j in range(len(column_values)):
-            if j == 0:
-                tmp1 = Hill_func(xj,1)
-            if j == 1:
-                tmp2 = Hill_func(xi*xj,1)
-            if j == 2:
-                tmp3 = Hill_func(xj-xi,1)
-            if j == 3:
-                tmp4 = Hill_func(xj,1)*xi
-            if j == 4:
-                tmp5 = Hill_func(xj,2)
-            if j == 5:
-                tmp6 = Hill_func(xi*xj,2)
-            if j == 6:
-                tmp7 = Hill_func(xj-xi,2)
-            if j == 7:
-                tmp8 = Hill_func(xj,5)
-            if j == 8:
-                tmp9 = Hill_func(xi*xj,5)
-            if j == 9:
-                tmp10 = Hill_func(xj-xi,5)
-        CoupledHill = np.stack((tmp1,tmp2,tmp3,tmp4,tmp5,tmp6,tmp7,tmp8,tmp9,tmp10),axis=1)
-        CoupledHill = pd.DataFrame(data = CoupledHill, columns = column_values)   
-    return pd.concat([CoupledSigmoid,Coupledtanh,CoupledHill], axis = 1) 
\ No newline at end of file
+        columns += unary_columns('hill', lambda u: ('hill', u))
+        for gamma in (2,5):
+            columns += [('hill'+name+str(gamma), ('hill', power(u, gamma))) for name, u in Coupled_arguments]
+    return columns
+
+def Coupled_Activation_names(Sigmoid = True, Tanh = True, Hill = True):
+    return [name for name, expr in Coupled_Activation_columns(Sigmoid, Tanh, Hill)]
+
+def Coupled_Activation_array(xi, xj, Sigmoid = True, Tanh = True, Hill = True, out = None):
+    return family_array(Coupled_Activation_columns(Sigmoid, Tanh, Hill), xi, xj, out)
+
+def Coupled_Activation_functions(xi, xj, Sigmoid = True, Tanh = True, Hill = True):
+    return family_frame(Coupled_Activation_columns(Sigmoid, Tanh, Hill), xi, xj)
+
+
+"""
+Multi-dimensional and edge-attribute-aware coupled library.
+
+Xi, Xj are (E, d) target/source states and W an optional (E, k) array of edge
+attributes (e.g. retrograde, anterograde and Euclidean weights). The scalar
+coupled library is applied to every state dimension a (column names get the
+suffix _a), optionally completed by the cross-dimension products xi_a*xj_b, and
+every term is multiplied by every edge attribute c (names prefixed by wc*).
+All columns are evaluated in one shared DAG into one preallocated array.
+"""
+
+def substitute(expr, mapping):
+    if isinstance(expr, str):
+        return mapping.get(expr, expr)
+    if isinstance(expr, tuple):
+        return tuple(substitute(arg, mapping) for arg in expr)
+    return expr
+
+def Coupled_Multidim_columns(dim, Nattr = 0, coupledPolyOrder = 1, CoupledPolynomialIndex = True, \
+        CoupledTrigonometricIndex = True, CoupledExponentialIndex = True, CoupledFractionalIndex = True, \
+            CoupledActivationIndex = True, CrossIndex = True, UnweightedIndex = True):
+    plan = coupled_library_plan(coupledPolyOrder, CoupledPolynomialIndex, CoupledTrigonometricIndex, \
+        CoupledExponentialIndex, CoupledFractionalIndex, CoupledActivationIndex)
+    base = [column for family, kwargs, names in plan for column in family(**kwargs)]
+    terms = []
+    for a in range(1,dim+1):
+        mapping = {'xi': 'xi'+str(a), 'xj': 'xj'+str(a)}
+        terms += [(name+'_'+str(a), substitute(expr, mapping)) for name, expr in base]
+    if CrossIndex == True:
+        terms += [('xi'+str(a)+'xj'+str(b), ('mul', 'xi'+str(a), 'xj'+str(b))) \
+            for a in range(1,dim+1) for b in range(1,dim+1) if a != b]
+    columns = list(terms) if (UnweightedIndex == True or Nattr == 0) else []
+    for c in range(1,Nattr+1):
+        columns += [('w'+str(c)+'*'+name, ('mul', 'w'+str(c), expr)) for name, expr in terms]
+    return columns
+
+def Coupled_Multidim_names(dim, Nattr = 0, **kwargs):
+    return [name for name, expr in Coupled_Multidim_columns(dim, Nattr, **kwargs)]
+
+def Coupled_Multidim_Array(Xi, Xj, W = None, out = None, dtype = np.float64, **kwargs):
+    """Evaluate the multi-dimensional coupled library of (E, d) states Xi, Xj and (E, k)
+    edge attributes W. Keyword arguments are those of Coupled_Multidim_columns.
+    Returns the (E, Numfunc) array and the list of column names."""
+    Xi = np.asarray(Xi).reshape(np.size(Xi,0),-1)
+    Xj = np.asarray(Xj).reshape(np.size(Xj,0),-1)
+    variables = {}
+    for a in range(0,np.size(Xi,1)):
+        variables['xi'+str(a+1)] = np.ascontiguousarray(Xi[:,a])
+        variables['xj'+str(a+1)] = np.ascontiguousarray(Xj[:,a])
+    Nattr = 0
+    if W is not None:
+        W = np.asarray(W).reshape(np.size(W,0),-1)
+        Nattr = np.size(W,1)
+        for c in range(0,Nattr):
+            variables['w'+str(c+1)] = np.ascontiguousarray(W[:,c])
+    columns = Coupled_Multidim_columns(np.size(Xi,1), Nattr, **kwargs)
+    ElementaryArray = new_block(Xi, len(columns), out, dtype)
+    evaluate_library([expr for name, expr in columns], variables, ElementaryArray)
+    return ElementaryArray, [name for name, expr in columns]
+
+def Coupled_Multidim_Matrix(Xi, Xj, W = None, **kwargs):
+    ElementaryArray, names = Coupled_Multidim_Array(Xi, Xj, W, **kwargs)
+    return pd.DataFrame(data = ElementaryArray, columns = names)
@@ -7,6 +7,8 @@ from torch_geometric.nn import MetaLayer, MessagePassing
 from torch.nn import Sequential as Seq, Linear as Lin, ReLU, Softplus, Sigmoid, Softmax
 from torch.autograd import Variable, grad
 
+from NeuGNN_model import grouped_heads
+
 class SDIdifftype(MessagePassing):
     def __init__(self, model, n_f, msg_dim, ndim, delt_t,hidden=50, aggr='add', flow='source_to_target'):
 
@@ -159,7 +161,8 @@ class SDIdifftype(MessagePassing):
             vij = torch.cat([vxij.reshape(-1,1), vyij.reshape(-1,1),vzij.reshape(-1,1)], dim=1)
             rij = torch.sqrt(xij**2+yij**2+zij**2)
 
-        Message = self.msg_fnc_cohesion(rij.reshape(-1,1))*Rij*vision.reshape(-1,1)+self.msg_fnc_align(rij.reshape(-1,1))*vij*vision.reshape(-1,1)#+self.msg_fnc_repulsion(rij.reshape(-1,1))*Rij
+        cohesion, align = grouped_heads([self.msg_fnc_cohesion, self.msg_fnc_align], rij.reshape(-1,1))
+        Message = cohesion*Rij*vision.reshape(-1,1)+align*vij*vision.reshape(-1,1)#+self.msg_fnc_repulsion(rij.reshape(-1,1))*Rij
         #print(torch.sum(self.msg_fnc_cohesion(rij)))
         return Message
     
@@ -183,15 +186,13 @@ class SDIdifftype(MessagePassing):
             Vi = torch.sqrt(vxi**2+vyi**2)
             Vx = torch.cat([Vi.reshape(-1,1),vxi.reshape(-1,1)],dim=1)
             Vy = torch.cat([Vi.reshape(-1,1),vyi.reshape(-1,1)],dim=1)
-            Fx = self.node_fnc_strength_x(Vx)
-            Fy = self.node_fnc_strength_y(Vy)
+            Fx, Fy = grouped_heads([self.node_fnc_strength_x, self.node_fnc_strength_y], [Vx, Vy])
             F = torch.cat((Fx,Fy),dim=1)
             #dvdt = F*vi+aggr_out
             dvdt = F+aggr_out
             v_update = x[:,self.ndim:]+dvdt*self.delt_t
             v_mean = x[:,self.ndim:]+dvdt*self.delt_t
-            v_var_x = self.stochastic_x(x)
-            v_var_y = self.stochastic_y(x)
+            v_var_x, v_var_y = grouped_heads([self.stochastic_x, self.stochastic_y], x)
             x_update = x[:,:self.ndim]+x[:,self.ndim:]*self.delt_t+v_update*self.delt_t
             return torch.distributions.Normal(v_mean[:,0].reshape(-1,1), v_var_x),torch.distributions.Normal(v_mean[:,1].reshape(-1,1), v_var_y),x_update,v_update,dvdt
         elif self.ndim==3:
@@ -204,9 +205,7 @@ class SDIdifftype(MessagePassing):
             dvdt = F*vi+aggr_out
             v_update = x[:,self.ndim:]+dvdt*self.delt_t
             v_mean = x[:,self.ndim:]+dvdt*self.delt_t
-            v_var_x = self.stochastic_x(x)
-            v_var_y = self.stochastic_y(x)
-            v_var_z = self.stochastic_z(x)
+            v_var_x, v_var_y, v_var_z = grouped_heads([self.stochastic_x, self.stochastic_y, self.stochastic_z], x)
             x_update = x[:,:self.ndim]+x[:,self.ndim:]*self.delt_t+v_update*self.delt_t
             return torch.distributions.Normal(v_mean[:,0].reshape(-1,1), v_var_x),torch.distributions.Normal(v_mean[:,1].reshape(-1,1), v_var_y),torch.distributions.Normal(v_mean[:,2].reshape(-1,1), v_var_z),x_update,v_update,dvdt
 
@@ -0,0 +1,146 @@
+"""Library cache
+   Content-addressed on-disk cache of self and coupled library matrices.
+
+The key of an entry is a hash of the input arrays (bytes, dtype and shape), the
+library configuration (family flags, orders, sigmoid/Hill grids) and the source
+of the library module, so that editing a library invalidates its old entries.
+Entries are stored as .npy files and loaded memory-mapped; the least recently
+used entries are evicted once the cache grows beyond max_bytes.
+"""
+
+import os
+import json
+import hashlib
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+import Self_func
+import Interaction_func
+import Library_stream
+
+def module_digest(module):
+    with open(module.__file__, 'rb') as f:
+        return hashlib.blake2b(f.read(), digest_size=16).hexdigest()
+
+class LibraryCache:
+    def __init__(self, directory=os.path.join('~', '.cache', 'network-sde-library'), max_bytes=16*2**30, chunk_size=2**16):
+        self.directory = os.path.expanduser(directory)
+        self.max_bytes = max_bytes
+        self.chunk_size = chunk_size
+        os.makedirs(self.directory, exist_ok=True)
+
+    def key(self, kind, arrays, config):
+        h = hashlib.blake2b(digest_size=20)
+        h.update(json.dumps([kind, config], sort_keys=True).encode())
+        for array in arrays:
+            array = np.ascontiguousarray(array)
+            h.update(json.dumps([array.dtype.str, array.shape]).encode())
+            h.update(memoryview(array).cast('B'))
+        return h.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key+'.npy'), os.path.join(self.directory, key+'.json')
+
+    def get(self, key):
+        """Return (memmap, names) of a cached entry, or None."""
+        matrix_path, names_path = self.path(key)
+        try:
+            with open(names_path) as f:
+                names = json.load(f)
+            Matrix = np.load(matrix_path, mmap_mode='r')
+        except (OSError, ValueError):
+            return None
+        # touching the names file marks the entry as recently used
+        os.utime(names_path)
+        return Matrix, names
+
+    def put(self, key, stream):
+        """Evaluate a Library_stream.LibraryStream into the cache and return (memmap, names)."""
+        matrix_path, names_path = self.path(key)
+        fd, tmp_path = tempfile.mkstemp(suffix='.npy', dir=self.directory)
+        os.close(fd)
+        try:
+            stream.to_npy(tmp_path)
+            os.replace(tmp_path, matrix_path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        with open(names_path, 'w') as f:
+            json.dump(stream.names, f)
+        self.evict(keep=key)
+        return np.load(matrix_path, mmap_mode='r'), stream.names
+
+    def entries(self):
+        """(last access, bytes, key) of every complete entry."""
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'):
+                continue
+            key = name[:-len('.json')]
+            matrix_path, names_path = self.path(key)
+            try:
+                entries.append((os.path.getmtime(names_path), os.path.getsize(matrix_path), key))
+            except OSError:
+                continue
+        return entries
+
+    def evict(self, keep=None):
+        entries = sorted(self.entries())
+        total = sum(size for last_use, size, key in entries)
+        for last_use, size, key in entries:
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            for path in self.path(key):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            total = total-size
+
+    def clear(self):
+        for last_use, size, key in self.entries():
+            for path in self.path(key):
+                os.remove(path)
+
+    def cached(self, kind, arrays, config, stream):
+        key = self.key(kind, arrays, config)
+        entry = self.get(key)
+        if entry is None:
+            entry = self.put(key, stream())
+        return entry
+
+    def self_ElementaryFunctions_Array(self, TimeSeries, dim, selfPolyOrder, PolynomialIndex = True, TrigonometricIndex = True, \
+        ExponentialIndex = True, FractionalIndex = True, ActivationIndex = True):
+        """Cached Self_func.self_ElementaryFunctions_Array, returns a read-only memmap and the names."""
+        TimeSeries = np.asarray(TimeSeries)[:,:dim]
+        flags = (PolynomialIndex, TrigonometricIndex, ExponentialIndex, FractionalIndex, ActivationIndex)
+        config = dict(dim=dim, selfPolyOrder=selfPolyOrder, flags=flags, alpha=Self_func.Sigmoid_alpha,
+                      beta=Self_func.Sigmoid_beta, gamma=Self_func.Regulation_gamma, source=module_digest(Self_func))
+        stream = lambda: Library_stream.self_ElementaryFunctions_Chunks(TimeSeries, dim, selfPolyOrder, *flags, \
+            chunk_size=self.chunk_size)
+        return self.cached('self', [TimeSeries], config, stream)
+
+    def ElementaryFunctions_Array(self, xi, xj, coupledPolyOrder = 1, CoupledPolynomialIndex = True, \
+        CoupledTrigonometricIndex = True, CoupledExponentialIndex = True, CoupledFractionalIndex = True, \
+            CoupledActivationIndex = True):
+        """Cached Interaction_func.ElementaryFunctions_Array, returns a read-only memmap and the names."""
+        xi = np.asarray(xi)
+        xj = np.asarray(xj)
+        flags = (CoupledPolynomialIndex, CoupledTrigonometricIndex, CoupledExponentialIndex, \
+            CoupledFractionalIndex, CoupledActivationIndex)
+        config = dict(coupledPolyOrder=coupledPolyOrder, flags=flags, source=module_digest(Interaction_func))
+        stream = lambda: Library_stream.ElementaryFunctions_Chunks(xi, xj, coupledPolyOrder, *flags, \
+            chunk_size=self.chunk_size)
+        return self.cached('coupled', [xi, xj], config, stream)
+
+    def self_ElementaryFunctions_Matrix(self, *args, **kwargs):
+        Matrix, names = self.self_ElementaryFunctions_Array(*args, **kwargs)
+        return pd.DataFrame(data = Matrix, columns = names, copy = False)
+
+    def ElementaryFunctions_Matrix(self, *args, **kwargs):
+        Matrix, names = self.ElementaryFunctions_Array(*args, **kwargs)
+        return pd.DataFrame(data = Matrix, columns = names, copy = False)
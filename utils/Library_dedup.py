@@ -0,0 +1,79 @@
+"""Library dedup
+   Evaluate the self and coupled libraries on the unique input rows only.
+
+The extracted messages and self dynamics repeat the same node states many times
+(every snapshot gathers x over all edges). The functions below hash the input
+rows, build the library on the unique rows and return the inverse index and the
+multiplicity of every unique row.
+
+Either expand back with Matrix[inverse], or regress on the unique rows directly:
+with y_unique = unique_targets(y, inverse, counts) and sample_weight = counts the
+weighted least squares (and Lasso) objective equals the one on all rows up to a
+constant, so library and regression cost both shrink by the duplication factor.
+"""
+
+import numpy as np
+import pandas as pd
+
+import Self_func
+import Interaction_func
+
+def unique_rows(Matrix):
+    """Unique rows of a 2-D array by hashing.
+
+    Returns (unique, inverse, counts) with unique[inverse] == Matrix; unique rows
+    keep the order of their first occurrence.
+    """
+    Matrix = np.asarray(Matrix)
+    if Matrix.ndim == 1:
+        Matrix = Matrix.reshape(-1,1)
+    if len(Matrix) == 0:
+        return Matrix.copy(), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    # -0.0 and 0.0 hash differently, normalize them
+    Matrix = Matrix+0.
+    row_hash = pd.util.hash_array(np.ascontiguousarray(Matrix[:,0]))
+    for k in range(1,np.size(Matrix,1)):
+        row_hash = row_hash*np.uint64(1000003) ^ pd.util.hash_array(np.ascontiguousarray(Matrix[:,k]))
+    inverse, first = pd.factorize(row_hash)
+    representative = np.zeros(len(first), dtype=np.int64)
+    representative[inverse[::-1]] = np.arange(len(inverse))[::-1]
+    unique = Matrix[representative]
+    if not np.array_equal(unique[inverse], Matrix, equal_nan=True):
+        # 64-bit hash collision, fall back to sorting
+        unique, representative, inverse = np.unique(Matrix, axis=0, return_index=True, return_inverse=True)
+        order = np.argsort(representative, kind='stable')
+        rank = np.empty_like(order)
+        rank[order] = np.arange(len(order))
+        unique = unique[order]
+        inverse = rank[inverse.reshape(-1)]
+    counts = np.bincount(inverse, minlength=len(unique))
+    return unique, inverse.astype(np.int64), counts
+
+def unique_targets(y, inverse, counts):
+    """Mean of the targets y (rows, or rows x targets) over every unique input row."""
+    y = np.asarray(y, dtype=np.float64)
+    flat = y.reshape(len(y),-1)
+    sums = np.zeros(shape=(len(counts),np.size(flat,1)))
+    np.add.at(sums, inverse, flat)
+    sums /= counts.reshape(-1,1)
+    return sums.reshape((len(counts),)+y.shape[1:])
+
+def self_ElementaryFunctions_Unique(TimeSeries, dim, selfPolyOrder, PolynomialIndex = True, TrigonometricIndex = True, \
+    ExponentialIndex = True, FractionalIndex = True, ActivationIndex = True):
+    """self_ElementaryFunctions_Matrix on the unique rows of TimeSeries[:, :dim].
+    Returns the library DataFrame of the unique rows, the inverse index and the counts."""
+    unique, inverse, counts = unique_rows(np.asarray(TimeSeries)[:,:dim])
+    Matrix = Self_func.self_ElementaryFunctions_Matrix(unique, dim, selfPolyOrder, PolynomialIndex, \
+        TrigonometricIndex, ExponentialIndex, FractionalIndex, ActivationIndex)
+    return Matrix, inverse, counts
+
+def ElementaryFunctions_Unique(xi, xj, coupledPolyOrder = 1, CoupledPolynomialIndex = True, \
+        CoupledTrigonometricIndex = True, CoupledExponentialIndex = True, CoupledFractionalIndex = True, \
+            CoupledActivationIndex = True):
+    """ElementaryFunctions_Matrix on the unique (xi, xj) pairs.
+    Returns the library DataFrame of the unique pairs, the inverse index and the counts."""
+    unique, inverse, counts = unique_rows(np.stack((np.asarray(xi), np.asarray(xj)), axis=1))
+    Matrix = Interaction_func.ElementaryFunctions_Matrix(unique[:,0], unique[:,1], coupledPolyOrder, \
+        CoupledPolynomialIndex, CoupledTrigonometricIndex, CoupledExponentialIndex, CoupledFractionalIndex, \
+            CoupledActivationIndex)
+    return Matrix, inverse, counts
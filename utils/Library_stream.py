@@ -0,0 +1,94 @@
+"""Streaming library
+   Row-chunked evaluation of the self and coupled libraries, so that the design
+   matrix never has to be held in memory at once."""
+
+import numpy as np
+from numpy.lib.format import open_memmap
+
+import Self_func
+import Interaction_func
+
+class LibraryStream:
+    """Library evaluated in row chunks.
+
+    fill(rows, out) writes the library of the rows selected by the slice `rows`
+    into `out`. Iterating yields (rows, block) pairs; block is a view into one
+    reused buffer and is only valid until the next step, copy it to keep it.
+    """
+    def __init__(self, fill, names, Timelength, chunk_size=2**16, dtype=np.float64):
+        self.fill = fill
+        self.names = list(names)
+        self.Timelength = int(Timelength)
+        self.chunk_size = int(chunk_size)
+        self.dtype = np.dtype(dtype)
+
+    @property
+    def shape(self):
+        return (self.Timelength, len(self.names))
+
+    def __len__(self):
+        return -(-self.Timelength//self.chunk_size)
+
+    def __iter__(self):
+        buffer = np.empty(shape=(min(self.chunk_size,self.Timelength),len(self.names)), dtype=self.dtype, order='F')
+        for start in range(0,self.Timelength,self.chunk_size):
+            rows = slice(start,min(start+self.chunk_size,self.Timelength))
+            block = buffer[:rows.stop-rows.start]
+            self.fill(rows, block)
+            yield rows, block
+
+    @classmethod
+    def from_array(cls, Matrix, names=None, chunk_size=2**16):
+        """Stream an already built (possibly memory-mapped) library."""
+        if names is None:
+            names = list(range(0,np.size(Matrix,1)))
+        def fill(rows, out):
+            out[...] = Matrix[rows]
+        return cls(fill, names, np.size(Matrix,0), chunk_size, Matrix.dtype)
+
+    def to_npy(self, filename):
+        """Write the library straight into a memory-mapped .npy file and return the memmap."""
+        Matrix = open_memmap(filename, mode='w+', dtype=self.dtype, shape=self.shape)
+        for rows, block in self:
+            Matrix[rows] = block
+        Matrix.flush()
+        return Matrix
+
+    def to_array(self):
+        Matrix = np.empty(shape=self.shape, dtype=self.dtype, order='F')
+        for rows, block in self:
+            Matrix[rows] = block
+        return Matrix
+
+
+def self_ElementaryFunctions_Chunks(TimeSeries, dim, selfPolyOrder, PolynomialIndex = True, TrigonometricIndex = True, \
+    ExponentialIndex = True, FractionalIndex = True, ActivationIndex = True, chunk_size = 2**16, dtype = np.float64):
+    """Self library of Self_func.self_ElementaryFunctions_Matrix as a LibraryStream."""
+    flags = (PolynomialIndex, TrigonometricIndex, ExponentialIndex, FractionalIndex, ActivationIndex)
+    plan = Self_func.self_library_plan(dim, selfPolyOrder, *flags)
+    names = [name for fill, kwargs, family_names in plan for name in family_names]
+    def fill(rows, out):
+        Self_func.self_ElementaryFunctions_Array(TimeSeries[rows], dim, selfPolyOrder, *flags, out=out)
+    return LibraryStream(fill, names, np.size(TimeSeries,0), chunk_size, dtype)
+
+def ElementaryFunctions_Chunks(xi, xj, coupledPolyOrder = 1, CoupledPolynomialIndex = True, \
+        CoupledTrigonometricIndex = True, CoupledExponentialIndex = True, CoupledFractionalIndex = True, \
+            CoupledActivationIndex = True, chunk_size = 2**16, dtype = np.float64):
+    """Coupled library of Interaction_func.ElementaryFunctions_Matrix as a LibraryStream."""
+    flags = (CoupledPolynomialIndex, CoupledTrigonometricIndex, CoupledExponentialIndex, \
+        CoupledFractionalIndex, CoupledActivationIndex)
+    plan = Interaction_func.coupled_library_plan(coupledPolyOrder, *flags)
+    names = [name for fill, kwargs, family_names in plan for name in family_names]
+    def fill(rows, out):
+        Interaction_func.ElementaryFunctions_Array(xi[rows], xj[rows], coupledPolyOrder, *flags, out=out)
+    return LibraryStream(fill, names, np.size(xi,0), chunk_size, dtype)
+
+def self_ElementaryFunctions_Memmap(filename, TimeSeries, dim, selfPolyOrder, chunk_size = 2**16, **kwargs):
+    """Write the self library into a memory-mapped .npy file. Returns the memmap and the column names."""
+    stream = self_ElementaryFunctions_Chunks(TimeSeries, dim, selfPolyOrder, chunk_size=chunk_size, **kwargs)
+    return stream.to_npy(filename), stream.names
+
+def ElementaryFunctions_Memmap(filename, xi, xj, coupledPolyOrder = 1, chunk_size = 2**16, **kwargs):
+    """Write the coupled library into a memory-mapped .npy file. Returns the memmap and the column names."""
+    stream = ElementaryFunctions_Chunks(xi, xj, coupledPolyOrder, chunk_size=chunk_size, **kwargs)
+    return stream.to_npy(filename), stream.names
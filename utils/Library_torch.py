@@ -0,0 +1,188 @@
+"""Torch libraries
+   Differentiable torch implementation of the self (Self_func) and coupled
+   (Interaction_func) libraries, with the same columns and names.
+
+SelfLibraryTorch maps node states x [N, n_f] (the input of node_fnc_.) and
+CoupledLibraryTorch maps tmp = [x_i[:,0], x_j[:,0]] [E, 2] (the input of msg_fnc)
+to the library [rows, Numfunc]. SparseLibraryLayer is a sparse linear combination of
+a library, so it can be used in place of msg_fnc / node_fnc_. in the SDI models,
+trained jointly with an l1 penalty, or fitted directly from the message tensors.
+"""
+
+import numpy as np
+import pandas as pd
+import torch
+from torch import nn
+
+import Self_func
+import Interaction_func
+
+def canonical(expr):
+    """Undo the numpy rewrite of sigmoid(u,1,0) as 1/(1+1/exp(u)), whose gradient is nan for exp(u) = 0."""
+    if not isinstance(expr, tuple):
+        return expr
+    if expr[0] == 'recip' and isinstance(expr[1], tuple) and expr[1][0] == 'add' and expr[1][2] == 1. \
+            and isinstance(expr[1][1], tuple) and expr[1][1][0] == 'recip' \
+            and isinstance(expr[1][1][1], tuple) and expr[1][1][1][0] == 'exp':
+        return ('sigmoid', canonical(expr[1][1][1][1]), 1, 0)
+    return tuple(canonical(arg) for arg in expr)
+
+Operations = {
+    'mul': torch.mul,
+    'sub': torch.sub,
+    'add': torch.add,
+    'div': torch.div,
+    'square': torch.square,
+    'recip': torch.reciprocal,
+    'sin': torch.sin,
+    'cos': torch.cos,
+    'tan': torch.tan,
+    'exp': torch.exp,
+    'tanh': torch.tanh,
+    'sigmoid': lambda u, alpha, beta: torch.sigmoid(alpha*(u-beta)),
+    'hill': lambda p: p/(p+1),
+}
+
+def evaluate_library(columns, variables):
+    """Torch counterpart of Interaction_func.evaluate_library, returns [rows, len(columns)]."""
+    memo = dict(variables)
+
+    def value(expr):
+        if expr not in memo:
+            args = [value(arg) if isinstance(arg, (tuple, str)) else arg for arg in expr[1:]]
+            memo[expr] = Operations[expr[0]](*args)
+        return memo[expr]
+
+    return torch.stack([value(expr) for expr in columns], dim=1)
+
+
+class CoupledLibraryTorch(nn.Module):
+    """Coupled library of Interaction_func.ElementaryFunctions_Matrix on tmp = [xi, xj]."""
+    def __init__(self, coupledPolyOrder = 1, CoupledPolynomialIndex = True, CoupledTrigonometricIndex = True, \
+            CoupledExponentialIndex = True, CoupledFractionalIndex = True, CoupledActivationIndex = True):
+        super(CoupledLibraryTorch, self).__init__()
+        plan = Interaction_func.coupled_library_plan(coupledPolyOrder, CoupledPolynomialIndex, \
+            CoupledTrigonometricIndex, CoupledExponentialIndex, CoupledFractionalIndex, CoupledActivationIndex)
+        columns = [column for family, kwargs, names in plan for column in family(**kwargs)]
+        self.names = [name for name, expr in columns]
+        self.columns = [canonical(expr) for name, expr in columns]
+
+    def forward(self, tmp):
+        return evaluate_library(self.columns, dict(xi=tmp[:,0], xj=tmp[:,1]))
+
+
+class SelfLibraryTorch(nn.Module):
+    """Self library of Self_func.self_ElementaryFunctions_Matrix on the first dim features of x."""
+    def __init__(self, dim, selfPolyOrder, PolynomialIndex = True, TrigonometricIndex = True, \
+            ExponentialIndex = True, FractionalIndex = True, ActivationIndex = True):
+        super(SelfLibraryTorch, self).__init__()
+        self.dim = dim
+        self.selfPolyOrder = selfPolyOrder
+        self.flags = (PolynomialIndex, TrigonometricIndex, ExponentialIndex, FractionalIndex, ActivationIndex)
+        plan = Self_func.self_library_plan(dim, selfPolyOrder, *self.flags)
+        self.names = [name for fill, kwargs, family_names in plan for name in family_names]
+        exponents, parent, last, degrees = Self_func.Polynomial_table(dim, selfPolyOrder)
+        self.register_buffer('parent', torch.as_tensor(parent), persistent=False)
+        self.register_buffer('last', torch.as_tensor(last), persistent=False)
+        self.degrees = degrees
+        self.register_buffer('alpha', torch.tensor(Self_func.Sigmoid_alpha, dtype=torch.float32).reshape(-1,1), persistent=False)
+        self.register_buffer('beta', torch.tensor(Self_func.Sigmoid_beta, dtype=torch.float32), persistent=False)
+        self.register_buffer('gamma', torch.tensor(Self_func.Regulation_gamma, dtype=torch.float32), persistent=False)
+
+    def polynomial(self, x):
+        full = x
+        for block in self.degrees[1:]:
+            full = torch.cat([full, full[:,self.parent[block]]*x[:,self.last[block]]], dim=1)
+        return full
+
+    def forward(self, x):
+        x = x[:,:self.dim]
+        PolynomialIndex, TrigonometricIndex, ExponentialIndex, FractionalIndex, ActivationIndex = self.flags
+        blocks = []
+        if PolynomialIndex == True:
+            blocks.append(self.polynomial(x))
+        if TrigonometricIndex == True:
+            blocks += [torch.sin(x), torch.cos(x), torch.tan(x)]
+        if ExponentialIndex == True:
+            blocks.append(torch.exp(x))
+        if FractionalIndex == True:
+            blocks.append(torch.reciprocal(x))
+        if ActivationIndex == True:
+            # (rows, dimension, alpha, beta) and (rows, dimension, gamma) flatten in the order of Self_func
+            sig = torch.sigmoid(self.alpha.to(x.dtype)*(x[:,:,None,None]-self.beta.to(x.dtype)))
+            blocks.append(sig.reshape(x.shape[0],-1))
+            blocks.append(torch.tanh(x))
+            p = x[:,:,None]**self.gamma.to(x.dtype)
+            blocks.append((p/(p+1)).reshape(x.shape[0],-1))
+        return torch.cat(blocks, dim=1)
+
+
+class SparseLibraryLayer(nn.Module):
+    """Sparse linear combination of a library: out = (library(input)[:, active]/scale) @ coef.
+
+    scale holds the mean absolute value of every column (the l1 normalization of the
+    discovery step), active excludes columns that are not finite on the data.
+    Train jointly by adding l1_penalty() to the loss, or call fit() on the
+    in-memory inputs and targets.
+    """
+    def __init__(self, library, out_features = 1):
+        super(SparseLibraryLayer, self).__init__()
+        self.library = library
+        Numfunc = len(library.names)
+        self.coef = nn.Parameter(torch.zeros(Numfunc, out_features))
+        self.register_buffer('scale', torch.ones(Numfunc))
+        self.register_buffer('active', torch.ones(Numfunc, dtype=torch.bool))
+
+    @property
+    def names(self):
+        return self.library.names
+
+    def forward(self, inputs):
+        """Evaluated in the dtype of coef (layer.double() for float64), whatever the dtype of inputs."""
+        Theta = self.library(inputs)[:,self.active].to(self.coef.dtype)
+        return Theta/self.scale[self.active].to(self.coef.dtype) @ self.coef[self.active]
+
+    def l1_penalty(self):
+        return torch.sum(torch.abs(self.coef[self.active]))
+
+    @torch.no_grad()
+    def calibrate(self, inputs):
+        """Set scale and active from the library evaluated on inputs."""
+        Theta = self.library(inputs)
+        finite = torch.isfinite(Theta).all(dim=0)
+        scale = torch.where(finite, Theta.abs().mean(dim=0), torch.ones_like(self.scale))
+        self.active.copy_(finite & (scale > 0))
+        self.scale.copy_(torch.where(self.active, scale, torch.ones_like(scale)))
+        return Theta
+
+    @torch.no_grad()
+    def fit(self, inputs, targets, alpha = 1e-3, max_iter = 5000, tol = 1e-8):
+        """Lasso fit of the coefficients, 1/(2n)||targets - Theta coef||^2 + alpha*||coef||_1 on the
+        normalized library, by accelerated proximal gradient (FISTA) on the Gram matrix."""
+        Theta = self.calibrate(inputs)[:,self.active]/self.scale[self.active]
+        targets = targets.reshape(len(targets),-1).to(Theta.dtype)
+        n = Theta.shape[0]
+        G = Theta.T @ Theta/n
+        b = Theta.T @ targets/n
+        L = torch.linalg.eigvalsh(G)[-1].clamp_min(1e-12)
+        w = torch.zeros_like(b)
+        z = w.clone()
+        t = 1.
+        for it in range(max_iter):
+            step = z-(G @ z-b)/L
+            w_new = torch.sign(step)*torch.clamp(step.abs()-alpha/L, min=0)
+            t_new = (1+np.sqrt(1+4*t*t))/2
+            z = w_new+(t-1)/t_new*(w_new-w)
+            change = torch.max(torch.abs(w_new-w))
+            w, t = w_new, t_new
+            if change < tol:
+                break
+        self.coef.zero_()
+        self.coef[self.active] = w.to(self.coef.dtype)
+        return self
+
+    def coefficients(self):
+        """Coefficients in the original (unnormalized) units, as a DataFrame indexed by the names."""
+        coef = (self.coef/self.scale.reshape(-1,1)).detach().cpu().numpy()
+        coef[~self.active.cpu().numpy()] = 0.
+        return pd.DataFrame(data = coef, index = self.names)
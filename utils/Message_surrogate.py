@@ -0,0 +1,197 @@
+"""Message surrogate
+   Tabulated replacements of the trained low-dimensional message functions for fast rollouts.
+
+msg_fnc of SDI / SDIw takes tmp = [x_i[:,0], x_j[:,0]] (2 inputs), msg_fnc_excit / msg_fnc_inh
+the same, msg_fnc_cohesion / msg_fnc_align of the flock models the distance rij (1 input).
+After training, tabulate() evaluates such a function once on a rectilinear grid over the
+range of its observed inputs, refining the grid intervals whose midpoint error exceeds tol
+(the error away from the midpoints can be larger, error_ records it on the inputs),
+and TabulatedFunction replaces it by vectorized interpolation (linear / bilinear, or cubic
+Hermite with finite difference slopes). surrogate() returns a copy of a model with its
+message functions tabulated, the inputs being recorded from a pass over the data.
+Inputs outside the tabulated range are clamped to it, margin widens the range beyond
+the observed one.
+"""
+
+import copy
+import warnings
+
+import numpy as np
+import torch
+from torch import nn
+
+
+def hermite(t):
+    """Cubic Hermite basis h00, h10, h01, h11 at t."""
+    t2 = t*t
+    t3 = t2*t
+    return 2*t3-3*t2+1, t3-2*t2+t, -2*t3+3*t2, t3-t2
+
+def mesh(grids):
+    """Points [prod(n_k), D] of the rectilinear grid, the last axis fastest."""
+    return np.stack(np.meshgrid(*grids, indexing='ij'), axis=-1).reshape(-1, len(grids))
+
+
+class TabulatedFunction(nn.Module):
+    """Interpolation of a table values [n_0, (n_1,) out] on the grids [n_0] (, [n_1])."""
+    def __init__(self, grids, values, method='cubic'):
+        super(TabulatedFunction, self).__init__()
+        if method not in ('linear', 'cubic'):
+            raise ValueError('method must be linear or cubic')
+        if len(grids) not in (1, 2):
+            raise ValueError('only functions of 1 or 2 inputs are tabulated')
+        self.method = method
+        self.dim = len(grids)
+        values = np.asarray(values, dtype=np.float64)
+        for k, grid in enumerate(grids):
+            self.register_buffer('grid%d' % k, torch.as_tensor(np.asarray(grid, dtype=np.float64)))
+        self.register_buffer('values', torch.as_tensor(values))
+        if method == 'cubic':
+            # slopes (and the cross derivative in 2-D) from second order finite differences
+            derivatives = np.gradient(values, *grids, axis=tuple(range(self.dim)))
+            derivatives = [derivatives] if self.dim == 1 else list(derivatives)
+            if self.dim == 2:
+                derivatives.append(np.gradient(derivatives[0], grids[1], axis=1))
+            self.register_buffer('derivatives', torch.as_tensor(np.stack(derivatives)))
+        self.error_ = None
+
+    @property
+    def grids(self):
+        return [getattr(self, 'grid%d' % k) for k in range(self.dim)]
+
+    def locate(self, grid, u):
+        """Cell index, cell width and position in the cell [0, 1] of u on grid."""
+        i = torch.clamp(torch.searchsorted(grid, u.contiguous(), right=True)-1, 0, len(grid)-2)
+        h = grid[i+1]-grid[i]
+        return i, h, torch.clamp((u-grid[i])/h, 0, 1)
+
+    def forward(self, inputs):
+        u = inputs.to(self.values.dtype)
+        if self.dim == 1:
+            i, h, t = self.locate(self.grid0, u[:,0])
+            F = self.values
+            if self.method == 'linear':
+                w = t.unsqueeze(1)
+                out = F[i]*(1-w)+F[i+1]*w
+            else:
+                D = self.derivatives[0]
+                h00, h10, h01, h11 = [b.unsqueeze(1) for b in hermite(t)]
+                h = h.unsqueeze(1)
+                out = h00*F[i]+h10*h*D[i]+h01*F[i+1]+h11*h*D[i+1]
+            return out.to(inputs.dtype)
+        i, hx, t = self.locate(self.grid0, u[:,0])
+        j, hy, s = self.locate(self.grid1, u[:,1])
+        F = self.values
+        if self.method == 'linear':
+            t, s = t.unsqueeze(1), s.unsqueeze(1)
+            out = (F[i,j]*(1-t)+F[i+1,j]*t)*(1-s)+(F[i,j+1]*(1-t)+F[i+1,j+1]*t)*s
+            return out.to(inputs.dtype)
+        Fx, Fy, Fxy = self.derivatives
+        bt = [b.unsqueeze(1) for b in hermite(t)]
+        bs = [b.unsqueeze(1) for b in hermite(s)]
+        hx, hy = hx.unsqueeze(1), hy.unsqueeze(1)
+        out = 0
+        for a in (0, 1):
+            for b in (0, 1):
+                # value and slope basis of corner (i+a, j+b): h00/h10 at the left end, h01/h11 at the right
+                vt, dt = (bt[0], bt[1]) if a == 0 else (bt[2], bt[3])
+                vs, ds = (bs[0], bs[1]) if b == 0 else (bs[2], bs[3])
+                out = out+vt*vs*F[i+a,j+b]+dt*hx*vs*Fx[i+a,j+b]+vt*ds*hy*Fy[i+a,j+b]+dt*ds*hx*hy*Fxy[i+a,j+b]
+        return out.to(inputs.dtype)
+
+
+@torch.no_grad()
+def evaluate(fnc, points, chunk_size=2**16):
+    """fnc on points [rows, D] (numpy) in chunks, returns a float64 array [rows, out]."""
+    parameters = list(fnc.parameters()) if isinstance(fnc, nn.Module) else []
+    dtype = parameters[0].dtype if parameters else torch.float32
+    device = parameters[0].device if parameters else 'cpu'
+    out = [fnc(torch.as_tensor(points[start:start+chunk_size], dtype=dtype, device=device)).double().cpu().numpy()
+        for start in range(0, len(points), chunk_size)]
+    return np.concatenate(out).reshape(len(points), -1)
+
+def tabulate(fnc, inputs, tol=1e-3, method='cubic', n_init=17, max_points=2**20, max_refinements=16, margin=0.05):
+    """TabulatedFunction of fnc on the range of inputs [rows, D], D = 1 or 2.
+
+    Starting from n_init points per axis, every grid interval whose cell midpoints have an
+    absolute error above tol is bisected, until all midpoints are within tol or the table
+    would exceed max_points. tol bounds the error at the cell midpoints only; error_ of the
+    result is the max error on the inputs, with a warning when it is above tol.
+    """
+    inputs = np.asarray(torch.as_tensor(inputs).detach().cpu().double()).reshape(len(inputs), -1)
+    D = inputs.shape[1]
+    if D not in (1, 2):
+        raise ValueError('only functions of 1 or 2 inputs are tabulated, got %d' % D)
+    lo, hi = inputs.min(axis=0), inputs.max(axis=0)
+    span = np.where(hi > lo, hi-lo, 1.)
+    grids = [np.linspace(lo[k]-margin*span[k], hi[k]+margin*span[k], n_init) for k in range(D)]
+    for refinement in range(max_refinements+1):
+        table = TabulatedFunction(grids, evaluate(fnc, mesh(grids)).reshape(*[len(g) for g in grids], -1), method)
+        centers = [0.5*(g[1:]+g[:-1]) for g in grids]
+        points = mesh(centers)
+        error = np.abs(table(torch.as_tensor(points)).numpy()-evaluate(fnc, points)).max(axis=1)
+        error = error.reshape([len(c) for c in centers])
+        bad = [np.flatnonzero(error.max(axis=tuple(a for a in range(D) if a != k)) > tol) for k in range(D)]
+        if all(len(b) == 0 for b in bad):
+            break
+        size = np.prod([len(g)+len(b) for g, b in zip(grids, bad)])
+        if size > max_points or refinement == max_refinements:
+            warnings.warn('tabulated with max midpoint error %.3g > tol %.3g (%d points)' % (error.max(), tol, table.values[...,0].numel()))
+            break
+        grids = [np.sort(np.concatenate([g, c[b]])) for g, c, b in zip(grids, centers, bad)]
+    table.error_ = float(np.abs(table(torch.as_tensor(inputs)).numpy()-evaluate(fnc, inputs)).max())
+    if table.error_ > tol:
+        warnings.warn('tabulated with max error %.3g > tol %.3g on the inputs (tol is checked at the cell midpoints)' % (table.error_, tol))
+    return table
+
+
+def record_inputs(model, names, graphs, max_samples=10**6):
+    """Inputs of the submodules names over the model forward on graphs (objects with x and edge_index),
+    the submodules that are never called are left out."""
+    records = {name: [] for name in names}
+    hooks = [getattr(model, name).register_forward_pre_hook(lambda module, args, name=name: records[name].append(args[0].detach()))
+        for name in names]
+    try:
+        with torch.no_grad():
+            for g in graphs:
+                model(g.x, g.edge_index)
+    finally:
+        for hook in hooks:
+            hook.remove()
+    inputs = {}
+    for name, chunks in records.items():
+        if not chunks:
+            continue
+        values = torch.cat(chunks).reshape(sum(len(c) for c in chunks), -1)
+        if len(values) > max_samples:
+            values = values[torch.randperm(len(values))[:max_samples]]
+        inputs[name] = values
+    return inputs
+
+def message_functions(model):
+    """Names of the message heads (msg_fnc*) of model with at most 2 inputs."""
+    names = []
+    for name, module in model.named_children():
+        linear = [layer for layer in module.modules() if isinstance(layer, nn.Linear)]
+        if name.startswith('msg_fnc') and linear and linear[0].in_features <= 2:
+            names.append(name)
+    return names
+
+def surrogate(model, graphs, names=None, tol=1e-3, method='cubic', **kwargs):
+    """Copy of model whose message functions names (default: message_functions(model)) are
+    tabulated on the inputs they receive over graphs; the errors are in errors_."""
+    requested = names is not None
+    names = message_functions(model) if names is None else list(names)
+    inputs = record_inputs(model, names, graphs)
+    unused = [name for name in names if name not in inputs]
+    if requested and unused:
+        raise ValueError('%s not called in the forward of the model' % ', '.join(unused))
+    names = [name for name in names if name in inputs]
+    fast = copy.deepcopy(model)
+    fast.errors_ = {}
+    for name in names:
+        table = tabulate(getattr(model, name), inputs[name], tol=tol, method=method, **kwargs)
+        parameter = next(model.parameters())
+        setattr(fast, name, table.to(device=parameter.device, dtype=parameter.dtype))
+        fast.errors_[name] = table.error_
+    return fast
@@ -0,0 +1,278 @@
+"""Model compiler
+   Compile discovered terms and coefficients into one fused drift / diffusion function.
+
+The discovered network SDE is
+
+    dx_i,d = [ sum_k c_dk phi_k(x_i) + sum_j w_ij sum_l a_dl g_l(x_i, x_j) ] dt + sigma_d(x_i) dW_i,d
+
+with phi_k, sigma_d from the self library (Self_func names, e.g. x1x2, sinx1,
+sig_x1_105, regx1_2) and g_l from the coupled library (Interaction_func names, e.g.
+xjMinusxi, xisigmoidxj, or the multi-dimensional names xj_2, w1*xixj_1). Every name
+is mapped to the expression tuples of Interaction_func, all outputs are merged
+into one DAG (shared subexpressions are computed once) and emitted as Python
+source over numpy or torch. The sum over neighbours is a scatter over the
+edge_index targets (source_to_target: xi = x[edge_index[1]], xj = x[edge_index[0]]).
+x may carry leading batch axes, [..., N, dim].
+"""
+
+import re
+
+import numpy as np
+import pandas as pd
+
+import Self_func
+import Interaction_func
+
+def product(factors):
+    expr = factors[0]
+    for factor in factors[1:]:
+        expr = ('mul', expr, factor)
+    return expr
+
+def self_columns(dim, selfPolyOrder):
+    """(name, expression) of every self library column, in the order of Self_func."""
+    leaves = Self_func.dimension_names(dim)
+    exponents, parent, last, degrees = Self_func.Polynomial_table(dim, selfPolyOrder)
+    columns = []
+    for exponent in exponents:
+        columns.append(product([Interaction_func.power(leaves[k], int(e)) for k, e in enumerate(exponent) if e > 0]))
+    for op in ('sin', 'cos', 'tan', 'exp', 'recip'):
+        columns += [(op, leaf) for leaf in leaves]
+    for leaf in leaves:
+        columns += [('sigmoid', leaf, alpha, beta) for alpha in Self_func.Sigmoid_alpha for beta in Self_func.Sigmoid_beta]
+    columns += [('tanh', leaf) for leaf in leaves]
+    for leaf in leaves:
+        columns += [('hill', Interaction_func.power(leaf, gamma)) for gamma in Self_func.Regulation_gamma]
+    plan = Self_func.self_library_plan(dim, selfPolyOrder)
+    names = [name for fill, kwargs, family_names in plan for name in family_names]
+    return list(zip(names, columns))
+
+def coupled_columns(dim, Nattr, coupledPolyOrder):
+    """(name, expression) of the coupled library and of its multi-dimensional form."""
+    plan = Interaction_func.coupled_library_plan(coupledPolyOrder)
+    columns = [column for family, kwargs, names in plan for column in family(**kwargs)]
+    return columns+Interaction_func.Coupled_Multidim_columns(dim, Nattr, coupledPolyOrder)
+
+def expression_table(names, dim, Nattr=0):
+    """Expressions of the given self / coupled names, 'constant' maps to 1."""
+    selfPolyOrder = max([name.count('x') for name in names if re.fullmatch(r'(x\d+)+', name)]+[1])
+    coupledPolyOrder = max([int(k) for name in names for k in re.findall(r'pow(\d+)', name)]+[1])
+    table = dict(self_columns(dim, selfPolyOrder))
+    table.update(coupled_columns(dim, Nattr, coupledPolyOrder))
+    table['constant'] = 1.
+    missing = [name for name in names if name not in table]
+    if missing:
+        raise KeyError('unknown library terms: '+', '.join(missing))
+    return table
+
+def terms_of(terms):
+    """Nonzero (name, coefficient) pairs of a Series, dict or list of pairs."""
+    if terms is None:
+        return []
+    if isinstance(terms, pd.Series):
+        terms = terms.items()
+    elif isinstance(terms, dict):
+        terms = terms.items()
+    return [(name, float(coef)) for name, coef in terms if coef != 0]
+
+def per_dimension(terms, dim, first_only=False):
+    """Broadcast a single Series / dict (dimension 0 if first_only, else every dimension) to a list."""
+    if terms is None or isinstance(terms, (pd.Series, dict)) or np.isscalar(terms):
+        return [terms]+[None]*(dim-1) if first_only else [terms]*dim
+    return list(terms)+[None]*(dim-len(terms))
+
+def linear(terms, table):
+    """Expression of sum coef*term, or None for no terms."""
+    expr = None
+    for name, coef in terms:
+        term = table[name]
+        term = coef if term == 1. else (term if coef == 1. else ('mul', term, coef))
+        expr = term if expr is None else ('add', expr, term)
+    return expr
+
+
+Templates = {
+    'numpy': {
+        'mul': '{0}*{1}', 'sub': '{0}-{1}', 'add': '{0}+{1}', 'div': '{0}/{1}', 'square': '{0}*{0}', 'recip': '1/{0}',
+        'sin': 'lib.sin({0})', 'cos': 'lib.cos({0})', 'tan': 'lib.tan({0})', 'exp': 'lib.exp({0})', 'tanh': 'lib.tanh({0})',
+        'sigmoid': '1/(1+lib.exp(-{1}*({0}-{2})))', 'hill': '{0}/({0}+1)',
+    },
+    'torch': {
+        'mul': '{0}*{1}', 'sub': '{0}-{1}', 'add': '{0}+{1}', 'div': '{0}/{1}', 'square': '{0}*{0}', 'recip': '1/{0}',
+        'sin': 'lib.sin({0})', 'cos': 'lib.cos({0})', 'tan': 'lib.tan({0})', 'exp': 'lib.exp({0})', 'tanh': 'lib.tanh({0})',
+        'sigmoid': 'lib.sigmoid({1}*({0}-{2}))', 'hill': '{0}/({0}+1)',
+    },
+}
+
+def leaf_source(leaf):
+    """Source of a leaf: node variables x1.., edge variables xi/xj(1..) and edge attributes w1.."""
+    match = re.fullmatch(r'x(\d+)', leaf)
+    if match:
+        return 'x[...,{}]'.format(int(match.group(1))-1)
+    match = re.fullmatch(r'x([ij])(\d*)', leaf)
+    if match:
+        index = 'target' if match.group(1) == 'i' else 'source'
+        return 'x[...,{},{}]'.format(index, int(match.group(2) or 1)-1)
+    match = re.fullmatch(r'w(\d+)', leaf)
+    if match:
+        return 'edge_attr[:,{}]'.format(int(match.group(1))-1)
+    raise KeyError(leaf)
+
+def generate(name, outputs, backend):
+    """Source of def name(x): returning lib.stack(outputs, -1).
+
+    outputs are pairs (node expression, edge expression) per dimension; the edge
+    part is multiplied by the edge weights and scattered to the targets.
+    """
+    template = Templates[backend]
+    lines = []
+    memo = {}
+
+    def emit(expr):
+        if not isinstance(expr, (tuple, str)):
+            return repr(float(expr))
+        if expr not in memo:
+            if isinstance(expr, str):
+                code = leaf_source(expr)
+            else:
+                code = template[expr[0]].format(*[emit(arg) for arg in expr[1:]])
+            memo[expr] = 't'+str(len(memo))
+            lines.append('    {} = {}'.format(memo[expr], code))
+        return memo[expr]
+
+    results = []
+    for node, edge in outputs:
+        parts = []
+        if node is not None:
+            parts.append(emit(node))
+        if edge is not None:
+            message = emit(edge)
+            lines.append('    a{} = scatter(weights*{})'.format(len(results), message))
+            parts.append('a'+str(len(results)))
+        if edge is None and not isinstance(node, (tuple, str)):
+            # constants and missing dimensions broadcast to the node shape
+            parts.append('zeros')
+        lines.append('    f{} = {}'.format(len(results), '+'.join(parts)))
+        results.append('f'+str(len(results)))
+    body = ['def {}(x):'.format(name), '    zeros = lib.zeros_like(x[...,0])']
+    if backend == 'torch' and any(edge is not None for node, edge in outputs):
+        # graph constants in the dtype and on the device of x
+        body.append('    source, target, weights, edge_attr = constants(x)')
+    body += lines
+    body.append('    return lib.stack([{}], -1)'.format(', '.join(results)))
+    return '\n'.join(body)+'\n'
+
+
+class CompiledSDE:
+    """Drift and diffusion of a discovered network SDE as fused numpy or torch functions.
+
+    drift(x) and diffusion(x) map states [..., N, dim] to [..., N, dim]; source
+    holds the generated code. euler_maruyama() integrates the SDE.
+    """
+    def __init__(self, drift, diffusion, source, backend):
+        self.drift = drift
+        self.diffusion = diffusion
+        self.source = source
+        self.backend = backend
+
+    def __call__(self, x):
+        return self.drift(x), self.diffusion(x)
+
+    def euler_maruyama(self, x0, delt_t, n_steps, n_paths=None, seed=None, record_every=1):
+        """Euler-Maruyama rollout from x0 [N, dim]; with n_paths, n_paths independent paths at once.
+        Returns the recorded states [n_steps//record_every+1, (n_paths,) N, dim]."""
+        if self.backend == 'torch':
+            import torch
+            x = torch.as_tensor(x0)
+            generator = torch.Generator(device=x.device).manual_seed(seed) if seed is not None else None
+            if n_paths is not None:
+                x = x.expand((n_paths,)+tuple(x.shape)).clone()
+            noise = lambda: torch.randn(x.shape, generator=generator, dtype=x.dtype, device=x.device)
+            stack = torch.stack
+        else:
+            rng = np.random.default_rng(seed)
+            x = np.array(x0, dtype=np.float64)
+            if n_paths is not None:
+                x = np.broadcast_to(x, (n_paths,)+x.shape).copy()
+            noise = lambda: rng.standard_normal(x.shape)
+            stack = np.stack
+        sqrt_dt = float(np.sqrt(delt_t))
+        record = [x]
+        for step in range(1,n_steps+1):
+            x = x+self.drift(x)*delt_t+self.diffusion(x)*sqrt_dt*noise()
+            if step % record_every == 0:
+                record.append(x)
+        return stack(record)
+
+
+def compile_sde(self_terms, coupled_terms=None, diffusion_terms=None, edge_index=None, weights=None, \
+        edge_attr=None, N=None, backend='numpy'):
+    """Compile discovered terms into a CompiledSDE.
+
+    self_terms: one Series / dict (name -> coefficient) of self library terms per
+        dimension, e.g. the coefficients() of Sparse_regression estimators;
+    coupled_terms: coupled library terms, one Series / dict for dimension 0 (as in
+        the SDI models) or a list per dimension;
+    diffusion_terms: sigma_d as self library terms (and 'constant') per dimension,
+        or one number / Series for all dimensions; None for a deterministic model;
+    edge_index: [2, E] source_to_target edges, weights [E] multiply the messages
+        (SDIweighted), edge_attr [E, k] fills w1..wk of multi-dimensional terms.
+    """
+    dim = len(self_terms)
+    coupled_terms = per_dimension(coupled_terms, dim, first_only=True)
+    diffusion_terms = per_dimension(diffusion_terms, dim)
+    diffusion_terms = [{'constant': terms} if np.isscalar(terms) else terms for terms in diffusion_terms]
+    self_terms = [terms_of(terms) for terms in self_terms]
+    coupled_terms = [terms_of(terms) for terms in coupled_terms]
+    diffusion_terms = [terms_of(terms) for terms in diffusion_terms]
+    names = [name for terms in self_terms+coupled_terms+diffusion_terms for name, coef in terms]
+    Nattr = 0 if edge_attr is None else int(np.shape(edge_attr)[1])
+    table = expression_table(names, dim, Nattr)
+    drift_outputs = [(linear(s, table), linear(c, table)) for s, c in zip(self_terms, coupled_terms)]
+    diffusion_outputs = [(linear(s, table), None) for s in diffusion_terms]
+    if any(edge is not None for node, edge in drift_outputs) and edge_index is None:
+        raise ValueError('coupled terms need the edge_index')
+
+    if backend == 'torch':
+        import torch
+        import Library_torch
+        lib = torch
+        canonical = Library_torch.canonical
+        drift_outputs = [(canonical(node), canonical(edge)) for node, edge in drift_outputs]
+        diffusion_outputs = [(canonical(node), None) for node, edge in diffusion_outputs]
+    else:
+        lib = np
+    namespace = dict(lib=lib)
+    if edge_index is not None:
+        edge_index = np.asarray(edge_index)
+        E = np.size(edge_index,1)
+        N = int(edge_index.max())+1 if N is None else N
+        source, target = edge_index[0], edge_index[1]
+        weights = np.ones(E) if weights is None else np.asarray(weights, dtype=np.float64).reshape(-1)
+        if backend == 'torch':
+            edge_attr = None if edge_attr is None else np.asarray(edge_attr, dtype=np.float64)
+            cache = {}
+            def constants(x):
+                """source, target, weights, edge_attr for x, converted once per device and dtype."""
+                key = (x.device, x.dtype)
+                if key not in cache:
+                    index = lambda a: torch.as_tensor(a, dtype=torch.long, device=x.device)
+                    value = lambda a: None if a is None else torch.as_tensor(a, dtype=x.dtype, device=x.device)
+                    cache[key] = (index(source), index(target), value(weights), value(edge_attr))
+                return cache[key]
+            def scatter(m):
+                target_t = constants(m)[1]
+                return torch.zeros(m.shape[:-1]+(N,), dtype=m.dtype, device=m.device).index_add_(m.dim()-1, target_t, m)
+            namespace['constants'] = constants
+        else:
+            import scipy.sparse
+            # incidence matrix of the targets [N, E]
+            A = scipy.sparse.csr_matrix((np.ones(E), (target, np.arange(E))), shape=(N,E))
+            def scatter(m):
+                return (A @ m.reshape(-1,E).T).T.reshape(m.shape[:-1]+(N,))
+            namespace.update(source=source, target=target, weights=weights, \
+                edge_attr=None if edge_attr is None else np.asarray(edge_attr, dtype=np.float64))
+        namespace['scatter'] = scatter
+    source_code = generate('drift', drift_outputs, backend)+'\n'+generate('diffusion', diffusion_outputs, backend)
+    exec(compile(source_code, '<compiled sde>', 'exec'), namespace)
+    return CompiledSDE(namespace['drift'], namespace['diffusion'], source_code, backend)
@@ -1,12 +1,15 @@
 """Models,
    author: Ting-Ting Gao"""
 
+import copy
+
 import numpy as np
 import torch
 from torch import nn
 from torch.functional import F
 from torch.optim import Adam
 from torch_geometric.nn import MetaLayer, MessagePassing
+from torch_geometric.data import Data
 from torch.nn import Sequential as Seq, Linear as Lin, ReLU, Softplus, Sigmoid, Softmax
 from torch.autograd import Variable, grad
 
@@ -22,6 +25,90 @@ node_fnc_. is module for estimating the self values of one node.
 
 """
 
+"""
+grouped_heads evaluates several Seq heads (e.g. node_fnc_x/y/z and stochastic_x/y/z) in one pass:
+heads with the same layer shapes are stacked and run with one matmul per layer (bmm),
+the weights are gathered from the heads (cached without autograd), so the parameters and
+state dicts are those of the separate heads. It saves kernel launches on CUDA; on CPU the
+heads are called one by one unless Grouping = True.
+"""
+Groupable = (nn.ReLU, nn.Softplus, nn.Sigmoid, nn.Tanh)
+# None: group on CUDA only (on CPU the separate GEMMs are faster), True / False: always / never
+Grouping = None
+
+def head_signature(head):
+    signature = []
+    for layer in head:
+        if isinstance(layer, nn.Linear):
+            signature.append(('Linear', layer.in_features, layer.out_features, layer.bias is not None))
+        elif isinstance(layer, Groupable):
+            signature.append((type(layer).__name__, getattr(layer, 'beta', None), getattr(layer, 'threshold', None)))
+        else:
+            return None
+    return tuple(signature)
+
+def stacked_weights(group):
+    """Stacked (W, b) of every Linear layer of the same-shaped heads of group, by layer index.
+
+    Without autograd (rollouts, evaluation) they are cached on the first head and rebuilt
+    only when a parameter is replaced, moved or modified in place (_version); with autograd
+    they are stacked at every call so that the gradients reach the heads."""
+    parameters = [p for head in group for p in head.parameters()]
+    if torch.is_grad_enabled() and any(p.requires_grad for p in parameters):
+        return {i: (torch.stack([head[i].weight for head in group]),
+            torch.stack([head[i].bias for head in group]) if layer.bias is not None else None)
+            for i, layer in enumerate(group[0]) if isinstance(layer, nn.Linear)}
+    key = tuple(id(head) for head in group)
+    state = [(p.data_ptr(), p._version) for p in parameters]
+    cache = group[0].__dict__.setdefault('stacked', {})
+    if key in cache:
+        cached_parameters, cached_state, weights = cache[key]
+        if all(p is q for p, q in zip(parameters, cached_parameters)) and cached_state == state:
+            return weights
+    with torch.no_grad():
+        weights = {i: (torch.stack([head[i].weight for head in group]),
+            torch.stack([head[i].bias for head in group]) if layer.bias is not None else None)
+            for i, layer in enumerate(group[0]) if isinstance(layer, nn.Linear)}
+    cache[key] = (parameters, state, weights)
+    return weights
+
+def grouped_heads(heads, x):
+    """Outputs of the Seq heads, x is one input shared by all heads or a list of per-head inputs."""
+    inputs = x if isinstance(x, (list, tuple)) else None
+    device = (x if inputs is None else inputs[0]).device
+    if not (Grouping or (Grouping is None and device.type == 'cuda')):
+        return [head(x if inputs is None else inputs[k]) for k, head in enumerate(heads)]
+    groups = {}
+    for k, head in enumerate(heads):
+        # heads with hooks are called on their own so that the hooks run
+        hooked = isinstance(head, nn.Module) and (head._forward_hooks or head._forward_pre_hooks)
+        signature = head_signature(head) if isinstance(head, Seq) and not hooked else None
+        groups.setdefault(k if signature is None else signature, []).append(k)
+    outputs = [None]*len(heads)
+    for members in groups.values():
+        if len(members) == 1:
+            k = members[0]
+            outputs[k] = heads[k](x if inputs is None else inputs[k])
+            continue
+        group = [heads[k] for k in members]
+        weights = stacked_weights(group)
+        h = x if inputs is None else torch.stack([inputs[k] for k in members])
+        for i, layer in enumerate(group[0]):
+            if not isinstance(layer, nn.Linear):
+                h = layer(h)
+                continue
+            W, b = weights[i]
+            if h.dim() == 2:
+                # shared input, one matmul with the concatenated weights [in, heads*out]
+                h = h @ W.reshape(-1,W.shape[2]).t()
+                h = h.reshape(h.shape[0],len(group),-1).transpose(0,1)
+                h = h if b is None else h+b.unsqueeze(1)
+            else:
+                h = torch.bmm(h, W.transpose(1,2)) if b is None else torch.baddbmm(b.unsqueeze(1), h, W.transpose(1,2))
+        for k, out in zip(members, h):
+            outputs[k] = out
+    return outputs
+
 """NGN is the base of unweighted network dynamics (deterministic) inference GNNs"""
 class NGN(MessagePassing):
     def __init__(self, n_f, msg_dim, ndim, delt_t, hidden=50, aggr='add', flow='source_to_target'):
@@ -85,17 +172,14 @@ class NGN(MessagePassing):
             dxdt = fx+aggr_out
             return x+dxdt*self.delt_t
         elif self.ndim==2:
-            fx = self.node_fnc_x(x)
-            fy = self.node_fnc_y(x)
+            fx, fy = grouped_heads([self.node_fnc_x, self.node_fnc_y], x)
             dxdt = fx+aggr_out
             dydt = fy
             x_update = x[:,0].reshape(-1,1)+dxdt*self.delt_t
             y_update = x[:,1].reshape(-1,1)+dydt*self.delt_t
             return torch.cat([x_update,y_update], dim=1)
         elif self.ndim==3:
-            fx = self.node_fnc_x(x)
-            fy = self.node_fnc_y(x)
-            fz = self.node_fnc_z(x)
+            fx, fy, fz = grouped_heads([self.node_fnc_x, self.node_fnc_y, self.node_fnc_z], x)
             dxdt = fx+aggr_out
             dydt = fy
             dzdt = fz
@@ -210,17 +294,14 @@ class wNGN(MessagePassing):
             dxdt = fx+aggr_out
             return torch.cat([x+dxdt*self.delt_t,dxdt], dim=1)
         elif self.ndim==2:
-            fx = self.node_fnc_x(x)
-            fy = self.node_fnc_y(x)
+            fx, fy = grouped_heads([self.node_fnc_x, self.node_fnc_y], x)
             dxdt = fx+aggr_out
             dydt = fy
             x_update = x[:,0].reshape(-1,1)+dxdt*self.delt_t
             y_update = x[:,1].reshape(-1,1)+dydt*self.delt_t
             return torch.cat([x_update,y_update,dxdt,dydt], dim=1)
         elif self.ndim==3:
-            fx = self.node_fnc_x(x)
-            fy = self.node_fnc_y(x)
-            fz = self.node_fnc_z(x)
+            fx, fy, fz = grouped_heads([self.node_fnc_x, self.node_fnc_y, self.node_fnc_z], x)
             dxdt = fx+aggr_out
             dydt = fy
             dzdt = fz
@@ -264,6 +345,171 @@ class wNeuG(wNGN):
 
 
 
+"""
+************************
+
+SDIcore: dimension-generic part of the overdamped SDI models (SDI, SDIw, SDIdifftype).
+
+The drift heads node_fnc_x, node_fnc_y, node_fnc_z (node_fnc_4, node_fnc_5, ... for ndim > 3) and
+the diffusion heads stochastic_. are evaluated together, transition(g) returns the stacked
+[N, ndim] mean x+dxdt*delt_t and scale of the Gaussian transition, and the loss is the closed
+form negative log-likelihood gaussian_nll, without torch.distributions objects.
+
+************************
+"""
+Axes = ['x', 'y', 'z']
+
+def axis(k):
+    """Suffix of the heads of dimension k: x, y, z, 4, 5, ..."""
+    return Axes[k] if k < len(Axes) else str(k+1)
+
+def init_normal(head, std):
+    for layer in head:
+        if isinstance(layer,nn.Linear):
+            torch.nn.init.normal_(layer.weight, mean=0.0, std=std)
+    return head
+
+def gaussian_nll(mean, scale, y):
+    """-log N(y; mean, scale^2) elementwise, equal to -Normal(mean, scale).log_prob(y)."""
+    return 0.5*((y-mean)/scale)**2+torch.log(scale)+0.5*np.log(2*np.pi)
+
+class SDIcore:
+    # ndim >= 3 losses average over the nodes (SDIunweighted, SDIweighted), SDI_Difftype sums them
+    mean_nll = True
+    # Aggregation.Aggregator used by transition() in place of propagate, if set
+    aggregation = None
+    # g.y is stride sampling intervals after g.x; stride > 1 trains on transition_nll
+    # with substeps (default stride) Euler substeps and paths simulated bridges
+    stride = 1
+    substeps = None
+    paths = 16
+
+    def extra_heads(self, ndim):
+        """Drift and diffusion heads of the dimensions beyond z, shaped as those of y."""
+        for k in range(len(Axes), ndim):
+            self.add_module('node_fnc_'+axis(k), init_normal(copy.deepcopy(self.node_fnc_y), 1e-1))
+            self.add_module('stochastic_'+axis(k), init_normal(copy.deepcopy(self.stochastic_y), 1e-3))
+
+    def heads(self):
+        drift = [getattr(self, 'node_fnc_'+axis(k)) for k in range(self.ndim)]
+        diffusion = [getattr(self, 'stochastic_'+axis(k)) for k in range(self.ndim)]
+        return drift+diffusion
+
+    def update(self, aggr_out, x=None):
+        """Stacked [N, ndim] mean and scale, the messages enter the first msg_dim dimensions."""
+        outputs = grouped_heads(self.heads(), x)
+        f = torch.cat(outputs[:self.ndim], dim=1)
+        scale = torch.cat(outputs[self.ndim:], dim=1)
+        msg_dim = aggr_out.shape[1]
+        dxdt = torch.cat([f[:,:msg_dim]+aggr_out, f[:,msg_dim:]], dim=1)
+        return x[:,:self.ndim]+dxdt*self.delt_t, scale
+
+    def distributions(self, mean, scale):
+        """(Normal_x, Normal_y, ..., x_update, y_update, ...) as returned by SDI_weighted."""
+        means = mean.split(1, dim=1)
+        return tuple(torch.distributions.Normal(m, s) for m, s in zip(means, scale.split(1, dim=1)))+means
+
+    def tiled(self, name, weights, rows, transform=None):
+        """Edge weights [E, k] (after transform) repeated over the rows//E graphs of a batch,
+        cached per batch size instead of tiled at every message call. A tile is reused only for
+        the same tensor (not an equal address) with the same _version and storage, so in-place
+        updates and reassigned weights are picked up."""
+        key = (name, rows)
+        state = (weights._version, weights.data_ptr())
+        tiles = self.__dict__.setdefault('tiles', {})
+        if key in tiles:
+            source, cached_state, tile = tiles[key]
+            if source is weights and cached_state == state:
+                return tile
+        tile = weights.detach() if transform is None else transform(weights.detach())
+        tiles[key] = (weights, state, tile.repeat(rows//tile.shape[0], 1))
+        return tiles[key][2]
+
+    def columns(self, values):
+        return values if self.ndim == 1 else values.split(1, dim=1)
+
+    def transition(self, g, augment=False, augmentation=3):
+        """Stacked [N, ndim] mean and scale of the transition from g.x."""
+        x = g.x
+        if augment:
+            augmentation = torch.randn(1, self.ndim)*augmentation
+            augmentation = augmentation.repeat(len(x), 1).to(x.device)
+            x = x.index_add(1, torch.arange(self.ndim).to(x.device), augmentation)
+        if self.aggregation is not None:
+            return self.update(self.aggregation(self, x), x)
+        return self.propagate(g.edge_index, size=(x.size(0), x.size(0)), x=x)
+
+    def coefficients(self, g):
+        """Drift f and diffusion b [N, ndim] of dx = f dt + b dW, from the Euler-Maruyama
+        transition mean = x + f*delt_t, scale = b*sqrt(delt_t) the model is trained on."""
+        mean, scale = self.transition(g)
+        return (mean-g.x[:,:self.ndim])/self.delt_t, scale/np.sqrt(self.delt_t)
+
+    def diffusion(self, x):
+        """Diffusion b [N, ndim] at x, the stochastic heads only (no message passing)."""
+        return torch.cat(grouped_heads(self.heads()[self.ndim:], x), dim=1)/np.sqrt(self.delt_t)
+
+    def nll(self, g, **kwargs):
+        mean, scale = self.transition(g, **kwargs)
+        return gaussian_nll(mean, scale, g.y[:,:self.ndim])
+
+    def transition_nll(self, g, stride, substeps=None, paths=16):
+        """-log p(g.y | g.x) [num_graphs] over stride*delt_t, simulated likelihood (Pedersen 1995)
+        with the modified Brownian bridge proposals of Durham & Gallant (2002).
+
+        The interval is cut into substeps Euler steps of h; paths bridges from x to y are drawn
+        (x_{j+1} ~ N(x_j + (y-x_j) h/tau, b^2 h (tau-h)/tau), tau the remaining time) and
+        weighted by their Euler density over the proposal density, the last step ending at y.
+        The nodes of a graph are coupled by the messages, so the weights are per graph.
+        substeps = 1 is the Euler-Maruyama likelihood of nll() at the step stride*delt_t.
+        """
+        substeps = stride if substeps is None else substeps
+        interval = stride*self.delt_t
+        h = interval/substeps
+        rows = len(g.x)
+        batch = getattr(g, 'batch', None)
+        batch = torch.zeros(rows, dtype=torch.long, device=g.x.device) if batch is None else batch
+        num_graphs = int(batch.max())+1
+        offsets = rows*torch.arange(paths, device=g.x.device)
+        edge_index = (g.edge_index[:,None,:]+offsets[None,:,None]).reshape(2,-1)
+        x = g.x.repeat(paths, 1)
+        y = g.y[:,:self.ndim].repeat(paths, 1)
+        log_weight = 0
+        for j in range(substeps):
+            f, b = self.coefficients(Data(x=x, edge_index=edge_index))
+            mean, scale = x[:,:self.ndim]+f*h, b*np.sqrt(h)
+            if j == substeps-1:
+                log_weight = log_weight-gaussian_nll(mean, scale, y)
+                break
+            tau = interval-j*h
+            proposal_mean = x[:,:self.ndim]+(y-x[:,:self.ndim])*h/tau
+            proposal_scale = b*np.sqrt(h*(tau-h)/tau)
+            step = proposal_mean+proposal_scale*torch.randn_like(proposal_mean)
+            log_weight = log_weight-gaussian_nll(mean, scale, step)+gaussian_nll(proposal_mean, proposal_scale, step)
+            x = torch.cat([step, x[:,self.ndim:]], dim=1)
+        log_weight = log_weight.sum(dim=1).reshape(paths, rows)
+        per_graph = torch.zeros(paths, num_graphs, dtype=log_weight.dtype, device=log_weight.device).index_add_(1, batch, log_weight)
+        return -(torch.logsumexp(per_graph, dim=0)-np.log(paths))
+
+    def loss(self, g, **kwargs):
+        if self.stride > 1:
+            neg_log_likelihood = torch.sum(self.transition_nll(g, self.stride, self.substeps, self.paths))
+            # per node as the mean over the nodes summed over the dimensions below
+            return neg_log_likelihood/len(g.x) if self.ndim >= 3 and self.mean_nll else neg_log_likelihood
+        neg_log_likelihood = self.nll(g)
+        if self.ndim >= 3 and self.mean_nll:
+            return torch.sum(torch.mean(neg_log_likelihood, dim=0))
+        return torch.sum(neg_log_likelihood)
+
+    def sample_trajectories(self, g, **kwargs):
+        mean, scale = self.transition(g)
+        with torch.no_grad():
+            return self.columns(torch.normal(mean, scale))
+
+    def average_trajectories(self, g, **kwargs):
+        return self.columns(self.transition(g)[0])
+
+
 """
 ************************
 
@@ -283,7 +529,7 @@ Layers weights' std: set for different dynamics.
 
 ************************
 """
-class SDI(MessagePassing):
+class SDI(SDIcore, MessagePassing):
     def __init__(self, model, n_f, msg_dim, ndim, delt_t, hidden=50, aggr='add', flow='source_to_target'):
 
         """If flow is 'source_to_target', the relation is (j,i), means information is passed from x_j to x_i'"""
@@ -387,11 +633,14 @@ class SDI(MessagePassing):
                 param_shape = layer.weight.shape
                 torch.nn.init.normal_(layer.weight, mean=0.0, std=1e-3)
 
+        self.ndim = ndim
+        self.extra_heads(ndim)
+
     def forward(self, x, edge_index):
         # x has shape [N, number_of_features]
         # edge_index has shape [2,E]
         x = x
-        return self.propagate(edge_index, x=x)
+        return self.distributions(*self.propagate(edge_index, x=x))
 
     def message(self, x_i, x_j):
 
@@ -399,45 +648,10 @@ class SDI(MessagePassing):
         tmp = tmp.reshape(2,-1)
         tmp = tmp.t()
         return self.msg_fnc(tmp)
-    
 
-    def update(self, aggr_out, x=None):
-        if self.ndim==1:
-            fx = self.node_fnc_x(x)
-            dxdt = fx+aggr_out
-            x_update = x+dxdt*self.delt_t
-            x_mean = x+dxdt*self.delt_t
-            x_var = self.stochastic_x(x)
-            return torch.distributions.Normal(x_mean, x_var),x_update
-        elif self.ndim==2:
-            fx = self.node_fnc_x(x)
-            fy = self.node_fnc_y(x)
-            dxdt = fx+aggr_out
-            dydt = fy
-            x_update = x[:,0].reshape(-1,1)+dxdt*self.delt_t
-            y_update = x[:,1].reshape(-1,1)+dydt*self.delt_t
-            x_mean = x[:,0].reshape(-1,1)+dxdt*self.delt_t
-            y_mean = x[:,1].reshape(-1,1)+dydt*self.delt_t
-            x_var = self.stochastic_x(x)
-            y_var = self.stochastic_y(x)
-            return torch.distributions.Normal(x_mean, x_var),torch.distributions.Normal(y_mean, y_var),x_update,y_update
-        elif self.ndim==3:
-            fx = self.node_fnc_x(x)
-            fy = self.node_fnc_y(x)
-            fz = self.node_fnc_z(x)
-            dxdt = fx+aggr_out
-            dydt = fy
-            dzdt = fz
-            x_update = x[:,0].reshape(-1,1)+dxdt*self.delt_t
-            y_update = x[:,1].reshape(-1,1)+dydt*self.delt_t
-            z_update = x[:,2].reshape(-1,1)+dzdt*self.delt_t
-            x_mean = x[:,0].reshape(-1,1)+dxdt*self.delt_t
-            y_mean = x[:,1].reshape(-1,1)+dydt*self.delt_t
-            z_mean = x[:,2].reshape(-1,1)+dzdt*self.delt_t
-            x_var = self.stochastic_x(x)
-            y_var = self.stochastic_y(x)
-            z_var = self.stochastic_z(x)
-            return torch.distributions.Normal(x_mean, x_var),torch.distributions.Normal(y_mean, y_var),torch.distributions.Normal(z_mean, z_var),x_update,y_update,z_update
+    def message_terms(self):
+        """(function of tmp, edge weight) pairs whose sum is message(), see Aggregation."""
+        return [(self.msg_fnc, None)]
 
 
 class SDIunweighted(SDI):
@@ -451,35 +665,8 @@ class SDIunweighted(SDI):
             self.ndim = ndim
     
      def SDI_unweighted(self, g, augment=False, augmentation=3):
-            #x is [n, n_f]f
-            x = g.x
-            ndim = self.ndim
-            if augment:
-                augmentation = torch.randn(1, ndim)*augmentation
-                augmentation = augmentation.repeat(len(x), 1).to(x.device)
-                x = x.index_add(1, torch.arange(ndim).to(x.device), augmentation)
-        
-            edge_index = g.edge_index
-            return self.propagate(
-                    edge_index, size=(x.size(0), x.size(0)),
-                    x=x)
+            return self.distributions(*self.transition(g, augment, augmentation))
 
-     def loss(self, g, **kwargs):
-            if self.ndim==1:
-                out_dist,xUpdate = self.SDI_unweighted(g)
-                neg_log_likelihood = -out_dist.log_prob(g.y)
-                return torch.sum(neg_log_likelihood)
-            if self.ndim==2:
-                out_dist_x,out_dist_y,xUpdate,yUpdate = self.SDI_unweighted(g)
-                neg_log_likelihood_x = -out_dist_x.log_prob(g.y[:,0].reshape(-1,1))
-                neg_log_likelihood_y = -out_dist_y.log_prob(g.y[:,1].reshape(-1,1))
-                return torch.sum(neg_log_likelihood_x)+torch.sum(neg_log_likelihood_y)
-            if self.ndim==3:
-                out_dist_x,out_dist_y,out_dist_z,xUpdate,yUpdate,zUpdate = self.SDI_unweighted(g)
-                neg_log_likelihood_x = -out_dist_x.log_prob(g.y[:,0].reshape(-1,1))
-                neg_log_likelihood_y = -out_dist_y.log_prob(g.y[:,1].reshape(-1,1))
-                neg_log_likelihood_z = -out_dist_z.log_prob(g.y[:,2].reshape(-1,1))
-                return torch.mean(neg_log_likelihood_x)+torch.mean(neg_log_likelihood_y)+torch.mean(neg_log_likelihood_z)
 
      def squareloss(self, g,square=False, **kwargs):
             out_dist,xUpdate = self.SDI_unweighted(g)
@@ -493,34 +680,6 @@ class SDIunweighted(SDI):
                 #print(torch.sum(neg_log_likelihood))
                 return torch.sum(torch.abs(g.y[:,0:self.ndim] - xUpdate))+torch.sum(neg_log_likelihood)
 
-     def sample_trajectories(self, g, **kwargs):
-            if self.ndim == 1:
-                out_dist,xUpdate = self.SDI_unweighted(g)
-                xUpdate_sample = out_dist.sample()
-                return xUpdate_sample
-            if self.ndim == 2:
-                out_dist_x,out_dist_y,xUpdate,yUpdate = self.SDI_unweighted(g)
-                xUpdate_sample = out_dist_x.sample()
-                yUpdate_sample = out_dist_y.sample()
-                return xUpdate_sample, yUpdate_sample
-            if self.ndim == 3:
-                out_dist_x,out_dist_y,out_dist_z,xUpdate,yUpdate,zUpdate = self.SDI_unweighted(g)
-                xUpdate_sample = out_dist_x.sample()
-                yUpdate_sample = out_dist_y.sample()
-                zUpdate_sample = out_dist_z.sample()
-                return xUpdate_sample, yUpdate_sample, zUpdate_sample
-
-     def average_trajectories(self, g, **kwargs):
-            if self.ndim == 1:
-                out_dist,xUpdate = self.SDI_unweighted(g)
-                return xUpdate
-            if self.ndim == 2:
-                out_dist_x,out_dist_y,xUpdate,yUpdate = self.SDI_unweighted(g)
-                return xUpdate, yUpdate
-            if self.ndim == 3:
-                out_dist_x,out_dist_y,out_dist_z,xUpdate,yUpdate,zUpdate = self.SDI_unweighted(g)
-                return xUpdate, yUpdate, zUpdate
-
 
 """
 Structure: SDIweighted
@@ -540,7 +699,7 @@ weights is the weight vector of the system topology.
 Layers weights' std: set for different dynamics (different from the above weight).
 
 """
-class SDIw(MessagePassing):
+class SDIw(SDIcore, MessagePassing):
     def __init__(self, model, n_f, msg_dim, ndim, delt_t, weights, hidden=50, aggr='add', flow='source_to_target'):
 
         """If flow is 'source_to_target', the relation is (j,i), means information is passed from x_j to x_i'"""
@@ -644,60 +803,25 @@ class SDIw(MessagePassing):
                 param_shape = layer.weight.shape
                 torch.nn.init.normal_(layer.weight, mean=0.0, std=1e-3)
 
+        self.ndim = ndim
+        self.extra_heads(ndim)
+
     def forward(self, x, edge_index):
         # x has shape [N, number_of_features]
         # edge_index has shape [2,E]
         x = x
-        return self.propagate(edge_index, x=x)
+        return self.distributions(*self.propagate(edge_index, x=x))
 
     def message(self, x_i, x_j):
 
         tmp = torch.cat([x_i[:,0], x_j[:,0]])
         tmp = tmp.reshape(2,-1)
         tmp = tmp.t()
-        Len = int(x_j[:,0].shape[0])/int(self.weights.shape[0])
-        w = self.weights.repeat(int(Len),1)
-        w = w.clone().detach()
-        return self.msg_fnc(tmp)*w
-    
+        return self.msg_fnc(tmp)*self.tiled('weights', self.weights, tmp.shape[0])
 
-    def update(self, aggr_out, x=None):
-        if self.ndim==1:
-            fx = self.node_fnc_x(x)
-            dxdt = fx+aggr_out
-            x_update = x+dxdt*self.delt_t
-            x_mean = x+dxdt*self.delt_t
-            x_var = self.stochastic_x(x)
-            return torch.distributions.Normal(x_mean, x_var),x_update
-        elif self.ndim==2:
-            fx = self.node_fnc_x(x)
-            fy = self.node_fnc_y(x)
-            dxdt = fx+aggr_out
-            dydt = fy
-            x_update = x[:,0].reshape(-1,1)+dxdt*self.delt_t
-            y_update = x[:,1].reshape(-1,1)+dydt*self.delt_t
-            x_mean = x[:,0].reshape(-1,1)+dxdt*self.delt_t
-            y_mean = x[:,1].reshape(-1,1)+dydt*self.delt_t
-            x_var = self.stochastic_x(x)
-            y_var = self.stochastic_y(x)
-            return torch.distributions.Normal(x_mean, x_var),torch.distributions.Normal(y_mean, y_var),x_update,y_update
-        elif self.ndim==3:
-            fx = self.node_fnc_x(x)
-            fy = self.node_fnc_y(x)
-            fz = self.node_fnc_z(x)
-            dxdt = fx+aggr_out
-            dydt = fy
-            dzdt = fz
-            x_update = x[:,0].reshape(-1,1)+dxdt*self.delt_t
-            y_update = x[:,1].reshape(-1,1)+dydt*self.delt_t
-            z_update = x[:,2].reshape(-1,1)+dzdt*self.delt_t
-            x_mean = x[:,0].reshape(-1,1)+dxdt*self.delt_t
-            y_mean = x[:,1].reshape(-1,1)+dydt*self.delt_t
-            z_mean = x[:,2].reshape(-1,1)+dzdt*self.delt_t
-            x_var = self.stochastic_x(x)
-            y_var = self.stochastic_y(x)
-            z_var = self.stochastic_z(x)
-            return torch.distributions.Normal(x_mean, x_var),torch.distributions.Normal(y_mean, y_var),torch.distributions.Normal(z_mean, z_var),x_update,y_update,z_update
+    def message_terms(self):
+        """(function of tmp, edge weight) pairs whose sum is message(), see Aggregation."""
+        return [(self.msg_fnc, self.weights)]
 
 
 class SDIweighted(SDIw):
@@ -712,62 +836,7 @@ class SDIweighted(SDIw):
             self.weights = weights
     
      def SDI_weighted(self, g, augment=False, augmentation=3):
-            #x is [n, n_f]f
-            x = g.x
-            ndim = self.ndim
-            if augment:
-                augmentation = torch.randn(1, ndim)*augmentation
-                augmentation = augmentation.repeat(len(x), 1).to(x.device)
-                x = x.index_add(1, torch.arange(ndim).to(x.device), augmentation)
-        
-            edge_index = g.edge_index
-            return self.propagate(
-                    edge_index, size=(x.size(0), x.size(0)),
-                    x=x)
-
-     def loss(self, g, **kwargs):
-            if self.ndim==1:
-                out_dist,xUpdate = self.SDI_weighted(g)
-                neg_log_likelihood = -out_dist.log_prob(g.y)
-                return torch.sum(neg_log_likelihood)
-            if self.ndim==2:
-                out_dist_x,out_dist_y,xUpdate,yUpdate = self.SDI_weighted(g)
-                neg_log_likelihood_x = -out_dist_x.log_prob(g.y[:,0].reshape(-1,1))
-                neg_log_likelihood_y = -out_dist_y.log_prob(g.y[:,1].reshape(-1,1))
-                return torch.sum(neg_log_likelihood_x)+torch.sum(neg_log_likelihood_y)
-            if self.ndim==3:
-                out_dist_x,out_dist_y,out_dist_z,xUpdate,yUpdate,zUpdate = self.SDI_weighted(g)
-                neg_log_likelihood_x = -out_dist_x.log_prob(g.y[:,0].reshape(-1,1))
-                neg_log_likelihood_y = -out_dist_y.log_prob(g.y[:,1].reshape(-1,1))
-                neg_log_likelihood_z = -out_dist_z.log_prob(g.y[:,2].reshape(-1,1))
-                return torch.mean(neg_log_likelihood_x)+torch.mean(neg_log_likelihood_y)+torch.mean(neg_log_likelihood_z)
-     def sample_trajectories(self, g, **kwargs):
-            if self.ndim == 1:
-                out_dist,xUpdate = self.SDI_weighted(g)
-                xUpdate_sample = out_dist.sample()
-                return xUpdate_sample
-            if self.ndim == 2:
-                out_dist_x,out_dist_y,xUpdate,yUpdate = self.SDI_weighted(g)
-                xUpdate_sample = out_dist_x.sample()
-                yUpdate_sample = out_dist_y.sample()
-                return xUpdate_sample, yUpdate_sample
-            if self.ndim == 3:
-                out_dist_x,out_dist_y,out_dist_z,xUpdate,yUpdate,zUpdate = self.SDI_weighted(g)
-                xUpdate_sample = out_dist_x.sample()
-                yUpdate_sample = out_dist_y.sample()
-                zUpdate_sample = out_dist_z.sample()
-                return xUpdate_sample, yUpdate_sample, zUpdate_sample
-
-     def average_trajectories(self, g, **kwargs):
-            if self.ndim == 1:
-                out_dist,xUpdate = self.SDI_weighted(g)
-                return xUpdate
-            if self.ndim == 2:
-                out_dist_x,out_dist_y,xUpdate,yUpdate = self.SDI_weighted(g)
-                return xUpdate, yUpdate
-            if self.ndim == 3:
-                out_dist_x,out_dist_y,out_dist_z,xUpdate,yUpdate,zUpdate = self.SDI_weighted(g)
-                return xUpdate, yUpdate, zUpdate
+            return self.distributions(*self.transition(g, augment, augmentation))
 
 
 """
@@ -789,7 +858,7 @@ Layers weights' std: set for different dynamics.
 
 """
 
-class SDIdifftype(MessagePassing):
+class SDIdifftype(SDIcore, MessagePassing):
     def __init__(self, model, n_f, msg_dim, ndim, delt_t, Type, hidden=50, aggr='add', flow='source_to_target'):
 
         """If flow is 'source_to_target', the relation is (j,i), means information is passed from x_j to x_i'"""
@@ -908,24 +977,23 @@ class SDIdifftype(MessagePassing):
                 param_shape = layer.weight.shape
                 torch.nn.init.normal_(layer.weight, mean=0.0, std=1e-3)
 
+        self.ndim = ndim
+        self.extra_heads(ndim)
+
     def forward(self, x, edge_index):
         # x has shape [N, number_of_features]
         # edge_index has shape [2,E]
         x = x
-        return self.propagate(edge_index, x=x)
+        return self.distributions(*self.propagate(edge_index, x=x))
 
     def message(self, x_i, x_j):
 
         tmp = torch.cat([x_i[:,0], x_j[:,0]])
         tmp = tmp.reshape(2,-1)
         tmp = tmp.t()
-        Len = int(x_j[:,0].shape[0])/int(self.Type.shape[0])
-        T = self.Type.repeat(int(Len),1)
-        T = T.clone().detach()
-        Message_excit = self.msg_fnc_excit(tmp)
-        Message_inh = self.msg_fnc_inh(tmp)
-        T_excit = torch.where(T>0,T,0)
-        T_inh = torch.where(T<0,T,0)
+        Message_excit, Message_inh = grouped_heads([self.msg_fnc_excit, self.msg_fnc_inh], tmp)
+        T_excit = self.tiled('T_excit', self.Type, tmp.shape[0], lambda T: torch.where(T>0,T,0))
+        T_inh = self.tiled('T_inh', self.Type, tmp.shape[0], lambda T: torch.where(T<0,T,0))
         Message = Message_excit*T_excit+Message_inh*T_inh
         return Message
         # for i in range(T.shape[0]):
@@ -938,48 +1006,15 @@ class SDIdifftype(MessagePassing):
         #         else:
         #             Message = torch.cat((Message,msg_tmp),0)
         # return Message
-    
 
-    def update(self, aggr_out, x=None):
-        if self.ndim==1:
-            fx = self.node_fnc_x(x)
-            dxdt = fx+aggr_out
-            x_update = x+dxdt*self.delt_t
-            x_mean = x+dxdt*self.delt_t
-            x_var = self.stochastic_x(x)
-            return torch.distributions.Normal(x_mean, x_var),x_update
-        elif self.ndim==2:
-            fx = self.node_fnc_x(x)
-            fy = self.node_fnc_y(x)
-            dxdt = fx+aggr_out
-            dydt = fy
-            x_update = x[:,0].reshape(-1,1)+dxdt*self.delt_t
-            y_update = x[:,1].reshape(-1,1)+dydt*self.delt_t
-            x_mean = x[:,0].reshape(-1,1)+dxdt*self.delt_t
-            y_mean = x[:,1].reshape(-1,1)+dydt*self.delt_t
-            x_var = self.stochastic_x(x)
-            y_var = self.stochastic_y(x)
-            return torch.distributions.Normal(x_mean, x_var),torch.distributions.Normal(y_mean, y_var),x_update,y_update
-        elif self.ndim==3:
-            fx = self.node_fnc_x(x)
-            fy = self.node_fnc_y(x)
-            fz = self.node_fnc_z(x)
-            dxdt = fx+aggr_out
-            dydt = fy
-            dzdt = fz
-            x_update = x[:,0].reshape(-1,1)+dxdt*self.delt_t
-            y_update = x[:,1].reshape(-1,1)+dydt*self.delt_t
-            z_update = x[:,2].reshape(-1,1)+dzdt*self.delt_t
-            x_mean = x[:,0].reshape(-1,1)+dxdt*self.delt_t
-            y_mean = x[:,1].reshape(-1,1)+dydt*self.delt_t
-            z_mean = x[:,2].reshape(-1,1)+dzdt*self.delt_t
-            x_var = self.stochastic_x(x)
-            y_var = self.stochastic_y(x)
-            z_var = self.stochastic_z(x)
-            return torch.distributions.Normal(x_mean, x_var),torch.distributions.Normal(y_mean, y_var),torch.distributions.Normal(z_mean, z_var),x_update,y_update,z_update
+    def message_terms(self):
+        """(function of tmp, edge weight) pairs whose sum is message(), see Aggregation."""
+        return [(self.msg_fnc_excit, torch.where(self.Type>0,self.Type,0)), (self.msg_fnc_inh, torch.where(self.Type<0,self.Type,0))]
 
 
 class SDI_Difftype(SDIdifftype):
+     mean_nll = False
+
      def __init__(
  		self, model, n_f, msg_dim, ndim, delt_t,Type,
  		edge_index, aggr='add', hidden=50, nt=1):
@@ -991,64 +1026,7 @@ class SDI_Difftype(SDIdifftype):
             self.Type = Type
     
      def SDI_weighted(self, g, augment=False, augmentation=3):
-            #x is [n, n_f]f
-            x = g.x
-            ndim = self.ndim
-            if augment:
-                augmentation = torch.randn(1, ndim)*augmentation
-                augmentation = augmentation.repeat(len(x), 1).to(x.device)
-                x = x.index_add(1, torch.arange(ndim).to(x.device), augmentation)
-        
-            edge_index = g.edge_index
-            return self.propagate(
-                    edge_index, size=(x.size(0), x.size(0)),
-                    x=x)
-
-     def loss(self, g, **kwargs):
-            if self.ndim==1:
-                out_dist,xUpdate = self.SDI_weighted(g)
-                neg_log_likelihood = -out_dist.log_prob(g.y)
-                return torch.sum(neg_log_likelihood)
-            if self.ndim==2:
-                out_dist_x,out_dist_y,xUpdate,yUpdate = self.SDI_weighted(g)
-                neg_log_likelihood_x = -out_dist_x.log_prob(g.y[:,0].reshape(-1,1))
-                neg_log_likelihood_y = -out_dist_y.log_prob(g.y[:,1].reshape(-1,1))
-                return torch.sum(neg_log_likelihood_x)+torch.sum(neg_log_likelihood_y)
-            if self.ndim==3:
-                out_dist_x,out_dist_y,out_dist_z,xUpdate,yUpdate,zUpdate = self.SDI_weighted(g)
-                neg_log_likelihood_x = -out_dist_x.log_prob(g.y[:,0].reshape(-1,1))
-                neg_log_likelihood_y = -out_dist_y.log_prob(g.y[:,1].reshape(-1,1))
-                neg_log_likelihood_z = -out_dist_z.log_prob(g.y[:,2].reshape(-1,1))
-                return torch.sum(neg_log_likelihood_x)+torch.sum(neg_log_likelihood_y)+torch.sum(neg_log_likelihood_z)
-     def sample_trajectories(self, g, **kwargs):
-            if self.ndim == 1:
-                out_dist,xUpdate = self.SDI_weighted(g)
-                xUpdate_sample = out_dist.sample()
-                return xUpdate_sample
-            if self.ndim == 2:
-                out_dist_x,out_dist_y,xUpdate,yUpdate = self.SDI_weighted(g)
-                xUpdate_sample = out_dist_x.sample()
-                yUpdate_sample = out_dist_y.sample()
-                return xUpdate_sample, yUpdate_sample
-            if self.ndim == 3:
-                out_dist_x,out_dist_y,out_dist_z,xUpdate,yUpdate,zUpdate = self.SDI_weighted(g)
-                xUpdate_sample = out_dist_x.sample()
-                yUpdate_sample = out_dist_y.sample()
-                zUpdate_sample = out_dist_z.sample()
-                return xUpdate_sample, yUpdate_sample, zUpdate_sample
-
-     def average_trajectories(self, g, **kwargs):
-            if self.ndim == 1:
-                out_dist,xUpdate = self.SDI_weighted(g)
-                return xUpdate
-            if self.ndim == 2:
-                out_dist_x,out_dist_y,xUpdate,yUpdate = self.SDI_weighted(g)
-                return xUpdate, yUpdate
-            if self.ndim == 3:
-                out_dist_x,out_dist_y,out_dist_z,xUpdate,yUpdate,zUpdate = self.SDI_weighted(g)
-                return xUpdate, yUpdate, zUpdate
-
-
+            return self.distributions(*self.transition(g, augment, augmentation))
 
 
 """underdamped Langevin equation (flocks)"""      
@@ -1156,30 +1134,27 @@ class SDIunder(MessagePassing):
         vij = torch.cat([vxij.reshape(-1,1), vyij.reshape(-1,1),vzij.reshape(-1,1)], dim=1)
         rij = torch.sqrt(xij**2+yij**2+zij**2)
 
-        Message = self.msg_fnc_cohesion(rij.reshape(-1,1))*Rij+self.msg_fnc_align(rij.reshape(-1,1))*vij
+        cohesion, align = grouped_heads([self.msg_fnc_cohesion, self.msg_fnc_align], rij.reshape(-1,1))
+        Message = cohesion*Rij+align*vij
         #print(torch.sum(self.msg_fnc_cohesion(rij)))
         return Message
     
 
     def update(self, aggr_out, x=None):
         if self.ndim==1:
-            fx = self.node_fnc_x(x)
+            fx, x_var = grouped_heads([self.node_fnc_x, self.stochastic_x], x)
             dxdt = fx+aggr_out
             x_update = x+dxdt*self.delt_t
             x_mean = x+dxdt*self.delt_t
-            x_var = self.stochastic_x(x)
             return torch.distributions.Normal(x_mean, x_var),x_update
         elif self.ndim==2:
-            fx = self.node_fnc_x(x)
-            fy = self.node_fnc_y(x)
+            fx, fy, x_var, y_var = grouped_heads([self.node_fnc_x, self.node_fnc_y, self.stochastic_x, self.stochastic_y], x)
             dxdt = fx+aggr_out
             dydt = fy
             x_update = x[:,0].reshape(-1,1)+dxdt*self.delt_t
             y_update = x[:,1].reshape(-1,1)+dydt*self.delt_t
             x_mean = x[:,0].reshape(-1,1)+dxdt*self.delt_t
             y_mean = x[:,1].reshape(-1,1)+dydt*self.delt_t
-            x_var = self.stochastic_x(x)
-            y_var = self.stochastic_y(x)
             return torch.distributions.Normal(x_mean, x_var),torch.distributions.Normal(y_mean, y_var),x_update,y_update
         elif self.ndim==3:
             vxi = x[:,3]
@@ -1191,9 +1166,7 @@ class SDIunder(MessagePassing):
             dvdt = F*vi+aggr_out
             v_update = x[:,self.ndim:]+dvdt*self.delt_t
             v_mean = x[:,self.ndim:]+dvdt*self.delt_t
-            v_var_x = self.stochastic_x(x)
-            v_var_y = self.stochastic_y(x)
-            v_var_z = self.stochastic_z(x)
+            v_var_x, v_var_y, v_var_z = grouped_heads([self.stochastic_x, self.stochastic_y, self.stochastic_z], x)
             x_update = x[:,:self.ndim]+x[:,self.ndim:]*self.delt_t+v_update*self.delt_t
             return torch.distributions.Normal(v_mean[:,0].reshape(-1,1), v_var_x),torch.distributions.Normal(v_mean[:,1].reshape(-1,1), v_var_y),torch.distributions.Normal(v_mean[:,2].reshape(-1,1), v_var_z),x_update,v_update,dvdt
             #return x_update,y_update,z_update,fx
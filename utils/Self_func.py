@@ -4,6 +4,21 @@
 import pandas as pd
 import numpy as np
 import itertools as it
+import functools
+import math
+
+"""
+The self library is built by one engine: every family of elementary functions has
+a *_names function (column names) and a *_array function which fills its columns
+into a given block of a preallocated (Timelength, Numfunc) array.
+self_ElementaryFunctions_Array returns the filled array and the list of names,
+self_ElementaryFunctions_Matrix wraps it into a DataFrame.
+"""
+
+# parameter grids of the activation family
+Sigmoid_alpha = [1, 5, 10]
+Sigmoid_beta = [0, 1, 5, 10]
+Regulation_gamma = [1, 2, 5, 10]
 
 def elementary_functions_name(dimensionList,order):
     Combination_func = list(it.combinations_with_replacement(dimensionList,order))
@@ -14,370 +29,209 @@ def elementary_functions_name(dimensionList,order):
         Name_of_func.append(tmp)
     return Num_of_func, Name_of_func
 
-def self_ElementaryFunctions_Matrix(TimeSeries, dim, selfPolyOrder, PolynomialIndex = True, TrigonometricIndex = True, \
+def dimension_names(dim):
+    return ['x'+str(j+1) for j in range(0,dim)]
+
+def new_block(TimeSeries, Numfunc, out=None, dtype=np.float64):
+    if out is None:
+        # column-major, so that every library column is contiguous
+        out = np.empty(shape=(np.size(TimeSeries, 0),Numfunc), dtype=dtype, order='F')
+    return out
+
+def self_library_plan(dim, selfPolyOrder, PolynomialIndex = True, TrigonometricIndex = True, \
     ExponentialIndex = True, FractionalIndex = True, ActivationIndex = True):
-    
-    ElementaryMatrix = pd.DataFrame()
+    """List the enabled families as (array function, keyword arguments, column names)."""
+    plan = []
     if PolynomialIndex == True:
-        ElementaryMatrix = pd.concat([ElementaryMatrix,Polynomial_functions(TimeSeries, dim, selfPolyOrder)],axis=1)
+        plan.append((Polynomial_array, dict(PolyOrder = selfPolyOrder), Polynomial_names(dim, selfPolyOrder)))
     if TrigonometricIndex == True:
-        ElementaryMatrix = pd.concat([ElementaryMatrix, Trigonometric(TimeSeries, dim,Sin = True, Cos = True, Tan = True)],axis=1)
+        plan.append((Trigonometric_array, dict(Sin = True, Cos = True, Tan = True), Trigonometric_names(dim)))
     if ExponentialIndex == True:
-        ElementaryMatrix = pd.concat([ElementaryMatrix, Exponential(TimeSeries, dim, expomential = True)],axis=1)
+        plan.append((Exponential_array, dict(expomential = True), Exponential_names(dim)))
     if FractionalIndex == True:
-        ElementaryMatrix = pd.concat([ElementaryMatrix, Fractional(TimeSeries, dim, fractional = True)],axis=1)
+        plan.append((Fractional_array, dict(fractional = True), Fractional_names(dim)))
     if ActivationIndex == True:
-        ElementaryMatrix = pd.concat([ElementaryMatrix, Activation(TimeSeries, dim, Sigmoid = True, Tanh = True, Regulation = True)],axis=1)
-    
-    return ElementaryMatrix
-
-def Polynomial_functions(TimeSeries, dim, PolyOrder):
-    Timelength = np.size(TimeSeries, 0)
-    dim_multi_Nnodes = np.size(TimeSeries, 1)
-
-    if PolyOrder >= 1:
-        if dim == 1:
-            lst = ['x1']
-            Numfunc, Namefunc = elementary_functions_name(lst,1)
-            PolyOne = np.zeros(shape=(Timelength,Numfunc))
-            for j in range(0,Numfunc):
-                PolyOne[:,j]  = TimeSeries[:,j]
-            column_values = Namefunc
-            PolyOne = pd.DataFrame(data = PolyOne, columns = column_values)
-
-        if dim == 2:
-            lst = ['x1','x2']
-            Numfunc, Namefunc = elementary_functions_name(lst,1)
-            PolyOne = np.zeros(shape=(Timelength,Numfunc))
-            for j in range(0,Numfunc):
-                PolyOne[:,j]  = TimeSeries[:,j]
-            column_values = Namefunc
-            PolyOne = pd.DataFrame(data = PolyOne, columns = column_values) 
-        
-        if dim == 3:
-            lst = ['x1','x2','x3']
-            Numfunc, Namefunc = elementary_functions_name(lst,1)
-            PolyOne = np.zeros(shape=(Timelength,Numfunc))
-            for j in range(0,Numfunc):
-                PolyOne[:,j]  = TimeSeries[:,j]
-            column_values = Namefunc
-            PolyOne = pd.DataFrame(data = PolyOne, columns = column_values)
-
-        if dim == 4:
-            lst = ['x1','x2','x3','x4']
-            Numfunc, Namefunc = elementary_functions_name(lst,1)
-            PolyOne = np.zeros(shape=(Timelength,Numfunc))
-            for j in range(0,Numfunc):
-                PolyOne[:,j]  = TimeSeries[:,j]
-            column_values = Namefunc
-            PolyOne = pd.DataFrame(data = PolyOne, columns = column_values)
-
-
-    if PolyOrder >= 2:
-        if dim == 1:
-            lst = ['x1']
-            Numfunc, Namefunc = elementary_functions_name(lst,2)
-            PolyTwo = np.zeros(shape=(Timelength,Numfunc))
-            j = 0
-            PolyTwo[:,j] = TimeSeries[:,j]**2
-            column_values = Namefunc
-            PolyTwo = pd.DataFrame(data = PolyTwo, columns = column_values)
-
-        if dim == 2:
-            lst = ['x1','x2']
-            Numfunc, Namefunc = elementary_functions_name(lst,2)
-            PolyTwo = np.zeros(shape=(Timelength,Numfunc))
-            j = 0
-            for ii in range(0,dim):
-                for jj in range(ii,dim):
-                    PolyTwo[:,j] = TimeSeries[:,ii]*TimeSeries[:,jj]
-                    j = j+1
-            column_values = Namefunc
-            PolyTwo = pd.DataFrame(data = PolyTwo, columns = column_values)
-
-        if dim == 3:
-            lst = ['x1','x2','x3']
-            Numfunc, Namefunc = elementary_functions_name(lst,2)
-            PolyTwo = np.zeros(shape=(Timelength,Numfunc))
-            j = 0
-            for ii in range(0,dim):
-                for jj in range(ii,dim):
-                    PolyTwo[:,j] = TimeSeries[:,ii]*TimeSeries[:,jj]
-                    j = j+1
-            column_values = Namefunc
-            PolyTwo = pd.DataFrame(data = PolyTwo, columns = column_values)
-
-        if dim == 4:
-            lst = ['x1','x2','x3','x4']
-            Numfunc, Namefunc = elementary_functions_name(lst,2)
-            PolyTwo = np.zeros(shape=(Timelength,Numfunc))
-            j = 0
-            for ii in range(0,dim):
-                for jj in range(ii,dim):
-                    PolyTwo[:,j] = TimeSeries[:,ii]*TimeSeries[:,jj]
-                    j = j+1
-            column_values = Namefunc
-            PolyTwo = pd.DataFrame(data = PolyTwo, columns = column_values)
+        plan.append((Activation_array, dict(Sigmoid = True, Tanh = True, Regulation = True), Activation_names(dim)))
+    return plan
+
+def self_ElementaryFunctions_Array(TimeSeries, dim, selfPolyOrder, PolynomialIndex = True, TrigonometricIndex = True, \
+    ExponentialIndex = True, FractionalIndex = True, ActivationIndex = True, out = None, dtype = np.float64):
+    """Fill the self library into one (Timelength, Numfunc) array, family by family.
+    Returns the array and the list of column names."""
+    TimeSeries = np.asarray(TimeSeries)
+    plan = self_library_plan(dim, selfPolyOrder, PolynomialIndex, TrigonometricIndex, \
+        ExponentialIndex, FractionalIndex, ActivationIndex)
+    names = [name for fill, kwargs, family_names in plan for name in family_names]
+    ElementaryArray = new_block(TimeSeries, len(names), out, dtype)
+    start = 0
+    for fill, kwargs, family_names in plan:
+        stop = start+len(family_names)
+        fill(TimeSeries, dim, out=ElementaryArray[:,start:stop], **kwargs)
+        start = stop
+    return ElementaryArray, names
 
-        
-    if PolyOrder >= 3:
-        if dim == 1:
-            lst = ['x1']
-            Numfunc, Namefunc = elementary_functions_name(lst,3)
-            PolyThree = np.zeros(shape=(Timelength,Numfunc))
-            j = 0
-            for ii in range(0,dim):
-                for jj in range(ii,dim):
-                    for kk in range(jj,dim):
-                        PolyThree[:,j] = TimeSeries[:,ii]*TimeSeries[:,jj]*TimeSeries[:,kk]
-                        j = j+1
-            column_values = Namefunc
-            PolyThree = pd.DataFrame(data = PolyThree, columns = column_values)
-
-        if dim == 2:
-            lst = ['x1','x2']
-            Numfunc, Namefunc = elementary_functions_name(lst,3)
-            PolyThree = np.zeros(shape=(Timelength,Numfunc))
-            j = 0
-            for ii in range(0,dim):
-                for jj in range(ii,dim):
-                    for kk in range(jj,dim):
-                        PolyThree[:,j] = TimeSeries[:,ii]*TimeSeries[:,jj]*TimeSeries[:,kk]
-                        j = j+1
-            column_values = Namefunc
-            PolyThree = pd.DataFrame(data = PolyThree, columns = column_values)
-
-        if dim == 3:
-            lst = ['x1','x2','x3']
-            Numfunc, Namefunc = elementary_functions_name(lst,3)
-            PolyThree = np.zeros(shape=(Timelength,Numfunc))
-            j = 0
-            for ii in range(0,dim):
-                for jj in range(ii,dim):
-                    for kk in range(jj,dim):
-                        PolyThree[:,j] = TimeSeries[:,ii]*TimeSeries[:,jj]*TimeSeries[:,kk]
-                        j = j+1
-            column_values = Namefunc
-            PolyThree = pd.DataFrame(data = PolyThree, columns = column_values)
-
-        if dim == 4:
-            lst = ['x1','x2','x3','x4']
-            Numfunc, Namefunc = elementary_functions_name(lst,3)
-            PolyThree = np.zeros(shape=(Timelength,Numfunc))
-            j = 0
-            for ii in range(0,dim):
-                for jj in range(ii,dim):
-                    for kk in range(jj,dim):
-                        PolyThree[:,j] = TimeSeries[:,ii]*TimeSeries[:,jj]*TimeSeries[:,kk]
-                        j = j+1
-            column_values = Namefunc
-            PolyThree = pd.DataFrame(data = PolyThree, columns = column_values)
-
-    if PolyOrder >= 4:
-        if dim == 1:
-            lst = ['x1']
-            Numfunc, Namefunc = elementary_functions_name(lst,4)
-            PolyFour = np.zeros(shape=(Timelength,Numfunc))
-            j = 0
-            for ii in range(0,dim):
-                for jj in range(ii,dim):
-                    for kk in range(jj,dim):
-                        for ll in range(kk,dim):
-                            PolyFour[:,j] = TimeSeries[:,ii]*TimeSeries[:,jj]*TimeSeries[:,kk]*TimeSeries[:,ll]
-                            j = j+1
-            column_values = Namefunc
-            PolyFour = pd.DataFrame(data = PolyFour, columns = column_values)
-
-        if dim == 2:
-            lst = ['x1','x2']
-            Numfunc, Namefunc = elementary_functions_name(lst,4)
-            PolyFour = np.zeros(shape=(Timelength,Numfunc))
-            j = 0
-            for ii in range(0,dim):
-                for jj in range(ii,dim):
-                    for kk in range(jj,dim):
-                        for ll in range(kk,dim):
-                            PolyFour[:,j] = TimeSeries[:,ii]*TimeSeries[:,jj]*TimeSeries[:,kk]*TimeSeries[:,ll]
-                            j = j+1
-            column_values = Namefunc
-            PolyFour = pd.DataFrame(data = PolyFour, columns = column_values)
+def self_ElementaryFunctions_Matrix(TimeSeries, dim, selfPolyOrder, PolynomialIndex = True, TrigonometricIndex = True, \
+    ExponentialIndex = True, FractionalIndex = True, ActivationIndex = True):
 
-        if dim == 3:
-            lst = ['x1','x2','x3']
-            Numfunc, Namefunc = elementary_functions_name(lst,4)
-            PolyFour = np.zeros(shape=(Timelength,Numfunc))
-            j = 0
-            for ii in range(0,dim):
-                for jj in range(ii,dim):
-                    for kk in range(jj,dim):
-                        for ll in range(kk,dim):
-                            PolyFour[:,j] = TimeSeries[:,ii]*TimeSeries[:,jj]*TimeSeries[:,kk]*TimeSeries[:,ll]
-                            j = j+1
-            column_values = Namefunc
-            PolyFour = pd.DataFrame(data = PolyFour, columns = column_values)
+    ElementaryArray, names = self_ElementaryFunctions_Array(TimeSeries, dim, selfPolyOrder, PolynomialIndex, \
+        TrigonometricIndex, ExponentialIndex, FractionalIndex, ActivationIndex)
+    return pd.DataFrame(data = ElementaryArray, columns = names)
+
+@functools.lru_cache(maxsize=None)
+def Polynomial_table(dim, PolyOrder):
+    """Multi-index table of all monomials of degree 1..PolyOrder in dim variables.
+
+    Columns follow itertools.combinations_with_replacement, degree by degree.
+    Returns exponents (Numfunc, dim), parent (column of the same monomial with
+    its last factor removed, -1 for degree one), last (index of that factor)
+    and the column slice of every degree.
+    """
+    combos = [combo for order in range(1,PolyOrder+1) \
+        for combo in it.combinations_with_replacement(range(0,dim),order)]
+    column = {combo: j for j, combo in enumerate(combos)}
+    exponents = np.zeros(shape=(len(combos),dim), dtype=np.int64)
+    parent = np.full(len(combos), -1, dtype=np.int64)
+    last = np.zeros(len(combos), dtype=np.int64)
+    for j, combo in enumerate(combos):
+        np.add.at(exponents[j], list(combo), 1)
+        last[j] = combo[-1]
+        if len(combo) > 1:
+            parent[j] = column[combo[:-1]]
+    degrees = []
+    start = 0
+    for order in range(1,PolyOrder+1):
+        stop = start+math.comb(dim+order-1,order)
+        degrees.append(slice(start,stop))
+        start = stop
+    for array in (exponents, parent, last):
+        array.setflags(write=False)
+    return exponents, parent, last, tuple(degrees)
+
+def Polynomial_names(dim, PolyOrder):
+    names = []
+    for order in range(1,PolyOrder+1):
+        Numfunc, Namefunc = elementary_functions_name(dimension_names(dim),order)
+        names += Namefunc
+    return names
+
+def Polynomial_array(TimeSeries, dim, PolyOrder, out = None, chunk = 2**20):
+    """Evaluate all monomials up to PolyOrder; every degree-k column is its degree-(k-1)
+    parent column times one variable. Rows are processed in blocks so that the
+    gathered parents never exceed about `chunk` elements."""
+    exponents, parent, last, degrees = Polynomial_table(dim, PolyOrder)
+    out = new_block(TimeSeries, len(parent), out)
+    x = TimeSeries[:,:dim]
+    out[:,degrees[0]] = x
+    Timelength = np.size(x, 0)
+    for block in degrees[1:]:
+        rows = max(1, chunk//max(1, block.stop-block.start))
+        for r in range(0,Timelength,rows):
+            np.multiply(out[r:r+rows,parent[block]], x[r:r+rows,last[block]], out=out[r:r+rows,block])
+    return out
 
-        if dim == 4:
-            lst = ['x1','x2','x3','x4']
-            Numfunc, Namefunc = elementary_functions_name(lst,4)
-            PolyFour = np.zeros(shape=(Timelength,Numfunc))
-            j = 0
-            for ii in range(0,dim):
-                for jj in range(ii,dim):
-                    for kk in range(jj,dim):
-                        for ll in range(kk,dim):
-                            PolyFour[:,j] = TimeSeries[:,ii]*TimeSeries[:,jj]*TimeSeries[:,kk]*TimeSeries[:,ll]
-                            j = j+1
-            column_values = Namefunc
-            PolyFour = pd.DataFrame(data = PolyFour, columns = column_values)
-    if PolyOrder == 1:
-        return PolyOne
-    if PolyOrder == 2:
-        return pd.concat([PolyOne, PolyTwo], axis=1)
-    if PolyOrder == 3:
-        return pd.concat([PolyOne, PolyTwo, PolyThree], axis=1)
-    if PolyOrder == 4:
-        return pd.concat([PolyOne, PolyTwo, PolyThree, PolyFour], axis=1)
+def Polynomial_functions(TimeSeries, dim, PolyOrder):
+    TimeSeries = np.asarray(TimeSeries)
+    return pd.DataFrame(data = Polynomial_array(TimeSeries, dim, PolyOrder), columns = Polynomial_names(dim, PolyOrder))
+
+def Trigonometric_names(dim, Sin = True, Cos = True, Tan = True):
+    names = []
+    for prefix, index in (('sin', Sin), ('cos', Cos), ('tan', Tan)):
+        if index == True:
+            names += [prefix+name for name in dimension_names(dim)]
+    return names
+
+def Trigonometric_array(TimeSeries, dim, Sin = True, Cos = True, Tan = True, out = None):
+    funcs = [func for func, index in ((np.sin, Sin), (np.cos, Cos), (np.tan, Tan)) if index == True]
+    out = new_block(TimeSeries, dim*len(funcs), out)
+    for k in range(0,len(funcs)):
+        funcs[k](TimeSeries[:,:dim], out=out[:,k*dim:(k+1)*dim])
+    return out
 
 def Trigonometric(TimeSeries, dim, Sin = True, Cos = True, Tan = True):
-    Timelength = np.size(TimeSeries, 0)
-    dim_multi_Nnodes = np.size(TimeSeries, 1)
-
-    if Sin == True:
-        sine = np.zeros(shape=(Timelength,dim))
-        for j in range(0,dim):
-            sine[:,j] = np.sin(TimeSeries[:,j])
-        if dim == 1:
-            column_values = ['sinx1']
-        if dim == 2:
-            column_values = ['sinx1','sinx2']
-        if dim == 3:
-            column_values = ['sinx1','sinx2','sinx3']
-        if dim == 4:
-            column_values = ['sinx1','sinx2','sinx3','sinx4']
-        sine = pd.DataFrame(data = sine, columns = column_values)
+    TimeSeries = np.asarray(TimeSeries)
+    return pd.DataFrame(data = Trigonometric_array(TimeSeries, dim, Sin, Cos, Tan), \
+        columns = Trigonometric_names(dim, Sin, Cos, Tan))
 
-    if Cos == True:
-        cosine = np.zeros(shape=(Timelength,dim))
-        for j in range(0,dim):
-            cosine[:,j] = np.cos(TimeSeries[:,j])
-        if dim == 1:
-            column_values = ['cosx1']
-        if dim == 2:
-            column_values = ['cosx1','cosx2']
-        if dim == 3:
-            column_values = ['cosx1','cosx2','cosx3']
-        if dim == 4:
-            column_values = ['cosx1','cosx2','cosx3','cosx4']
-        cosine = pd.DataFrame(data = cosine, columns = column_values)
+def Exponential_names(dim, expomential = True):
+    if expomential == True:
+        return ['exp'+name for name in dimension_names(dim)]
+    return []
 
-    if Tan == True:
-        tangent = np.zeros(shape=(Timelength,dim))
-        for j in range(0,dim):
-            tangent[:,j] = np.tan(TimeSeries[:,j])
-        if dim == 1:
-            column_values = ['tanx1']
-        if dim == 2:
-            column_values = ['tanx1','tanx2']
-        if dim == 3:
-            column_values = ['tanx1','tanx2','tanx3']
-        if dim == 4:
-            column_values = ['tanx1','tanx2','tanx3','tanx4']
-        tangent= pd.DataFrame(data = tangent, columns = column_values)
-    return pd.concat([sine, cosine, tangent], axis=1)
+def Exponential_array(TimeSeries, dim, expomential = True, out = None):
+    out = new_block(TimeSeries, len(Exponential_names(dim, expomential)), out)
+    if expomential == True:
+        np.exp(TimeSeries[:,:dim], out=out)
+    return out
 
 def Exponential(TimeSeries, dim, expomential = True):
-    Timelength = np.size(TimeSeries, 0)
-    dim_multi_Nnodes = np.size(TimeSeries, 1)
-    if expomential == True:
-        Exp = np.zeros(shape=(Timelength,dim))
-        for j in range(0,dim):
-            Exp[:,j] = np.exp(TimeSeries[:,j])
-        if dim == 1:
-            column_values = ['expx1']
-        if dim == 2:
-            column_values = ['expx1','expx2']
-        if dim == 3:
-            column_values = ['expx1','expx2','expx3']
-        if dim == 4:
-            column_values = ['expx1','expx2','expx3','expx4']
-        Exp = pd.DataFrame(data = Exp, columns = column_values)
-    return Exp
+    TimeSeries = np.asarray(TimeSeries)
+    return pd.DataFrame(data = Exponential_array(TimeSeries, dim, expomential), \
+        columns = Exponential_names(dim, expomential))
 
-def Fractional(TimeSeries, dim, fractional = True):
-    Timelength = np.size(TimeSeries, 0)
-    dim_multi_Nnodes = np.size(TimeSeries, 1)
+def Fractional_names(dim, fractional = True):
     if fractional == True:
-        frac = np.zeros(shape=(Timelength,dim))
-        for j in range(0,dim):
-            frac[:,j] = 1/TimeSeries[:,j]
-        if dim == 1:
-            column_values = ['fracx1']
-        if dim == 2:
-            column_values = ['fracx1','fracx2']
-        if dim == 3:
-            column_values = ['fracx1','fracx2','fracx3']
-        if dim == 4:
-            column_values = ['fracx1','fracx2','fracx3','fracx4']
-        frac = pd.DataFrame(data = frac, columns = column_values)
-    return frac
+        return ['frac'+name for name in dimension_names(dim)]
+    return []
 
-def Activation(TimeSeries, dim, Sigmoid = True, Tanh = True, Regulation = True):
-    Timelength = np.size(TimeSeries, 0)
-    dim_multi_Nnodes = np.size(TimeSeries, 1)
+def Fractional_array(TimeSeries, dim, fractional = True, out = None):
+    out = new_block(TimeSeries, len(Fractional_names(dim, fractional)), out)
+    if fractional == True:
+        np.divide(1, TimeSeries[:,:dim], out=out)
+    return out
+
+def Fractional(TimeSeries, dim, fractional = True):
+    TimeSeries = np.asarray(TimeSeries)
+    return pd.DataFrame(data = Fractional_array(TimeSeries, dim, fractional), \
+        columns = Fractional_names(dim, fractional))
+
+def Activation_names(dim, Sigmoid = True, Tanh = True, Regulation = True):
+    names = []
     if Sigmoid == True:
-        #alpha = np.linspace(1,10,10)
-        alpha = [1, 5, 10]
-        #beta = np.linspace(0,10,11)
-        beta = [0,1, 5, 10]
-        Numfunc = len(alpha)*len(beta)
-        sigmoid = np.zeros(shape=(Timelength,dim*Numfunc))
-        kk = 0
         for j in range(0,dim):
-            for ii in range(0,len(alpha)):
-                for jj in range(0,len(beta)):
-                    sigmoid[:,kk] = 1./(1.+np.exp(-alpha[ii]*(TimeSeries[:,j]-beta[jj])))
-                    kk = kk+1
-        kk = 0
-        Sigmoid = pd.DataFrame()
-        for j in range(0,dim):
-            for ii in range(0,len(alpha)):
-                for jj in range(0,len(beta)):
-                    tmp = ["sig_x"+str(j+1)+"_"+str(alpha[ii])+str(beta[jj])]
-                    tmp_2 = pd.DataFrame(data = sigmoid[:,kk], columns = tmp)
-                    kk = kk+1
-                    Sigmoid = pd.concat([Sigmoid,tmp_2], axis=1)
-    
+            for alpha in Sigmoid_alpha:
+                for beta in Sigmoid_beta:
+                    names.append("sig_x"+str(j+1)+"_"+str(alpha)+str(beta))
     if Tanh == True:
-        tanh = np.zeros(shape=(Timelength,dim))
-        for j in range(0,dim):
-            tanh[:,j] = (np.exp(TimeSeries[:,j])-np.exp(-TimeSeries[:,j]))/(np.exp(TimeSeries[:,j])+np.exp(-TimeSeries[:,j]))
-        if dim == 1:
-            column_values = ['tanhx1']
-        if dim == 2:
-            column_values = ['tanhx1','tanhx2']
-        if dim == 3:
-            column_values = ['tanhx1','tanhx2','tanhx3']
-        if dim == 4:
-            column_values = ['tanhx1','tanhx2','tanhx3','tanhx4']
-        tanh = pd.DataFrame(data = tanh, columns = column_values)
-
+        names += ['tanh'+name for name in dimension_names(dim)]
     if Regulation == True:
-        #gamma = np.linspace(0,10,11)
-        gamma = [1,2,5,10]
-        Numfunc = len(gamma)
-        regulation = np.zeros(shape=(Timelength,dim*Numfunc))
-        kk = 0
         for j in range(0,dim):
-            for ii in range(0,len(gamma)):
-                    regulation[:,kk] = (TimeSeries[:,j]**gamma[ii])/(TimeSeries[:,j]**gamma[ii]+1)
-                    kk = kk+1
-
+            for gamma in Regulation_gamma:
+                names.append("regx"+str(j+1)+"_"+str(gamma))
+    return names
+
+def Activation_array(TimeSeries, dim, Sigmoid = True, Tanh = True, Regulation = True, out = None):
+    out = new_block(TimeSeries, len(Activation_names(dim, Sigmoid, Tanh, Regulation)), out)
+    x = TimeSeries[:,:dim]
+    start = 0
+    if Sigmoid == True:
+        # columns run over (dimension, alpha, beta), so one (alpha, beta) pair is a strided view over all dimensions
+        Numfunc = len(Sigmoid_alpha)*len(Sigmoid_beta)
+        stop = start+dim*Numfunc
         kk = 0
-        Regulation = pd.DataFrame()
-        for j in range(0,dim):
-            for ii in range(0,len(gamma)):
-                tmp = ["regx"+str(j+1)+"_"+str(gamma[ii])]
-                tmp_2 = pd.DataFrame(data = regulation[:,kk], columns = tmp)
+        for alpha in Sigmoid_alpha:
+            for beta in Sigmoid_beta:
+                col = out[:,start+kk:stop:Numfunc]
+                np.subtract(x, beta, out=col)
+                col *= -alpha
+                np.exp(col, out=col)
+                col += 1.
+                np.reciprocal(col, out=col)
                 kk = kk+1
-                Regulation = pd.concat([Regulation,tmp_2], axis=1)
-    return pd.concat([Sigmoid, tanh, Regulation], axis=1)
\ No newline at end of file
+        start = stop
+    if Tanh == True:
+        np.tanh(x, out=out[:,start:start+dim])
+        start = start+dim
+    if Regulation == True:
+        Numfunc = len(Regulation_gamma)
+        stop = start+dim*Numfunc
+        for kk in range(0,Numfunc):
+            col = out[:,start+kk:stop:Numfunc]
+            np.power(x, Regulation_gamma[kk], out=col)
+            np.divide(col, col+1, out=col)
+        start = stop
+    return out
+
+def Activation(TimeSeries, dim, Sigmoid = True, Tanh = True, Regulation = True):
+    TimeSeries = np.asarray(TimeSeries)
+    return pd.DataFrame(data = Activation_array(TimeSeries, dim, Sigmoid, Tanh, Regulation), \
+        columns = Activation_names(dim, Sigmoid, Tanh, Regulation))
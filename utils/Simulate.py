@@ -0,0 +1,239 @@
+"""Simulate
+   Batched Monte Carlo rollouts of the trained SDI models.
+
+The notebooks reproduce trajectories one snapshot at a time: a new Data object per step,
+one call of average_trajectories / sample_trajectories and a copy back into X[i+1].
+simulate(model, x0, n_steps, n_paths) advances n_paths independent realizations at once as
+one batched graph (n_paths copies of edge_index, offset by k*N as in a PyG Batch), draws the
+Gaussian increments block_size steps at a time and writes the states into a preallocated
+[n_steps, n_paths, N, d] buffer under torch.inference_mode, out[t] being the state after
+t+1 steps of dt (the x_Update of the notebooks for dt = delt_t).
+
+SDIunweighted, SDIweighted and SDI_Difftype (SDIcore models) are integrated as the Ito SDE
+dx = f dt + b dW of their coefficients() on the first ndim features (the others are kept),
+with the scheme
+    euler     Euler-Maruyama, the training transition for dt = delt_t,
+    milstein  derivative-free Milstein (Kloeden & Platen 11.1) for the diagonal noise,
+              the cross terms b_j d_j b_k, j != k, are neglected,
+    heun      stochastic Heun of Roberts (2012), Ito, two drift evaluations per step,
+    srk       Heun drift with the Milstein correction and error control: the difference to
+              the Euler-Maruyama step, max(rtol*|x|, atol) scaled and RMS over the batch,
+              must be below 1; rejected steps are halved, the increments of the halves
+              drawn from the Brownian bridge, and every interval dt starts from the depth of
+              the last accepted step of the previous one, less one.
+The underdamped flock models (SDI_underdamp, LaGNA_flocks.SDI_Difftype, state [position,
+velocity]) are integrated with
+    euler     their sample_trajectories step, x <- x + v*dt + v_new*dt, at dt = delt_t only,
+    baoab     the Langevin splitting B A O A B of dx = v dt, dv = a dt + s dW with the
+              acceleration a (dvdt) and velocity diffusion s of the model: half kicks with a,
+              exact half drifts of the position and the noise in the middle, stable at
+              several times delt_t. a depends on the velocity, so it is evaluated twice per
+              step (the force evaluation of the last kick is not reused).
+noise=False gives the mean trajectories (the drift ODE for the SDIcore schemes).
+"""
+
+import numpy as np
+import torch
+
+from Graph_loader import GraphBatch
+from NeuGNN_model import SDIcore
+
+
+def batched_edges(edge_index, N, n_paths):
+    """edge_index [2, E] of n_paths copies of a graph with N nodes."""
+    offsets = N*torch.arange(n_paths, device=edge_index.device)
+    return (edge_index[:,None,:]+offsets[None,:,None]).reshape(2,-1)
+
+def at(g, x):
+    return GraphBatch(x, None, g.edge_index, None, g.index)
+
+def with_dims(x, y):
+    """x with its first y.shape[1] features replaced by y."""
+    return torch.cat([y, x[:,y.shape[1]:]], dim=1)
+
+def milstein_correction(model, x, f, b, dW, h):
+    """0.5 b_k d_k b_k (dW_k^2 - h) with d_k b_k from the support values b_k(x + f h + b_k sqrt(h) e_k),
+    the ndim supports evaluated as one batch of the stochastic heads."""
+    rows, ndim = b.shape
+    support = x.repeat(ndim, 1).reshape(ndim, rows, -1)
+    support[:,:,:ndim] += f*h
+    k = torch.arange(ndim, device=x.device)
+    support[k,:,k] += b.t()*np.sqrt(h)
+    b_support = model.diffusion(support.reshape(ndim*rows, -1)).reshape(ndim, rows, ndim)
+    return (b_support[k,:,k].t()-b)*(dW**2-h)/(2*np.sqrt(h))
+
+def euler(model, g, dW, h, generator=None):
+    f, b = model.coefficients(g)
+    y = g.x[:,:model.ndim]+f*h
+    return with_dims(g.x, y if dW is None else y+b*dW)
+
+def milstein(model, g, dW, h, generator=None):
+    f, b = model.coefficients(g)
+    y = g.x[:,:model.ndim]+f*h
+    if dW is not None:
+        y = y+b*dW+milstein_correction(model, g.x, f, b, dW, h)
+    return with_dims(g.x, y)
+
+def heun(model, g, dW, h, generator=None):
+    """K1 = f(x) h + (dW - S sqrt(h)) b(x), K2 = f(x+K1) h + (dW + S sqrt(h)) b(x+K1),
+    x <- x + (K1+K2)/2 with random signs S."""
+    x = g.x[:,:model.ndim]
+    f, b = model.coefficients(g)
+    if dW is None:
+        K1 = f*h
+        f2, b2 = model.coefficients(at(g, with_dims(g.x, x+K1)))
+        return with_dims(g.x, x+0.5*(K1+f2*h))
+    S = (2*torch.randint(0, 2, dW.shape, device=dW.device, generator=generator)-1).to(dW.dtype)
+    K1 = f*h+(dW-S*np.sqrt(h))*b
+    f2, b2 = model.coefficients(at(g, with_dims(g.x, x+K1)))
+    K2 = f2*h+(dW+S*np.sqrt(h))*b2
+    return with_dims(g.x, x+0.5*(K1+K2))
+
+def srk(model, g, dW, h, generator=None):
+    """Heun drift with the Milstein correction and the difference to Euler-Maruyama."""
+    x = g.x[:,:model.ndim]
+    f, b = model.coefficients(g)
+    euler = x+f*h if dW is None else x+f*h+b*dW
+    f2, b2 = model.coefficients(at(g, with_dims(g.x, euler)))
+    y = x+0.5*(f+f2)*h
+    if dW is not None:
+        y = y+b*dW+milstein_correction(model, g.x, f, b, dW, h)
+    return with_dims(g.x, y), y-euler
+
+Schemes = {'euler': euler, 'milstein': milstein, 'heun': heun, 'srk': srk}
+
+def bridge(dW, h, m, generator=None):
+    """Increments [m, rows, ndim] of m equal steps of h/m summing to dW (Brownian bridge)."""
+    u = np.sqrt(h/m)*torch.randn(m, *dW.shape, device=dW.device, dtype=dW.dtype, generator=generator)
+    return u-u.mean(0)+dW/m
+
+class AdaptiveSteps:
+    """Error-controlled srk steps over intervals of length dt, bisecting rejected steps."""
+    def __init__(self, rtol=1e-2, atol=1e-3, max_depth=10):
+        self.rtol = rtol
+        self.atol = atol
+        self.max_depth = max_depth
+        self.depth = 0
+        self.steps = 0
+        self.rejected = 0
+
+    def error(self, x, y, err):
+        scale = torch.clamp(self.rtol*torch.maximum(x.abs(), y.abs()), min=self.atol)
+        return float(torch.sqrt(torch.mean((err/scale)**2)))
+
+    def __call__(self, model, g, dW, h, generator=None):
+        depth = max(self.depth-1, 0)
+        m = 2**depth
+        pieces = [None]*m if dW is None else list(bridge(dW, h, m, generator))
+        stack = [(h/m, w, depth) for w in reversed(pieces)]
+        x = g.x
+        while stack:
+            step, w, depth = stack.pop()
+            y, err = srk(model, at(g, x), w, step)
+            if depth < self.max_depth and self.error(x[:,:model.ndim], y[:,:model.ndim], err) > 1:
+                self.rejected += 1
+                halves = [None, None] if w is None else list(bridge(w, step, 2, generator))
+                stack += [(step/2, halves[1], depth+1), (step/2, halves[0], depth+1)]
+                continue
+            self.steps += 1
+            self.depth = depth
+            x = y
+        return x
+
+def underdamped_step(model, g, dW, h, generator=None):
+    """Next [position, velocity] of a flock model, dW [rows, ndim] (None: mean)."""
+    ndim = model.ndim
+    out = model.SDI_weighted(g)
+    if dW is None:
+        v = out[ndim+1]
+    else:
+        v = torch.cat([dist.loc+dist.scale*dW[:,k:k+1]/np.sqrt(h) for k, dist in enumerate(out[:ndim])], dim=1)
+    x = g.x
+    return torch.cat([x[:,:ndim]+x[:,ndim:2*ndim]*model.delt_t+v*model.delt_t, v, x[:,2*ndim:]], dim=1)
+
+def flock_coefficients(model, g):
+    """Acceleration a and velocity diffusion s [rows, ndim] of a flock model, dv = a dt + s dW."""
+    out = model.SDI_weighted(g)
+    scale = torch.cat([dist.scale for dist in out[:model.ndim]], dim=1)
+    return out[-1], scale/np.sqrt(model.delt_t)
+
+def baoab(model, g, dW, h, generator=None):
+    """Half kick, half drift, noise, half drift, half kick; the learned acceleration keeps the
+    velocity dependent forces (friction, alignment) in the kicks and s is taken at the start."""
+    ndim = model.ndim
+    x, v = g.x[:,:ndim], g.x[:,ndim:2*ndim]
+    a, s = flock_coefficients(model, g)
+    v = v+0.5*h*a
+    x = x+0.5*h*v
+    if dW is not None:
+        v = v+s*dW
+    x = x+0.5*h*v
+    a = flock_coefficients(model, at(g, torch.cat([x, v, g.x[:,2*ndim:]], dim=1)))[0]
+    v = v+0.5*h*a
+    return torch.cat([x, v, g.x[:,2*ndim:]], dim=1)
+
+FlockSchemes = {'euler': underdamped_step, 'baoab': baoab}
+
+def step_function(model, scheme, dt, rtol, atol, max_depth):
+    if isinstance(model, SDIcore):
+        if isinstance(scheme, AdaptiveSteps):
+            return scheme
+        if scheme not in Schemes:
+            raise ValueError('scheme must be one of %s' % (tuple(Schemes),))
+        return AdaptiveSteps(rtol, atol, max_depth) if scheme == 'srk' else Schemes[scheme]
+    if hasattr(model, 'SDI_weighted'):
+        if scheme not in FlockSchemes:
+            raise ValueError('scheme must be one of %s' % (tuple(FlockSchemes),))
+        if scheme == 'euler' and dt != model.delt_t:
+            raise ValueError('%s is simulated with euler at dt = delt_t only, use baoab' % type(model).__name__)
+        return FlockSchemes[scheme]
+    raise TypeError('%s is not an SDI model' % type(model).__name__)
+
+def model_caches(model):
+    """Caches of model filled on first use (tiled edge weights, aggregation matrices)."""
+    caches = [model.__dict__.setdefault('tiles', {})]
+    if getattr(model, 'aggregation', None) is not None:
+        caches.append(model.aggregation.cache)
+    return caches
+
+def simulate(model, x0, n_steps, n_paths=1, edge_index=None, noise=True, block_size=64, generator=None, out=None,
+        scheme='euler', dt=None, rtol=1e-2, atol=1e-3, max_depth=10):
+    """States [n_steps, n_paths, N, d] of n_paths realizations from x0 [N, d] (or [n_paths, N, d]).
+
+    edge_index defaults to model.edge_index, generator is a torch.Generator on the device of
+    the model for reproducible increments, out an optional preallocated buffer. dt (default
+    delt_t) is the output interval, the step of euler / milstein / heun; rtol, atol and
+    max_depth (at least dt/2**max_depth) control srk, or scheme is an AdaptiveSteps whose
+    steps and rejected count the srk steps.
+    """
+    parameter = next(model.parameters())
+    device, dtype = parameter.device, parameter.dtype
+    dt = model.delt_t if dt is None else dt
+    edge_index = torch.as_tensor(model.edge_index if edge_index is None else edge_index).long().to(device)
+    x0 = torch.as_tensor(x0).to(device=device, dtype=dtype)
+    N, d = x0.shape[-2], x0.shape[-1]
+    if out is None:
+        out = torch.empty(n_steps, n_paths, N, d, device=device, dtype=dtype)
+    elif tuple(out.shape) != (n_steps, n_paths, N, d):
+        raise ValueError('out has shape %s, expected %s' % (tuple(out.shape), (n_steps, n_paths, N, d)))
+    step = step_function(model, scheme, dt, rtol, atol, max_depth)
+    rows = n_paths*N
+    # tensors cached during the rollout are inference tensors, unusable for training afterwards
+    caches = model_caches(model)
+    before = [dict(cache) for cache in caches]
+    try:
+        with torch.inference_mode():
+            g = GraphBatch(x0.expand(n_paths, N, d).reshape(rows, d), None, batched_edges(edge_index, N, n_paths), None,
+                torch.arange(n_paths, device=device))
+            for start in range(0, n_steps, block_size):
+                block = min(block_size, n_steps-start)
+                if noise:
+                    dW = np.sqrt(dt)*torch.randn(block, rows, model.ndim, device=device, dtype=dtype, generator=generator)
+                for t in range(block):
+                    g.x = step(model, g, dW[t] if noise else None, dt, generator)
+                    out[start+t] = g.x.reshape(n_paths, N, d)
+    finally:
+        for cache, entries in zip(caches, before):
+            cache.clear()
+            cache.update(entries)
+    return out
@@ -0,0 +1,156 @@
+"""Sparse ensemble
+   Bootstrap / subsample ensembles of the Sparse_regression discovery.
+
+The design matrix and the targets are placed in shared memory once (or, for a
+memory-mapped library such as the entries of Library_cache, reopened from its
+file), and every worker of a process pool attaches to them without a copy. A
+resample is a vector of row multiplicities, used as sample weights of the Gram
+statistics, so no resampled matrix is ever built. The coefficients of all fits
+give the inclusion probability and the coefficient distribution of every term.
+"""
+
+import copy
+import mmap
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+import Sparse_regression
+
+def file_offset(array):
+    """Byte offset in its file of the data of a memmap (or memmap view), None if unknown.
+
+    Views keep the filename and offset of the memmap they come from, so the offset is
+    recomputed from the data pointer and the start of the mapping (the parent's offset
+    rounded down to the allocation granularity, as np.memmap maps it)."""
+    buffer = getattr(array, '_mmap', None)
+    if buffer is None or array.offset is None:
+        return None
+    start = array.offset-array.offset%mmap.ALLOCATIONGRANULARITY
+    return start+array.ctypes.data-np.frombuffer(buffer, dtype=np.uint8).ctypes.data
+
+def share(array):
+    """Put array in shared memory, returns the SharedMemory block and a descriptor for attach()."""
+    if isinstance(array, np.memmap) and array.filename is not None and \
+            (array.flags.c_contiguous or array.flags.f_contiguous):
+        offset = file_offset(array)
+        if offset is not None:
+            order = 'C' if array.flags.c_contiguous else 'F'
+            return None, ('memmap', array.filename, offset, array.shape, array.dtype.str, order)
+    # strided views of a memmap are copied like any other array
+    array = np.asarray(array)
+    block = shared_memory.SharedMemory(create=True, size=max(array.nbytes,1))
+    view = np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)
+    view[...] = array
+    return block, ('shm', block.name, 0, array.shape, array.dtype.str, 'C')
+
+def attach(descriptor):
+    kind, name, offset, shape, dtype, order = descriptor
+    if kind == 'memmap':
+        return None, np.memmap(name, dtype=dtype, mode='r', offset=offset, shape=shape, order=order)
+    block = shared_memory.SharedMemory(name=name)
+    return block, np.ndarray(shape, dtype=dtype, buffer=block.buf)
+
+# arrays of the current worker process, set by worker_init
+Worker = {}
+
+def worker_init(X_descriptor, y_descriptor, weight_descriptor, names, target_names):
+    Worker['X'] = attach(X_descriptor)
+    Worker['y'] = attach(y_descriptor)
+    Worker['sample_weight'] = None if weight_descriptor is None else attach(weight_descriptor)
+    Worker['names'] = names
+    Worker['target_names'] = target_names
+
+def resample_fit(estimator, seed, fraction=1.0, replace=True, chunk_size=2**16):
+    """Fit estimator on one resample (drawn from seed) of the worker's matrix, returns its coef_."""
+    block, X = Worker['X']
+    block, y = Worker['y']
+    sample_weight = None if Worker['sample_weight'] is None else Worker['sample_weight'][1]
+    counts = resample_counts(np.random.default_rng(seed), len(X), fraction, replace, sample_weight)
+    rows = np.flatnonzero(counts)
+    stats = Sparse_regression.GramStatistics(np.size(X,1), len(rows), np.size(y,1), estimator.cv, \
+        Worker['names'], Worker['target_names'])
+    for start in range(0,len(rows),chunk_size):
+        chunk = rows[start:start+chunk_size]
+        stats.update(slice(start,start+len(chunk)), X[chunk], y[chunk], counts[chunk])
+    return estimator.fit_statistics(stats).coef_
+
+def resample_counts(rng, Timelength, fraction=1.0, replace=True, sample_weight=None):
+    """Row multiplicities of one bootstrap (replace=True) or subsample (replace=False) draw."""
+    size = int(round(fraction*Timelength))
+    if replace:
+        counts = np.bincount(rng.integers(0,Timelength,size=size), minlength=Timelength).astype(np.float64)
+    else:
+        counts = np.zeros(Timelength)
+        counts[rng.choice(Timelength, size=size, replace=False)] = 1.
+    return counts if sample_weight is None else counts*sample_weight
+
+
+class BootstrapEnsemble:
+    """Ensemble of a Sparse_regression estimator (GramLassoCV by default) over resampled rows.
+
+    After fit, coefs_ holds the coefficients of every model (n_models, [n_targets,] Numfunc)
+    in the original units, inclusion_ the fraction of models selecting each term and
+    summary() a table of inclusion probability and coefficient quantiles.
+    """
+    def __init__(self, estimator=None, n_models=100, fraction=1.0, replace=True, n_jobs=None, random_state=0, \
+            chunk_size=2**16):
+        self.estimator = Sparse_regression.GramLassoCV() if estimator is None else estimator
+        self.n_models = n_models
+        self.fraction = fraction
+        self.replace = replace
+        self.n_jobs = n_jobs
+        self.random_state = random_state
+        self.chunk_size = chunk_size
+
+    def fit(self, X, y, sample_weight=None):
+        names = list(X.columns) if isinstance(X, pd.DataFrame) else list(range(0,np.size(X,1)))
+        target_names = list(y.columns) if isinstance(y, pd.DataFrame) else None
+        X = X.values if isinstance(X, pd.DataFrame) else X
+        y = np.asarray(y, dtype=np.float64).reshape(len(X),-1)
+        if target_names is None:
+            target_names = list(range(0,np.size(y,1)))
+        seeds = np.random.SeedSequence(self.random_state).spawn(self.n_models)
+        tasks = ([copy.deepcopy(self.estimator) for i in range(0,self.n_models)], seeds, [self.fraction]*self.n_models, \
+            [self.replace]*self.n_models, [self.chunk_size]*self.n_models)
+        if self.n_jobs == 1:
+            try:
+                Worker.update(X=(None, X), y=(None, y), names=names, target_names=target_names, \
+                    sample_weight=None if sample_weight is None else (None, np.asarray(sample_weight)))
+                coefs = list(map(resample_fit, *tasks))
+            finally:
+                Worker.clear()
+        else:
+            blocks = []
+            try:
+                descriptors = []
+                for array in (X, y, sample_weight):
+                    block, descriptor = (None, None) if array is None else share(array)
+                    blocks.append(block)
+                    descriptors.append(descriptor)
+                with ProcessPoolExecutor(max_workers=self.n_jobs, initializer=worker_init, \
+                        initargs=(*descriptors, names, target_names)) as pool:
+                    coefs = list(pool.map(*(resample_fit,)+tasks))
+            finally:
+                for block in blocks:
+                    if block is not None:
+                        block.close()
+                        block.unlink()
+        self.coefs_ = np.stack(coefs)
+        self.inclusion_ = np.mean(self.coefs_ != 0, axis=0)
+        self.coef_mean_ = np.mean(self.coefs_, axis=0)
+        self.coef_median_ = np.median(self.coefs_, axis=0)
+        self.names_ = names
+        self.target_names_ = target_names
+        return self
+
+    def summary(self, target=0, quantiles=(0.05, 0.5, 0.95)):
+        """Inclusion probability, mean, std and quantiles of every term, sorted by inclusion."""
+        coefs = self.coefs_ if self.coefs_.ndim == 2 else self.coefs_[:,target]
+        table = pd.DataFrame(dict(inclusion=np.mean(coefs != 0, axis=0), mean=coefs.mean(axis=0), \
+            std=coefs.std(axis=0)), index=self.names_)
+        for q in quantiles:
+            table['q%g' % (100*q)] = np.quantile(coefs, q, axis=0)
+        return table.sort_values('inclusion', ascending=False)
@@ -0,0 +1,436 @@
+"""Sparse regression
+   Lasso and cross-validation on accumulated Gram statistics.
+
+The library width F is small (~50-100) while the number of rows reaches 10^7, so
+the design matrix is reduced in a single streaming pass to the per-fold sums
+X^T W X, X^T W y, y^T W y and the column l1 norms (W are optional sample weights,
+e.g. the counts of Library_dedup). The notebooks' l1 normalization
+X[:,i]*L/sum|X[:,i]|, y*L/sum|y| is applied afterwards in the F x F space, and the
+whole LassoCV problem (alpha grid, K-fold path, refit) is solved there as well.
+Along the warm-started path only the columns passing the sequential strong rule
+are optimized (checked against the KKT conditions), so wide libraries cost little
+more than their active set.
+"""
+
+import numpy as np
+import pandas as pd
+
+def fold_bounds(Timelength, n_folds):
+    """Contiguous folds of sklearn.model_selection.KFold(n_folds) without shuffling."""
+    sizes = np.full(n_folds, Timelength//n_folds, dtype=np.int64)
+    sizes[:Timelength % n_folds] += 1
+    return np.concatenate(([0], np.cumsum(sizes)))
+
+class GramStatistics:
+    """Per-fold sums of a (weighted) regression problem X w = y.
+
+    Call update(rows, X_block, y_block) for the row blocks of the design matrix
+    (any order, e.g. the (rows, block) pairs of a Library_stream.LibraryStream).
+    Columns with non-finite values are excluded (finite[i] == False) and get a
+    zero coefficient.
+    """
+    def __init__(self, Numfunc, Timelength, n_targets=1, n_folds=5, names=None, target_names=None):
+        self.Numfunc = Numfunc
+        self.Timelength = int(Timelength)
+        self.n_targets = n_targets
+        self.n_folds = n_folds
+        self.names = list(range(0,Numfunc)) if names is None else list(names)
+        self.target_names = list(range(0,n_targets)) if target_names is None else list(target_names)
+        self.bounds = fold_bounds(self.Timelength, n_folds)
+        self.XtX = np.zeros(shape=(n_folds,Numfunc,Numfunc))
+        self.Xty = np.zeros(shape=(n_folds,Numfunc,n_targets))
+        self.yty = np.zeros(shape=(n_folds,n_targets))
+        self.ysum = np.zeros(shape=(n_folds,n_targets))
+        self.weight = np.zeros(n_folds)
+        self.x_norml1 = np.zeros(Numfunc)
+        self.y_norml1 = np.zeros(n_targets)
+        self.finite = np.ones(Numfunc, dtype=bool)
+
+    def update(self, rows, X, y, sample_weight=None):
+        X = np.asarray(X, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64).reshape(len(X),-1)
+        w = np.ones(len(X)) if sample_weight is None else np.asarray(sample_weight, dtype=np.float64)
+        finite = np.isfinite(X).all(axis=0)
+        if not finite.all():
+            self.finite &= finite
+            X = np.where(finite, X, 0.)
+        self.x_norml1 += w @ np.abs(X)
+        self.y_norml1 += w @ np.abs(y)
+        start = rows.start
+        stop = start+len(X)
+        for k in range(0,self.n_folds):
+            lo, hi = max(start,self.bounds[k]), min(stop,self.bounds[k+1])
+            if lo >= hi:
+                continue
+            Xk, yk, wk = X[lo-start:hi-start], y[lo-start:hi-start], w[lo-start:hi-start]
+            WX = Xk*wk[:,None]
+            self.XtX[k] += WX.T @ Xk
+            self.Xty[k] += WX.T @ yk
+            self.yty[k] += wk @ (yk*yk)
+            self.ysum[k] += wk @ yk
+            self.weight[k] += wk.sum()
+        return self
+
+    def scales(self, normalize=True):
+        """Column factors of the l1 normalization, X_norm = X*x_scale, y_norm = y*y_scale."""
+        L = self.weight.sum()
+        if not normalize:
+            return np.where(self.finite, 1., 0.), np.ones(self.n_targets)
+        with np.errstate(divide='ignore'):
+            x_scale = np.where(self.finite & (self.x_norml1 > 0), L/self.x_norml1, 0.)
+            y_scale = np.where(self.y_norml1 > 0, L/self.y_norml1, 1.)
+        return x_scale, y_scale
+
+    def normalized(self, normalize=True):
+        """Per-fold normalized sums (XtX, Xty, yty, ysum, weight)."""
+        x_scale, y_scale = self.scales(normalize)
+        XtX = self.XtX*x_scale[:,None]*x_scale[None,:]
+        Xty = self.Xty*x_scale[:,None]*y_scale
+        return XtX, Xty, self.yty*y_scale**2, self.ysum*y_scale, self.weight
+
+
+def gram_statistics(X, y, sample_weight=None, n_folds=5, chunk_size=2**16):
+    """GramStatistics of an in-memory (or memory-mapped) design matrix, X may be a DataFrame."""
+    names = list(X.columns) if isinstance(X, pd.DataFrame) else None
+    target_names = list(y.columns) if isinstance(y, pd.DataFrame) else None
+    X = X.values if isinstance(X, pd.DataFrame) else X
+    y = np.asarray(y).reshape(len(X),-1)
+    stats = GramStatistics(np.size(X,1), len(X), np.size(y,1), n_folds, names, target_names)
+    for start in range(0,len(X),chunk_size):
+        rows = slice(start,min(start+chunk_size,len(X)))
+        stats.update(rows, X[rows], y[rows], None if sample_weight is None else sample_weight[rows])
+    return stats
+
+def stream_gram_statistics(stream, y, sample_weight=None, n_folds=5):
+    """GramStatistics of a Library_stream.LibraryStream in one pass over its chunks."""
+    target_names = list(y.columns) if isinstance(y, pd.DataFrame) else None
+    y = np.asarray(y).reshape(stream.Timelength,-1)
+    stats = GramStatistics(len(stream.names), stream.Timelength, np.size(y,1), n_folds, stream.names, target_names)
+    for rows, block in stream:
+        stats.update(rows, block, y[rows], None if sample_weight is None else sample_weight[rows])
+    return stats
+
+def alpha_grid(Xty, n, n_alphas=100, eps=1e-3):
+    """Decreasing log grid from the smallest alpha with an all-zero solution, as in sklearn."""
+    alpha_max = np.max(np.abs(Xty))/n
+    if alpha_max <= 0:
+        return np.full(n_alphas, np.finfo(float).resolution)
+    return np.logspace(np.log10(alpha_max*eps), np.log10(alpha_max), num=n_alphas)[::-1]
+
+def duality_gap(G, b, yy, w, alpha):
+    """Duality gap of 1/2 w^T G w - b^T w + yy/2 + alpha*|w|_1 (the Lasso objective divided by n)."""
+    Gw = G @ w
+    R_norm2 = yy-2*(b @ w)+w @ Gw
+    dual_norm = np.max(np.abs(b-Gw)) if len(w) else 0.
+    const = alpha/dual_norm if dual_norm > alpha else 1.
+    return 0.5*R_norm2*(1+const**2)+alpha*np.sum(np.abs(w))-const*(yy-b @ w)
+
+def coordinate_descent(G, b, yy, alpha, w, max_iter=1000, tol=1e-4):
+    """Active-set cyclic coordinate descent of 1/2 w^T G w - b^T w + alpha*|w|_1.
+
+    Full sweeps alternate with sweeps over the nonzero coordinates only; after every
+    full sweep the exact solution on the current support is tried (support_solve).
+    Stops on the sklearn criterion (duality gap below tol*yy) after a full sweep.
+    """
+    Numfunc = len(b)
+    w = np.array(w, dtype=np.float64)
+    q = G @ w
+    # python floats in the scalar updates, numpy only for the rank-one update of q
+    diag = np.diag(G).tolist()
+    b_list = b.tolist()
+    tol = tol*yy
+    full = True
+    for it in range(0,max_iter):
+        w_max = d_max = 0.
+        for j in (range(0,Numfunc) if full else np.flatnonzero(w).tolist()):
+            d = diag[j]
+            if d <= 0:
+                continue
+            old = float(w[j])
+            rho = b_list[j]-float(q[j])+d*old
+            if rho > alpha:
+                new = (rho-alpha)/d
+            elif rho < -alpha:
+                new = (rho+alpha)/d
+            else:
+                new = 0.
+            if new != old:
+                q += G[:,j]*(new-old)
+                w[j] = new
+                d_max = max(d_max,abs(new-old))
+            w_max = max(w_max,abs(new))
+        converged = w_max == 0. or d_max/w_max < 1e-4
+        if full:
+            polished = support_solve(G, b, alpha, w)
+            if polished is not None:
+                w, q = polished, G @ polished
+                converged = True
+            if (converged or it == max_iter-1) and duality_gap(G, b, yy, w, alpha) < tol:
+                break
+            full = False
+        elif converged:
+            full = True
+    return w
+
+def support_solve(G, b, alpha, w):
+    """Exact Lasso solution on the support and signs of w, G_AA w_A = b_A - alpha*sign(w_A).
+
+    Returns None unless the solution keeps the signs and satisfies the KKT
+    conditions of the zero coordinates; collinear libraries make coordinate
+    descent crawl, this step ends it once the support has settled.
+    """
+    A = np.flatnonzero(w)
+    if len(A) == 0:
+        return None
+    sign = np.sign(w[A])
+    try:
+        w_A = np.linalg.solve(G[np.ix_(A,A)], b[A]-alpha*sign)
+    except np.linalg.LinAlgError:
+        return None
+    if not np.all(np.sign(w_A) == sign):
+        return None
+    polished = np.zeros_like(w)
+    polished[A] = w_A
+    if np.any(np.abs(b-G[:,A] @ w_A) > alpha*(1+1e-9)):
+        return None
+    return polished
+
+def lasso_gram(G, b, yy, alpha, w=None, max_iter=1000, tol=1e-4, alpha_prev=None, hint=None):
+    """Lasso in Gram space with sequential strong-rule screening.
+
+    G = X^T X/n, b = X^T y/n and yy = y^T y/n; minimizes 1/(2n)||y - X w||^2 + alpha*|w|_1.
+    Only the columns passing the strong rule |b - G w_prev| >= 2*alpha - alpha_prev
+    (plus the current nonzeros and the optional boolean hint) are optimized; the
+    KKT conditions of the discarded columns are checked afterwards and violators
+    are added back, so the solution is that of the full problem.
+    """
+    Numfunc = len(b)
+    w = np.zeros(Numfunc) if w is None else np.array(w, dtype=np.float64)
+    alpha_prev = alpha if alpha_prev is None else alpha_prev
+    c = b-G @ w
+    strong = ((np.abs(c) >= 2*alpha-alpha_prev) | (w != 0)) & (np.diag(G) > 0)
+    if hint is not None:
+        strong |= hint
+    while True:
+        E = np.flatnonzero(strong)
+        w[E] = coordinate_descent(G[np.ix_(E,E)], b[E], yy, alpha, w[E], max_iter, tol)
+        c = b-G[:,E] @ w[E]
+        violators = ~strong & (np.abs(c) > alpha*(1+1e-9)) & (np.diag(G) > 0)
+        if not violators.any():
+            return w
+        strong |= violators
+
+def lasso_path_gram(G, b, yy, alphas, max_iter=1000, tol=1e-4, screening=True, hints=None):
+    """Warm-started Lasso path, returns the coefficients (Numfunc, n_alphas).
+
+    hints (Numfunc, n_alphas) seeds the screened set of every alpha, e.g. with the
+    support of the full-data path when solving the cross-validation folds.
+    """
+    coefs = np.zeros(shape=(len(b),len(alphas)))
+    w = np.zeros(len(b))
+    alpha_prev = None
+    for a, alpha in enumerate(alphas):
+        if screening:
+            w = lasso_gram(G, b, yy, alpha, w, max_iter, tol, alpha_prev, None if hints is None else hints[:,a])
+        else:
+            w = coordinate_descent(G, b, yy, alpha, w, max_iter, tol)
+        coefs[:,a] = w
+        alpha_prev = alpha
+    return coefs
+
+
+class GramLassoCV:
+    """LassoCV(cv=n_folds, fit_intercept=False) of the notebooks, solved on Gram statistics.
+
+    y may hold several targets (e.g. the s1, s2, s3 self dynamics against one
+    self_matrix): the library is reduced, normalized and every fold Gram formed once
+    for all of them, each target keeps its own normalization, alpha grid and
+    selected alpha. Attributes then gain a leading target axis, coef_ is
+    (n_targets, Numfunc) and support_ marks the selected terms.
+
+    With normalize=True the l1 normalization of the notebooks is applied and coef_
+    is already rescaled to the original units (coef*y_norml1/x_norml1);
+    coef_normalized_ holds the coefficients of the normalized problem. The path uses
+    strong-rule screening and active-set coordinate descent (screening=False
+    optimizes all columns at every alpha).
+    """
+    def __init__(self, cv=5, n_alphas=100, eps=1e-3, alphas=None, max_iter=1000, tol=1e-4, normalize=True, \
+            screening=True, chunk_size=2**16):
+        self.cv = cv
+        self.n_alphas = n_alphas
+        self.eps = eps
+        self.alphas = alphas
+        self.max_iter = max_iter
+        self.tol = tol
+        self.normalize = normalize
+        self.screening = screening
+        self.chunk_size = chunk_size
+
+    def fit(self, X, y, sample_weight=None):
+        return self.fit_statistics(gram_statistics(X, y, sample_weight, self.cv, self.chunk_size))
+
+    def fit_stream(self, stream, y, sample_weight=None):
+        return self.fit_statistics(stream_gram_statistics(stream, y, sample_weight, self.cv))
+
+    def fit_statistics(self, stats):
+        XtX, Xty, yty, ysum, weight = stats.normalized(self.normalize)
+        XtX_all, Xty_all, yty_all, n = XtX.sum(axis=0), Xty.sum(axis=0), yty.sum(axis=0), weight.sum()
+        m = stats.n_targets
+        if self.alphas is None:
+            alphas = np.stack([alpha_grid(Xty_all[:,t], n, self.n_alphas, self.eps) for t in range(0,m)])
+        else:
+            alphas = np.tile(np.sort(np.asarray(self.alphas, dtype=np.float64))[::-1], (m,1))
+        # the normalized full-data Gram is formed once and shared by all targets; its
+        # paths give the refit and seed the screened sets of the folds
+        G = XtX_all/n
+        paths = np.stack([lasso_path_gram(G, Xty_all[:,t]/n, yty_all[t]/n, alphas[t], self.max_iter, self.tol, \
+            self.screening) for t in range(0,m)])
+        mse_path = np.zeros(shape=(m,np.size(alphas,1),stats.n_folds))
+        for k in range(0,stats.n_folds):
+            n_train = n-weight[k]
+            G_k = (XtX_all-XtX[k])/n_train
+            for t in range(0,m):
+                b_k, yy_k = (Xty_all[:,t]-Xty[k][:,t])/n_train, (yty_all[t]-yty[k][t])/n_train
+                coefs = lasso_path_gram(G_k, b_k, yy_k, alphas[t], self.max_iter, self.tol, self.screening, \
+                    paths[t] != 0 if self.screening else None)
+                # held-out squared error from the fold sums: y'y - 2 w'X'y + w'X'X w
+                rss = yty[k][t]-2*(Xty[k][:,t] @ coefs)+np.einsum('ia,ij,ja->a', coefs, XtX[k], coefs)
+                mse_path[t,:,k] = rss/weight[k]
+        best = np.argmin(mse_path.mean(axis=2), axis=1)
+        coef = paths[np.arange(m),:,best]
+        x_scale, y_scale = stats.scales(self.normalize)
+        B = Xty_all.T/n
+        rss = yty_all/n-2*np.sum(B*coef, axis=1)+np.einsum('ti,ij,tj->t', coef, G, coef)
+        ymean = ysum.sum(axis=0)/n
+        squeeze = (lambda a: a[0]) if m == 1 else (lambda a: a)
+        self.alphas_ = squeeze(alphas)
+        self.alpha_ = squeeze(alphas[np.arange(m),best])
+        self.mse_path_ = squeeze(mse_path)
+        self.coef_normalized_ = squeeze(coef)
+        self.coef_ = squeeze(coef*x_scale[None,:]/y_scale[:,None])
+        self.support_ = self.coef_ != 0
+        self.score_ = squeeze(1-rss/(yty_all/n-ymean**2))
+        self.names_ = stats.names
+        self.target_names_ = stats.target_names
+        return self
+
+    def coefficients(self):
+        """coef_ as a Series indexed by the library names, a names x targets DataFrame for several targets."""
+        if np.ndim(self.coef_) == 1:
+            return pd.Series(self.coef_, index=self.names_)
+        return pd.DataFrame(data=self.coef_.T, index=self.names_, columns=self.target_names_)
+
+
+def stlsq_gram(G, B, thresholds, ridge=1e-5, max_iter=20):
+    """Sequentially thresholded (ridge) least squares in Gram space, for many thresholds at once.
+
+    G = X^T X/n (Numfunc, Numfunc), B = X^T y/n (Numfunc, n_targets) and thresholds
+    (n_targets, n_thresholds). Every (target, threshold) pair alternates the ridge
+    solution on its support with dropping the coefficients below its threshold; all
+    unconverged pairs are solved as one batch. Returns (n_targets, n_thresholds, Numfunc).
+    """
+    Numfunc = len(G)
+    m, T = np.shape(thresholds)
+    target = np.repeat(np.arange(m), T)
+    thresholds = np.reshape(thresholds, -1)
+    Gr = G+ridge*np.eye(Numfunc)
+    eye = np.eye(Numfunc)
+    mask = np.tile(np.diag(G) > 0, (m*T,1))
+    W = np.zeros(shape=(m*T,Numfunc))
+    todo = np.arange(m*T)
+    for it in range(0,max_iter+1):
+        support = mask[todo]
+        # masked systems: identity rows/columns outside the support
+        M = np.where(support[:,:,None] & support[:,None,:], Gr, eye)
+        rhs = np.where(support, B.T[target[todo]], 0.)
+        W[todo] = np.linalg.solve(M, rhs[:,:,None])[:,:,0]
+        if it == max_iter:
+            break
+        keep = support & (np.abs(W[todo]) >= thresholds[todo,None])
+        changed = np.any(keep != support, axis=1)
+        mask[todo] = keep
+        todo = todo[changed]
+        if len(todo) == 0:
+            break
+    W[~mask] = 0.
+    return W.reshape(m,T,Numfunc)
+
+
+class GramSTLSQ:
+    """STLSQ discovery on the normalized library with a Pareto sweep over thresholds.
+
+    All thresholds (n_thresholds, log-spaced relative to the largest ridge
+    coefficient of every target unless given) are solved in one batched call on
+    the full data and on every cross-validation fold, giving for each threshold
+    the number of terms, the training and the held-out MSE (pareto_). The model
+    is the one with the fewest terms whose held-out MSE is within tolerance of the
+    best (select='cv'), or minimizes the notebooks' AIC n*log(mse) + 2*num_params
+    (select='aic'). Attributes follow GramLassoCV.
+    """
+    def __init__(self, thresholds=None, n_thresholds=50, ridge=1e-5, max_iter=20, cv=5, select='cv', tolerance=0.05, \
+            normalize=True, chunk_size=2**16):
+        self.thresholds = thresholds
+        self.n_thresholds = n_thresholds
+        self.ridge = ridge
+        self.max_iter = max_iter
+        self.cv = cv
+        self.select = select
+        self.tolerance = tolerance
+        self.normalize = normalize
+        self.chunk_size = chunk_size
+
+    def fit(self, X, y, sample_weight=None):
+        return self.fit_statistics(gram_statistics(X, y, sample_weight, self.cv, self.chunk_size))
+
+    def fit_stream(self, stream, y, sample_weight=None):
+        return self.fit_statistics(stream_gram_statistics(stream, y, sample_weight, self.cv))
+
+    def fit_statistics(self, stats):
+        XtX, Xty, yty, ysum, weight = stats.normalized(self.normalize)
+        XtX_all, Xty_all, yty_all, n = XtX.sum(axis=0), Xty.sum(axis=0), yty.sum(axis=0), weight.sum()
+        m = stats.n_targets
+        G, B = XtX_all/n, Xty_all/n
+        if self.thresholds is None:
+            W0 = stlsq_gram(G, B, np.zeros(shape=(m,1)), self.ridge, 0)[:,0]
+            top = np.max(np.abs(W0), axis=1, keepdims=True)
+            thresholds = top*np.logspace(-4, 0, self.n_thresholds)
+        else:
+            thresholds = np.tile(np.sort(np.asarray(self.thresholds, dtype=np.float64)), (m,1))
+        W = stlsq_gram(G, B, thresholds, self.ridge, self.max_iter)
+        mse = (yty_all[:,None]-2*np.einsum('it,tai->ta', Xty_all, W)+np.einsum('tai,ij,taj->ta', W, XtX_all, W))/n
+        cv_mse = np.zeros_like(mse)
+        for k in range(0,stats.n_folds):
+            n_train = n-weight[k]
+            W_k = stlsq_gram((XtX_all-XtX[k])/n_train, (Xty_all-Xty[k])/n_train, thresholds, self.ridge, self.max_iter)
+            rss = yty[k][:,None]-2*np.einsum('it,tai->ta', Xty[k], W_k)+np.einsum('tai,ij,taj->ta', W_k, XtX[k], W_k)
+            cv_mse += rss/weight[k]/stats.n_folds
+        n_terms = np.count_nonzero(W, axis=2)
+        if self.select == 'aic':
+            best = np.argmin(n*np.log(np.maximum(mse, np.finfo(float).tiny))+2*n_terms, axis=1)
+        else:
+            # fewest terms within the tolerance of the best held-out error, ties by the error
+            eligible = cv_mse <= (1+self.tolerance)*np.min(cv_mse, axis=1, keepdims=True)
+            best = np.array([np.lexsort((cv_mse[t], np.where(eligible[t], n_terms[t], np.iinfo(np.int64).max)))[0] \
+                for t in range(0,m)])
+        x_scale, y_scale = stats.scales(self.normalize)
+        coef_path = W*x_scale[None,None,:]/y_scale[:,None,None]
+        pareto = []
+        for t in range(0,m):
+            front = pd.DataFrame(dict(threshold=thresholds[t], n_terms=n_terms[t], mse=mse[t], cv_mse=cv_mse[t]))
+            # non-dominated in (number of terms, held-out error)
+            front['pareto'] = [not np.any((n_terms[t] <= k) & (cv_mse[t] < e)) for k, e in zip(n_terms[t], cv_mse[t])]
+            pareto.append(front)
+        squeeze = (lambda a: a[0]) if m == 1 else (lambda a: a)
+        self.thresholds_ = squeeze(thresholds)
+        self.threshold_ = squeeze(thresholds[np.arange(m),best])
+        self.coef_path_ = squeeze(coef_path)
+        self.coef_normalized_ = squeeze(W[np.arange(m),best])
+        self.coef_ = squeeze(coef_path[np.arange(m),best])
+        self.support_ = self.coef_ != 0
+        self.pareto_ = squeeze(pareto)
+        self.score_ = squeeze(1-mse[np.arange(m),best]/(yty_all/n-(ysum.sum(axis=0)/n)**2))
+        self.names_ = stats.names
+        self.target_names_ = stats.target_names
+        return self
+
+    coefficients = GramLassoCV.coefficients